@@ -1,3 +1,22 @@
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from config import CLIENT_RATE_LIMIT_STORAGE
+from core.admission import AdmissionController
+from core.batch_planner import AdaptiveBatcher
+from core.batch_scheduler import BatchScheduler
+from core.key_state import build_key_state_sync
 from core.llm_client import LLM
+from core.metrics import admission_collector, key_pool_collector, registry
+from core.result_cache import build_result_cache
 
 llm = LLM()
+batch_scheduler = BatchScheduler(llm.api_key_manager)
+key_state_sync = build_key_state_sync(llm.api_key_manager)
+registry.add_gauge_collector(key_pool_collector(llm.api_key_manager))
+admission = AdmissionController(llm.api_key_manager)
+registry.add_gauge_collector(admission_collector(admission))
+limiter = Limiter(key_func=get_remote_address, storage_uri=CLIENT_RATE_LIMIT_STORAGE)
+result_cache = build_result_cache()
+transcription_batcher = AdaptiveBatcher()
+transcription_batcher.load_history()
@@ -1,35 +1,49 @@
-import io
 import logging
-from PIL import Image
 from fastapi import APIRouter, File, HTTPException, Request, UploadFile
-from config import MAX_HEIGHT, MAX_WIDTH, PROMPT_TUNISIAN_ID_BACK, PV_PATH
-from utils.prompt_utils import resize_id_card_image, save_pv
+from core.extraction import cached_side, extract_side
+from core.audit_log import audit_log
+from config import CLIENT_RATE_LIMITS
+from exceptions.admission_exceptions import AdmissionRejectedError
+from exceptions.image_exceptions import ImageTooLargeError, InvalidIDCardError, UnsupportedImageError
 from exceptions.llm_exceptions import ValidationRetryError
-from models.id_card import BackResponse, TunisianIDCardBack
-from api import llm
+from utils.upload_utils import read_image_upload
+from models.id_card import BackResponse
+from api import admission, limiter, llm, result_cache
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 @router.post("/back", response_model=BackResponse)
+@limiter.limit(CLIENT_RATE_LIMITS["back"])
 async def extract_front(request: Request, image: UploadFile = File(...)):
     logger.info("[API] /extract/back called")
-    prompt = PROMPT_TUNISIAN_ID_BACK
     try:
-        img = Image.open(io.BytesIO(await image.read()))
-        resized_img = resize_id_card_image(img,MAX_WIDTH,MAX_HEIGHT)
-        result_with_pv = await llm.generate([prompt, resized_img], TunisianIDCardBack)
-        try:
-            save_pv("tunisian_id_back", result_with_pv["pv"],save_dir=PV_PATH)
-        except Exception as e:
-            logger.warning(f"[PV] Failed to save prompt value info: {e}")
+        raw = await read_image_upload(image)
+        # A cache hit costs no model call: only misses queue for admission
+        result_with_pv = await cached_side(llm, result_cache, raw, "back")
+        if result_with_pv is None:
+            async with admission.admit("back"):
+                result_with_pv = await extract_side(llm, result_cache, raw, "back")
+        audit_log.record("tunisian_id_back", result_with_pv["pv"])
 
         return BackResponse(
             data = result_with_pv["result"],
             audit = result_with_pv["pv"]
         )
     except ValidationRetryError as e:
+        if e.pv:
+            audit_log.record("tunisian_id_back", e.pv)  # the failed attempts were paid for
         raise HTTPException(status_code=422, detail=f"Validation failed after retries: {e}")
+    except InvalidIDCardError as e:
+        if e.pv:
+            audit_log.record("tunisian_id_back", e.pv)  # the model was paid to say so
+        raise HTTPException(status_code=422, detail=f"Invalid ID card: {e}")
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=f"Image too large: {e}")
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=415, detail=str(e))
     except RuntimeError as e:
+        if getattr(e, "pv", None):
+            audit_log.record("tunisian_id_back", e.pv)
         msg = str(e).lower()
         if "quota" in msg:
             raise HTTPException(status_code=429, detail="Quota exhausted, please try again later.")
@@ -37,5 +51,7 @@ async def extract_front(request: Request, image: UploadFile = File(...)):
             raise HTTPException(status_code=500, detail="Configuration error in API keys or client.")
         else:
             raise HTTPException(status_code=503, detail="External API error, please try again later.")
+    except AdmissionRejectedError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
@@ -0,0 +1,186 @@
+import asyncio
+import json
+import logging
+import zipfile
+from typing import AsyncIterator, List
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.datastructures import UploadFile
+from config import BULK_MAX_FILES, BULK_MAX_ITEM_BYTES, CLIENT_RATE_LIMITS
+from core.bulk_pipeline import BulkPipeline
+from core.extraction import extract_card, extract_side
+from exceptions.image_exceptions import ImageTooLargeError, InvalidIDCardError, UnsupportedImageError
+from exceptions.llm_exceptions import ValidationRetryError
+from models.pv import FullPromptValue
+from core.audit_log import audit_log
+from utils.prompt_utils import finalize_merged_pv, merge_pv, new_merged_pv
+from utils.upload_utils import SNIFF_BYTES, check_image_type, read_image_upload
+from api import admission, limiter, llm, result_cache
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+bulk_pipeline = BulkPipeline(llm.api_key_manager)
+
+BULK_SIDES = ("front", "back", "both")
+
+
+class ItemTooLargeError(Exception):
+    pass
+
+
+class UnpairedImageError(Exception):
+    pass
+
+
+async def iter_uploads(uploads: List[UploadFile]) -> AsyncIterator[tuple]:
+    for upload in uploads:
+        try:
+            yield upload.filename, await read_image_upload(upload, BULK_MAX_ITEM_BYTES)
+        except (ImageTooLargeError, UnsupportedImageError) as e:
+            yield upload.filename, e
+
+
+def archive_members(zf: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    return sorted(
+        (info for info in zf.infolist() if not info.is_dir() and not info.filename.startswith("__MACOSX/")),
+        key=lambda info: info.filename
+    )
+
+
+async def iter_archive(zf: zipfile.ZipFile, members: List[zipfile.ZipInfo]) -> AsyncIterator[tuple]:
+    for info in members:
+        if info.file_size > BULK_MAX_ITEM_BYTES:
+            yield info.filename, ItemTooLargeError(f"{info.file_size} bytes exceeds {BULK_MAX_ITEM_BYTES}")
+            continue
+        raw = await asyncio.to_thread(zf.read, info)
+        try:
+            check_image_type(raw[:SNIFF_BYTES])
+        except UnsupportedImageError as e:
+            yield info.filename, e
+            continue
+        yield info.filename, raw
+
+
+async def iter_cards(files: AsyncIterator[tuple], side: str) -> AsyncIterator[dict]:
+    """Number the files as cards; for side="both" consecutive files are paired as (front, back)."""
+    index = 0
+    pending = None
+    async for filename, raw in files:
+        if side != "both":
+            yield {"index": index, "filename": filename, "raw": raw}
+            index += 1
+        elif pending is None:
+            pending = (filename, raw)
+        else:
+            yield {"index": index, "filename": [pending[0], filename], "raw": (pending[1], raw)}
+            index += 1
+            pending = None
+    if pending is not None:
+        yield {"index": index, "filename": [pending[0]], "raw": UnpairedImageError("Missing back image for the last card")}
+
+
+def describe_error(e: Exception) -> tuple:
+    if isinstance(e, ValidationRetryError):
+        return 422, f"Validation failed after retries: {e}"
+    if isinstance(e, InvalidIDCardError):
+        return 422, f"Invalid ID card: {e}"
+    if isinstance(e, (ItemTooLargeError, ImageTooLargeError)):
+        return 413, f"Image too large: {e}"
+    if isinstance(e, UnsupportedImageError):
+        return 415, str(e)
+    if isinstance(e, UnpairedImageError):
+        return 422, str(e)
+    if isinstance(e, RuntimeError):
+        msg = str(e).lower()
+        if "quota" in msg:
+            return 429, "Quota exhausted, please try again later."
+        if "configuration" in msg:
+            return 500, "Configuration error in API keys or client."
+        return 503, "External API error, please try again later."
+    return 500, f"Unexpected error: {e}"
+
+
+@router.post("/bulk")
+@limiter.limit(CLIENT_RATE_LIMITS["bulk"])
+async def extract_bulk(request: Request):
+    """
+    Multipart form:
+    - side: "front" (default), "back" or "both" (files are consumed in (front, back) pairs)
+    - images: one or more image files, or
+    - archive: a zip of images, processed in file name order
+    Streams one NDJSON line per card, in completion order.
+    """
+    logger.info("[API] /extract/bulk called")
+    # Parsed here rather than through File() params so the uploads stay open while the response streams
+    form = await request.form(max_files=BULK_MAX_FILES)
+    side = form.get("side") or "front"
+    archive = form.get("archive")
+    uploads = [value for key, value in form.multi_items() if key == "images" and isinstance(value, UploadFile)]
+
+    if side not in BULK_SIDES:
+        await form.close()
+        raise HTTPException(status_code=422, detail=f"side must be one of {', '.join(BULK_SIDES)}")
+    if not uploads and not isinstance(archive, UploadFile):
+        await form.close()
+        raise HTTPException(status_code=422, detail="Provide image files under 'images' or a zip under 'archive'")
+
+    if isinstance(archive, UploadFile):
+        try:
+            zf = await asyncio.to_thread(zipfile.ZipFile, archive.file)
+        except zipfile.BadZipFile:
+            await form.close()
+            raise HTTPException(status_code=422, detail="archive is not a valid zip file")
+        members = archive_members(zf)
+        if len(members) > BULK_MAX_FILES:
+            await form.close()
+            raise HTTPException(status_code=413, detail=f"Archive holds more than {BULK_MAX_FILES} files")
+        files = iter_archive(zf, members)
+    else:
+        files = iter_uploads(uploads)
+
+    async def handle(card: dict) -> dict:
+        if isinstance(card["raw"], Exception):
+            raise card["raw"]
+        # Bulk runs are throughput-bound: hedging would only add upstream calls, and cards
+        # queue behind interactive requests instead of being shed
+        async with admission.admit("bulk", shed=False):
+            if side == "both":
+                return await extract_card(llm, result_cache, *card["raw"], hedge=False)
+            return await extract_side(llm, result_cache, card["raw"], side, hedge=False)
+
+    async def stream():
+        merged_pv = new_merged_pv()
+        succeeded = failed = 0
+        try:
+            async for card, result_with_pv, error in bulk_pipeline.run(iter_cards(files, side), handle):
+                line = {"index": card["index"], "filename": card["filename"]}
+                if error is None:
+                    succeeded += 1
+                    merge_pv(merged_pv, result_with_pv["pv"])
+                    result = result_with_pv["result"]
+                    line["status"] = "ok"
+                    if isinstance(result, dict):
+                        line["data"] = {k: v.model_dump() for k, v in result.items()}
+                    else:
+                        line["data"] = result.model_dump()
+                    line["audit"] = FullPromptValue(**result_with_pv["pv"]).model_dump()
+                else:
+                    failed += 1
+                    if getattr(error, "pv", None):
+                        merge_pv(merged_pv, error.pv)  # failed cards' calls were paid for too
+                    line["status"] = "error"
+                    line["status_code"], line["error"] = describe_error(error)
+                    logger.warning(f"[BULK] Card {card['index']} failed: {error}")
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"[BULK] Stream aborted: {e}")
+            status_code, detail = describe_error(e)
+            yield json.dumps({"status": "aborted", "status_code": status_code, "error": detail}, ensure_ascii=False) + "\n"
+        finally:
+            await form.close()
+            finalize_merged_pv(merged_pv)
+            logger.info(f"[BULK] Finished: {succeeded} ok, {failed} failed")
+            audit_log.record("tunisian_id_bulk", merged_pv)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,58 @@
+import logging
+from fastapi import APIRouter, File, HTTPException, Request, UploadFile
+from core.extraction import cached_card, extract_card
+from core.audit_log import audit_log
+from config import CLIENT_RATE_LIMITS
+from exceptions.admission_exceptions import AdmissionRejectedError
+from exceptions.image_exceptions import ImageTooLargeError, InvalidIDCardError, UnsupportedImageError
+from exceptions.llm_exceptions import ValidationRetryError
+from utils.upload_utils import read_image_upload
+from models.id_card import CardResponse
+from api import admission, limiter, llm, result_cache
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+@router.post("/card", response_model=CardResponse)
+@limiter.limit(CLIENT_RATE_LIMITS["card"])
+async def extract_full_card(request: Request, front: UploadFile = File(...), back: UploadFile = File(...)):
+    logger.info("[API] /extract/card called")
+    try:
+        raw_front, raw_back = await read_image_upload(front), await read_image_upload(back)
+        # A card with both sides cached costs no model call: only misses queue for admission
+        result_with_pv = await cached_card(llm, result_cache, raw_front, raw_back)
+        if result_with_pv is None:
+            async with admission.admit("card"):
+                result_with_pv = await extract_card(llm, result_cache, raw_front, raw_back)
+        audit_log.record("tunisian_id_card", result_with_pv["pv"])
+
+        return CardResponse(
+            front = result_with_pv["result"]["front"],
+            back = result_with_pv["result"]["back"],
+            audit = result_with_pv["pv"]
+        )
+    except ValidationRetryError as e:
+        if e.pv:
+            audit_log.record("tunisian_id_card", e.pv)  # the failed attempts were paid for
+        raise HTTPException(status_code=422, detail=f"Validation failed after retries: {e}")
+    except InvalidIDCardError as e:
+        if e.pv:
+            audit_log.record("tunisian_id_card", e.pv)  # the model was paid to say so
+        raise HTTPException(status_code=422, detail=f"Invalid ID card: {e}")
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=413, detail=f"Image too large: {e}")
+    except UnsupportedImageError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except RuntimeError as e:
+        if getattr(e, "pv", None):
+            audit_log.record("tunisian_id_card", e.pv)
+        msg = str(e).lower()
+        if "quota" in msg:
+            raise HTTPException(status_code=429, detail="Quota exhausted, please try again later.")
+        elif "configuration" in msg:
+            raise HTTPException(status_code=500, detail="Configuration error in API keys or client.")
+        else:
+            raise HTTPException(status_code=503, detail="External API error, please try again later.")
+    except AdmissionRejectedError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Unexpected error: {e}")
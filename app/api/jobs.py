@@ -0,0 +1,81 @@
+import asyncio
+import json
+import logging
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from api import admission, limiter, llm, transcription_batcher
+from config import CLIENT_RATE_LIMITS, JOB_POLL_INTERVAL
+from core.job_store import JOB_COMPLETED, JOB_FAILED, JobStore
+from core.job_worker import JobWorker, merged_job_pv
+from models.job import JobStatusResponse, JobSubmitResponse
+from models.transcription import TranscriptionRequest
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+job_store = JobStore()
+job_worker = JobWorker(llm, job_store, batcher=transcription_batcher, admission=admission)
+
+
+async def load_job(job_id: str, with_results: bool = True) -> dict:
+    job = await asyncio.to_thread(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    if with_results:
+        pvs = await asyncio.to_thread(job_store.get_batch_pvs, job_id)
+        job["pv"] = merged_job_pv(job, pvs)
+        if job["status"] == JOB_COMPLETED:
+            outputs = await asyncio.to_thread(job_store.get_batch_outputs, job_id)
+            job["results"] = [item for output in outputs for item in output["result"]]
+    return job
+
+
+@router.post("/transcript/jobs", response_model=JobSubmitResponse, status_code=202)
+@limiter.limit(CLIENT_RATE_LIMITS["jobs"])
+async def submit_transcription_job(request: Request, data: list[TranscriptionRequest]):
+    logger.info("[API] /transcript/jobs called")
+    if not data:
+        raise HTTPException(status_code=422, detail="Empty transcription list")
+    batches = transcription_batcher.plan([item.dict() for item in data])
+    job_id = await asyncio.to_thread(job_store.create_job, batches)
+    logger.info(f"[JOB {job_id[:8]}] Queued {len(data)} item(s) in {len(batches)} batch(es)")
+    return JobSubmitResponse(job_id=job_id, status="queued", total_batches=len(batches), total_items=len(data))
+
+
+@router.get("/transcript/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_transcription_job(job_id: str):
+    """Job progress; `results` is filled once every batch is done, `pv` covers every call made so far, failed attempts included."""
+    return JobStatusResponse(**await load_job(job_id))
+
+
+@router.post("/transcript/jobs/{job_id}/retry", response_model=JobStatusResponse)
+async def retry_transcription_job(job_id: str):
+    """Re-queue failed batches; finished batches are kept, so the job resumes where it stopped."""
+    await load_job(job_id, with_results=False)
+    requeued = await asyncio.to_thread(job_store.retry_failed, job_id)
+    logger.info(f"[JOB {job_id[:8]}] Re-queued {requeued} failed batch(es)")
+    return JobStatusResponse(**await load_job(job_id))
+
+
+@router.get("/transcript/jobs/{job_id}/events")
+async def stream_transcription_job(job_id: str):
+    """NDJSON progress stream: one line per change, ending with the final status (results included)."""
+    job = await load_job(job_id, with_results=False)
+
+    async def stream():
+        last = None
+        current = job
+        while True:
+            progress = (current["status"], current["done_batches"], current["failed_batches"])
+            terminal = current["status"] in (JOB_COMPLETED, JOB_FAILED)
+            if terminal:
+                final = JobStatusResponse(**await load_job(job_id))
+                yield final.model_dump_json() + "\n"
+                return
+            if progress != last:
+                last = progress
+                yield json.dumps({k: current[k] for k in ("job_id", "status", "total_batches", "done_batches", "failed_batches")}) + "\n"
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            current = await load_job(job_id, with_results=False)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -1,8 +1,11 @@
 from fastapi import APIRouter
 
-from api import transcript, extract_front, extract_back
+from api import transcript, extract_front, extract_back, extract_card, extract_bulk, jobs
 
 router = APIRouter()
 router.include_router(transcript.router)
+router.include_router(jobs.router)
 router.include_router(extract_front.router)
 router.include_router(extract_back.router)
+router.include_router(extract_card.router)
+router.include_router(extract_bulk.router)
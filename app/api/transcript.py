@@ -1,55 +1,35 @@
-import json
 import logging
-import time
 from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import JSONResponse
-from api import llm
+from api import admission, batch_scheduler, limiter, llm, transcription_batcher
+from config import CLIENT_RATE_LIMITS
 from models.pv import FullPromptValue
-from config import MAX_BATCH_SIZE, PROMPT_TRANSCRIPTION
+from core.transcription import transcribe_batch
 from exceptions.llm_exceptions import ValidationRetryError
-from models.id_card import TranscriptResponse, TunisianIDCardData
+from models.id_card import TranscriptResponse
 from models.transcription import TranscriptionRequest
-from utils.prompt_utils import save_pv, split_batches
+from core.audit_log import audit_log
+from utils.prompt_utils import finalize_merged_pv, merge_pv, new_merged_pv
 
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 @router.post("/transcript", response_model=TranscriptResponse)
+@limiter.limit(CLIENT_RATE_LIMITS["transcript"])
 async def process_id_card_list(request: Request, data: list[TranscriptionRequest]):
     logger.info("[API] /transcript called")
     input_dicts = [item.dict() for item in data]
-    batches = split_batches(input_dicts, MAX_BATCH_SIZE)
+    batches = transcription_batcher.plan(input_dicts)
     logger.info(f"[INFO] Split input into {len(batches)} batch(es)")
 
-    results = []
-    merged_pv = {
-        "total_api_calls": 0,
-        "total_input_tokens": 0,
-        "total_output_tokens": 0,
-        "attempts": [],
-        "keys_used": set(),
-        "start_time": time.time(),
-    }
-
-    for batch_index, batch in enumerate(batches):
+    merged_pv = new_merged_pv()
+
+    async def process_batch(batch_index: int, batch: list[dict]) -> dict:
         logger.info(f"[BATCH {batch_index}] Processing batch with {len(batch)} item(s)")
-        prompt = PROMPT_TRANSCRIPTION + json.dumps(batch, ensure_ascii=False, indent=2)
 
         try:
-            response_with_pv = await llm.generate([prompt], output_model=TunisianIDCardData)
-            parsed = response_with_pv["result"]
-            pv = response_with_pv["pv"]
-
-            merged_pv["total_api_calls"] += pv.get("total_api_calls", 0)
-            merged_pv["total_input_tokens"] += pv.get("total_input_tokens", 0)
-            merged_pv["total_output_tokens"] += pv.get("total_output_tokens", 0)
-            merged_pv["attempts"].extend(pv.get("attempts", []))
-            merged_pv["keys_used"].update(pv.get("keys_used", []))
-
-            parsed_items = parsed if isinstance(parsed, list) else [parsed]
-            results.extend(parsed_items)
-            logger.info(f"[BATCH {batch_index}] Batch validated and added to results")
+            return await transcribe_batch(llm, batch, transcription_batcher)
 
         except ValidationRetryError as ve:
             logger.error(f"[BATCH {batch_index}] Validation failed after retries: {ve}")
@@ -68,13 +48,20 @@ async def process_id_card_list(request: Request, data: list[TranscriptionRequest
             logger.error(f"[BATCH {batch_index}] Unexpected error: {e}")
             raise HTTPException(status_code=500, detail=f"Error processing batch: {e}")
 
-    merged_pv["keys_used"] = list(merged_pv["keys_used"])
-    merged_pv["duration_total"] = time.time() - merged_pv["start_time"]
+    def on_batch_done(batch_index: int, response_with_pv: dict):
+        merge_pv(merged_pv, response_with_pv["pv"])
+        logger.info(f"[BATCH {batch_index}] Batch validated and added to results")
+
+    async with admission.admit("transcript"):
+        batch_results = await batch_scheduler.run(batches, process_batch, on_result=on_batch_done)
+
+    results = []
+    for response_with_pv in batch_results:
+        results.extend(response_with_pv["result"])
+
+    finalize_merged_pv(merged_pv)
 
-    try:
-        save_pv(indicator_name="id_card_transcription", pv=merged_pv)
-    except Exception as e:
-        logger.warning(f"[PV] Failed to save prompt value info: {e}")
+    audit_log.record("id_card_transcription", merged_pv)
 
     logger.info(f"[RESULT] Total valid items: {len(results)}")
 
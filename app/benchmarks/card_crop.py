@@ -0,0 +1,185 @@
+"""
+Card crop versus full frame. Reports:
+- estimated image tokens per call (utils.client_utils.calculate_image_tokens) and how
+  many of the model input pixels show the card, on synthetic phone photos (a card rotated
+  and placed on a textured table) with known corners; detection rate, IoU of the detected
+  card and the preprocessing time;
+- with --dataset, the extraction accuracy change on a local labelled sample set: the real
+  model is called once per image and variant, so GOOGLE_API_KEY_* must be set. Layout:
+  DIR/front/*.jpg and DIR/back/*.jpg, each with a .json of the expected fields next to it.
+Run from the app directory:
+
+    python -m benchmarks.card_crop --images 40
+    python -m benchmarks.card_crop --dataset ~/id-samples
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import random
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from benchmarks.common import percentile
+from benchmarks.prescreen_eval import synthetic_card
+from config import MAX_HEIGHT, MAX_WIDTH
+from core.card_crop import CardCropper
+from core.image_pipeline import decode_and_resize
+from utils.client_utils import calculate_image_tokens
+
+FRAME = (4032, 3024)
+MASK_SCALE = 8  # polygons are rasterised at 1/8 of the frame for IoU
+
+
+def table(rng: random.Random, size: Tuple[int, int]) -> Image.Image:
+    """Wood-ish background: a base colour with a low-frequency shade and fine grain."""
+    base = np.array([rng.randint(90, 170), rng.randint(60, 120), rng.randint(30, 90)], dtype=np.float32)
+    shade = np.asarray(Image.linear_gradient("L").rotate(rng.uniform(0, 360)).resize(size), dtype=np.float32) / 255
+    grain = np.asarray(Image.effect_noise(size, 18), dtype=np.float32) - 128
+    rgb = base[None, None, :] * (0.75 + 0.4 * shade[..., None]) + grain[..., None] * 0.5
+    return Image.fromarray(np.clip(rgb, 0, 255).astype(np.uint8))
+
+
+def scene(rng: random.Random) -> Tuple[bytes, np.ndarray]:
+    """JPEG of a card on a table and the card's corners in the frame."""
+    card = synthetic_card(rng)
+    width = int(FRAME[0] * rng.uniform(0.35, 0.7))
+    card = card.resize((width, round(width / 1.586)), Image.LANCZOS)
+    angle = rng.uniform(-12, 12)
+    rotated = card.rotate(angle, resample=Image.BICUBIC, expand=True)
+    mask = Image.new("L", card.size, 255).rotate(angle, resample=Image.BICUBIC, expand=True)
+    x = rng.randint(0, FRAME[0] - rotated.width)
+    y = rng.randint(0, FRAME[1] - rotated.height)
+    frame = table(rng, FRAME)
+    frame.paste(rotated, (x, y), mask)
+
+    # Corners of the card in the frame: rotate about the card centre (PIL rotates counter-clockwise)
+    half = np.array(card.size) / 2
+    local = np.array([(-1, -1), (-1, 1), (1, 1), (1, -1)]) * half
+    theta = math.radians(angle)
+    rot = np.array([[math.cos(theta), math.sin(theta)], [-math.sin(theta), math.cos(theta)]])
+    corners = local @ rot.T + np.array([x, y]) + np.array(rotated.size) / 2
+
+    buffer = io.BytesIO()
+    frame.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue(), corners
+
+
+def polygon_mask(corners: np.ndarray) -> np.ndarray:
+    canvas = Image.new("1", (FRAME[0] // MASK_SCALE, FRAME[1] // MASK_SCALE))
+    ImageDraw.Draw(canvas).polygon([tuple(p) for p in (corners / MASK_SCALE).tolist()], fill=1)
+    return np.asarray(canvas)
+
+
+def synthetic_report(images: int, seed: int):
+    rng = random.Random(seed)
+    cropper = CardCropper()
+    rows: Dict[str, Dict[str, List[float]]] = {"full frame": {}, "card crop": {}}
+    ious, detected = [], 0
+
+    for _ in range(images):
+        raw, truth = scene(rng)
+        truth_mask = polygon_mask(truth)
+
+        start = time.perf_counter()
+        full = decode_and_resize(raw)
+        full_time = time.perf_counter() - start
+        start = time.perf_counter()
+        cropped = decode_and_resize(raw, cropper=cropper)
+        crop_time = time.perf_counter() - start
+
+        # Corners again (cheap) to score the detection against the truth
+        source = Image.open(io.BytesIO(raw))
+        scale = min(MAX_WIDTH / source.width, MAX_HEIGHT / source.height) * 2.5
+        source.draft("RGB", (int(source.width * scale), int(source.height * scale)))
+        corners = cropper.find_card(source)
+        card_share_full = truth_mask.mean()
+        if corners is not None:
+            detected += 1
+            found_mask = polygon_mask(corners * (FRAME[0] / source.width))
+            inter = np.logical_and(found_mask, truth_mask).sum()
+            ious.append(inter / np.logical_or(found_mask, truth_mask).sum())
+            card_share_crop = inter / max(1, found_mask.sum())
+        else:
+            card_share_crop = card_share_full
+
+        for label, img, seconds, share in (("full frame", full, full_time, card_share_full),
+                                           ("card crop", cropped, crop_time, card_share_crop)):
+            row = rows[label]
+            row.setdefault("tokens", []).append(calculate_image_tokens(img))
+            row.setdefault("card_pixels", []).append(share * img.width * img.height)
+            row.setdefault("seconds", []).append(seconds)
+
+    print(f"{images} synthetic {FRAME[0]}x{FRAME[1]} photos, card on 35-70% of the width, rotated up to 12 degrees")
+    print(f"detected {detected}/{images}, IoU p5={percentile(ious, 5):.3f} p50={percentile(ious, 50):.3f}")
+    for label, row in rows.items():
+        print(f"{label:<11} tokens/image={np.mean(row['tokens']):6.1f}  "
+              f"card pixels in model input p50={percentile(row['card_pixels'], 50):9.0f}  "
+              f"preprocess p50={percentile(row['seconds'], 50) * 1000:7.1f}ms p99={percentile(row['seconds'], 99) * 1000:7.1f}ms")
+
+    print("\ntokens of a card crop by output width (Gemini bills 258 per image up to 384x384, then 258 per 768x768 tile):")
+    for width in (384, 512, 768, 1024):
+        img = Image.new("RGB", (width, round(width / 1.586)))
+        print(f"  {img.width}x{img.height}: {calculate_image_tokens(img)}")
+
+
+def load_dataset(root: str) -> List[Tuple[str, str, bytes, dict]]:
+    samples = []
+    for side in ("front", "back"):
+        directory = os.path.join(root, side)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            stem, ext = os.path.splitext(name)
+            truth_path = os.path.join(directory, stem + ".json")
+            if ext.lower() in (".jpg", ".jpeg", ".png", ".webp") and os.path.exists(truth_path):
+                with open(os.path.join(directory, name), "rb") as f, open(truth_path, encoding="utf-8") as t:
+                    samples.append((side, name, f.read(), json.load(t)))
+    return samples
+
+
+async def accuracy_report(root: str):
+    from core.extraction import CARD_SIDES
+    from core.llm_client import LLM
+
+    samples = load_dataset(root)
+    if not samples:
+        print(f"No labelled images under {root}/front or {root}/back")
+        return
+    llm = LLM()
+    cropper = CardCropper()
+    for label, crop in (("full frame", None), ("card crop", cropper)):
+        fields = correct = failed = tokens = 0
+        for side, name, raw, truth in samples:
+            spec = CARD_SIDES[side]
+            img = await asyncio.to_thread(decode_and_resize, raw, cropper=crop)
+            try:
+                result_with_pv = await llm.generate([spec.prompt, img], spec.output_model)
+            except Exception as e:
+                print(f"  {label}: {side}/{name} failed: {e}")
+                failed += 1
+                fields += len(truth)
+                continue
+            tokens += result_with_pv["pv"]["total_input_tokens"]
+            answer = result_with_pv["result"].model_dump()
+            fields += len(truth)
+            correct += sum(1 for key, value in truth.items() if str(answer.get(key, "")).strip() == str(value).strip())
+        print(f"{label:<11} field accuracy={correct / fields if fields else 0:.3f} ({correct}/{fields})  "
+              f"failed={failed}/{len(samples)}  input tokens={tokens}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=40, help="synthetic photos")
+    parser.add_argument("--seed", type=int, default=11)
+    parser.add_argument("--dataset", help="labelled sample set, see above")
+    args = parser.parse_args()
+    if args.dataset:
+        asyncio.run(accuracy_report(args.dataset))
+    else:
+        synthetic_report(args.images, args.seed)
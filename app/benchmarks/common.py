@@ -0,0 +1,26 @@
+import os
+import statistics
+from typing import List
+
+
+def install_fake_keys(count: int = 4):
+    """Expose `count` placeholder GOOGLE_API_KEY_i variables so LLM/APIKeyManager can start offline."""
+    for i in range(1, count + 1):
+        os.environ.setdefault(f"GOOGLE_API_KEY_{i}", f"fake-key-{i:04d}-offline")
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(label: str, samples: List[float], unit: str = "ms", scale: float = 1000.0) -> str:
+    return (
+        f"{label:<28} n={len(samples):<6} "
+        f"p50={percentile(samples, 50) * scale:8.3f}{unit} "
+        f"p99={percentile(samples, 99) * scale:8.3f}{unit} "
+        f"mean={statistics.fmean(samples) * scale if samples else 0.0:8.3f}{unit}"
+    )
@@ -0,0 +1,313 @@
+"""
+Offline stand-in for the Gemini API.
+
+`FakeSessionPool` hands out `FakeGeminiSession` objects that mimic the two SDK
+entry points the transports use (`generate_content` and `generate_content_async`).
+Plug it under a real transport to benchmark `LLM` without network or keys:
+
+    sessions = FakeSessionPool(latency=0.2)
+    llm = LLM(transport=AsyncTransport(sessions))
+
+`ReplayBackend` is the fuller fake behind `ReplaySessionPool`: it answers each prompt
+kind (front, back, card, transcript) from a recording made with LLM_RECORD_PATH, or
+synthesises a valid answer; samples latencies from a distribution (or the recorded
+durations); injects 429s, 5xx, timeouts and unusable answers at given rates; and
+enforces per-key RPM/TPM quotas with the same ResourceExhausted messages as the API:
+
+    backend = ReplayBackend(Recording.load("answers.jsonl"), latency=LatencyModel.parse("lognormal:1.2,0.4"),
+                            faults=Faults(rate_429=0.02), key_rpm=15)
+    llm = LLM(transport=AsyncTransport(ReplaySessionPool(backend)))
+"""
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
+
+from config import PROMPT_TRANSCRIPTION
+from core.transport import prompt_id, prompt_kind
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeGeminiSession:
+    def __init__(self, latency: float, jitter: float, text: str, tail_share: float = 0.0, tail_latency: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.text = text
+        self.tail_share = tail_share
+        self.tail_latency = tail_latency
+
+    def _delay(self) -> float:
+        if self.tail_share and random.random() < self.tail_share:
+            return self.tail_latency
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def generate_content(self, prompt, **kwargs):
+        time.sleep(self._delay())
+        return FakeResponse(self.text)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        await asyncio.sleep(self._delay())
+        return FakeResponse(self.text)
+
+
+class FakeSessionPool:
+    """
+    Drop-in for `core.session_pool.SessionPool` that never leaves the process.
+    A `tail_share` of the calls take `tail_latency` instead, to model a slow tail.
+    """
+
+    def __init__(self,
+                 latency: float = 0.2,
+                 jitter: float = 0.0,
+                 text: str = '```json\n{"ok": true}\n```',
+                 tail_share: float = 0.0,
+                 tail_latency: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.text = text
+        self.tail_share = tail_share
+        self.tail_latency = tail_latency
+        self._sessions = {}
+
+    def get(self, key: str) -> FakeGeminiSession:
+        if key not in self._sessions:
+            self._sessions[key] = FakeGeminiSession(self.latency, self.jitter, self.text, self.tail_share, self.tail_latency)
+        return self._sessions[key]
+
+    def get_async(self, key: str) -> FakeGeminiSession:
+        return self.get(key)
+
+    def invalidate(self, key: str):
+        self._sessions.pop(key, None)
+
+    def on_key_event(self, event: str, key: str):
+        self.invalidate(key)
+
+
+FRONT_ANSWER = {"idNumber": "08123456", "lastName": "بن علي", "firstName": "محمد", "fatherFullName": "صالح بن أحمد",
+                "dateOfBirth": "1990-01-15", "placeOfBirth": "تونس"}
+BACK_ANSWER = {"motherFullName": "فاطمة بنت علي", "job": "تلميذ", "address": "10 نهج 9 أفريل أريانة",
+               "dateOfCreation": "2015-06-01"}
+
+
+class LatencyModel:
+    """
+    Seconds per call. Specs: fixed:S, uniform:LO,HI, lognormal:MEDIAN,SIGMA, exp:MEAN, or
+    recorded (the duration stored with the replayed answer, fixed:0.2 for synthetic ones).
+    """
+
+    def __init__(self, kind: str = "fixed", params: Tuple[float, ...] = (0.2,), rng: Optional[random.Random] = None):
+        self.kind = kind
+        self.params = params
+        self.rng = rng or random.Random()
+
+    @classmethod
+    def parse(cls, spec: str, rng: Optional[random.Random] = None) -> "LatencyModel":
+        kind, _, args = spec.partition(":")
+        params = tuple(float(a) for a in args.split(",")) if args else ()
+        expected = {"fixed": 1, "uniform": 2, "lognormal": 2, "exp": 1, "recorded": 0}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"Bad latency spec '{spec}', expected e.g. fixed:0.2, uniform:0.1,0.3, "
+                             f"lognormal:1.2,0.4, exp:0.8 or recorded")
+        return cls(kind, params, rng)
+
+    def sample(self, recorded: Optional[float] = None) -> float:
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self.rng.uniform(*self.params)
+        if self.kind == "lognormal":
+            return self.rng.lognormvariate(math.log(self.params[0]), self.params[1])
+        if self.kind == "exp":
+            return self.rng.expovariate(1 / self.params[0])
+        return recorded if recorded is not None else 0.2
+
+
+@dataclass
+class Faults:
+    """Per-call probabilities of each injected failure."""
+    rate_429: float = 0.0        # ResourceExhausted on top of the per-key quotas
+    rate_5xx: float = 0.0        # ServiceUnavailable / InternalServerError
+    rate_timeout: float = 0.0    # DeadlineExceeded after `timeout` seconds
+    rate_bad_answer: float = 0.0  # a text answer with no usable JSON
+    timeout: float = 10.0
+
+
+class Recording:
+    """Answers captured by core.transport.RecordingTransport, indexed by prompt id and by prompt kind."""
+
+    def __init__(self, entries: List[dict]):
+        self.by_prompt: Dict[str, List[dict]] = defaultdict(list)
+        self.by_kind: Dict[str, List[dict]] = defaultdict(list)
+        for entry in entries:
+            if entry.get("text") is None:
+                continue  # failed calls are injected from Faults instead
+            self.by_prompt[entry["prompt_id"]].append(entry)
+            self.by_kind[entry["kind"]].append(entry)
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path, encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    def __len__(self) -> int:
+        return sum(len(entries) for entries in self.by_kind.values())
+
+
+def synthetic_answer(kind: str, prompt: Any, structured: bool) -> str:
+    """A valid answer for the prompt kind; transcription echoes the input records, which are already Latin."""
+    if kind == "front":
+        answer = FRONT_ANSWER
+    elif kind == "back":
+        answer = BACK_ANSWER
+    elif kind == "card":
+        answer = {"front": FRONT_ANSWER, "back": BACK_ANSWER}
+    elif kind == "transcript":
+        text = prompt if isinstance(prompt, str) else next(p for p in prompt if isinstance(p, str))
+        answer = json.loads(text[len(PROMPT_TRANSCRIPTION):])
+    else:
+        answer = {"ok": True}
+    body = json.dumps(answer, ensure_ascii=False, indent=2)
+    return body if structured else f"```json\n{body}\n```"
+
+
+def estimate_tokens(prompt: Any) -> float:
+    """Input tokens as the quota counts them, roughly: words of text, 258 per image."""
+    tokens = 0.0
+    for part in ([prompt] if isinstance(prompt, str) else prompt):
+        tokens += len(part.split()) * 1.33 if isinstance(part, str) else 258
+    return tokens
+
+
+class ReplayBackend:
+    """One fake Gemini shared by all keys, so per-key quotas and call counters see the whole load."""
+
+    def __init__(self,
+                 recording: Optional[Recording] = None,
+                 latency: Optional[LatencyModel] = None,
+                 faults: Optional[Faults] = None,
+                 key_rpm: int = 0,
+                 key_tpm: int = 0,
+                 seed: Optional[int] = None):
+        self.recording = recording or Recording([])
+        self.rng = random.Random(seed)
+        self.latency = latency or LatencyModel(rng=self.rng)
+        self.faults = faults or Faults()
+        self.key_rpm = key_rpm
+        self.key_tpm = key_tpm
+        self.outcomes: Counter = Counter()
+        self.calls_by_key: Counter = Counter()
+        self._windows: Dict[str, Deque[Tuple[float, float]]] = defaultdict(deque)
+        self._replay_index: Counter = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self) -> int:
+        return sum(self.outcomes.values())
+
+    def _check_quota(self, key: str, tokens: float, now: float):
+        """Sliding 60 s window of (time, tokens) per key, like the API's per-minute quotas."""
+        window = self._windows[key]
+        while window and window[0][0] <= now - 60:
+            window.popleft()
+        retry_in = 60 - (now - window[0][0]) if window else 0.0
+        if self.key_rpm and len(window) >= self.key_rpm:
+            raise ResourceExhausted(f"You exceeded your current quota: GenerateRequestsPerMinutePerProjectPerModel "
+                                    f"(requests per minute). Please retry in {retry_in:.1f}s.")
+        if self.key_tpm and sum(t for _, t in window) + tokens > self.key_tpm:
+            raise ResourceExhausted(f"You exceeded your current quota: GenerateContentInputTokensPerModelPerMinute "
+                                    f"(input tokens per minute). Please retry in {retry_in:.1f}s.")
+        window.append((now, tokens))
+
+    def _answer(self, kind: str, prompt: Any, structured: bool) -> Tuple[str, Optional[float]]:
+        """(text, recorded duration): the recorded answer to this exact prompt, else one of its kind
+        (not for transcription, whose answer must match the input records), else a synthetic one."""
+        entries = self.recording.by_prompt.get(prompt_id(prompt))
+        if not entries and kind != "transcript":
+            entries = self.recording.by_kind.get(kind)
+        if entries:
+            index = self._replay_index[kind]
+            self._replay_index[kind] += 1
+            entry = entries[index % len(entries)]
+            return entry["text"], entry.get("duration")
+        return synthetic_answer(kind, prompt, structured), None
+
+    def plan(self, key: str, prompt: Any, generation_config: Optional[dict]) -> Tuple[float, Any]:
+        """(delay, FakeResponse or exception to raise after it) for one call."""
+        kind = prompt_kind(prompt)
+        structured = bool(generation_config)
+        with self._lock:
+            self.calls_by_key[key] += 1
+            try:
+                self._check_quota(key, estimate_tokens(prompt), time.monotonic())
+            except ResourceExhausted as e:
+                self.outcomes["quota_429"] += 1
+                return 0.05, e
+            text, recorded = self._answer(kind, prompt, structured)
+            roll = self.rng.random()
+            faults = self.faults
+            if roll < faults.rate_429:
+                self.outcomes["injected_429"] += 1
+                return 0.05, ResourceExhausted("Resource has been exhausted (e.g. check quota). Please retry in 5s.")
+            roll -= faults.rate_429
+            if roll < faults.rate_5xx:
+                self.outcomes["injected_5xx"] += 1
+                error = ServiceUnavailable("The model is overloaded.") if self.rng.random() < 0.5 \
+                    else InternalServerError("An internal error has occurred.")
+                return self.latency.sample(recorded) / 2, error
+            roll -= faults.rate_5xx
+            if roll < faults.rate_timeout:
+                self.outcomes["injected_timeout"] += 1
+                return faults.timeout, DeadlineExceeded("Deadline Exceeded")
+            roll -= faults.rate_timeout
+            if roll < faults.rate_bad_answer:
+                self.outcomes["injected_bad_answer"] += 1
+                return self.latency.sample(recorded), FakeResponse("I am unable to read the card in this image.")
+            self.outcomes["answered"] += 1
+            return self.latency.sample(recorded), FakeResponse(text)
+
+
+class ReplaySession:
+    """Per-key handle with the SDK's two entry points; all state lives in the shared backend."""
+
+    def __init__(self, backend: ReplayBackend, key: str):
+        self.backend = backend
+        self.key = key
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        delay, result = self.backend.plan(self.key, prompt, generation_config)
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def generate_content_async(self, prompt, generation_config=None, **kwargs):
+        delay, result = self.backend.plan(self.key, prompt, generation_config)
+        await asyncio.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+class ReplaySessionPool(FakeSessionPool):
+    """Drop-in for `core.session_pool.SessionPool` backed by a `ReplayBackend`."""
+
+    def __init__(self, backend: ReplayBackend):
+        super().__init__()
+        self.backend = backend
+
+    def get(self, key: str) -> ReplaySession:
+        if key not in self._sessions:
+            self._sessions[key] = ReplaySession(self.backend, key)
+        return self._sessions[key]
@@ -0,0 +1,69 @@
+"""
+Tail latency of LLM.generate with and without hedging, against the offline fake
+backend with a slow tail (a share of the calls take much longer). Reports latency
+percentiles and upstream calls per request. Run from the app directory:
+
+    python -m benchmarks.hedging --requests 2000 --concurrency 16 --tail-share 0.05 --tail-latency 3
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from pydantic import BaseModel
+
+from benchmarks.common import install_fake_keys, percentile
+
+install_fake_keys(16)
+
+from benchmarks.fake_gemini import FakeSessionPool  # noqa: E402
+from core.llm_client import LLM  # noqa: E402
+from core.transport import AsyncTransport  # noqa: E402
+
+
+class Echo(BaseModel):
+    ok: bool
+
+
+async def drive(llm: LLM, requests: int, concurrency: int, hedge: bool):
+    latencies = []
+    calls = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        nonlocal calls
+        async with semaphore:
+            start = time.perf_counter()
+            result = await llm.generate([f"benchmark prompt {i}"], Echo, hedge=hedge)
+            latencies.append(time.perf_counter() - start)
+            calls += result["pv"]["total_api_calls"]
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies, calls
+
+
+async def main(requests: int, concurrency: int, latency: float, jitter: float, tail_share: float, tail_latency: float):
+    sessions = FakeSessionPool(latency=latency, jitter=jitter, tail_share=tail_share, tail_latency=tail_latency)
+    for hedge in (False, True):
+        llm = LLM(transport=AsyncTransport(sessions))
+        llm.api_key_manager.set_rate_limits(0, 0)  # fake keys have no quota
+        await drive(llm, 200, concurrency, hedge)  # warm-up fills the latency window
+        latencies, calls = await drive(llm, requests, concurrency, hedge)
+        delay = llm.hedge_policy.delay("Echo")
+        print(f"hedge={'on ' if hedge else 'off'} delay={delay if hedge else 0:.2f}s "
+              f"p50={percentile(latencies, 50) * 1000:7.1f}ms p95={percentile(latencies, 95) * 1000:7.1f}ms "
+              f"p99={percentile(latencies, 99) * 1000:7.1f}ms max={max(latencies) * 1000:7.1f}ms "
+              f"calls/request={calls / requests:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tail-share", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=3.0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)  # per-call key lines would dominate the measurement
+    asyncio.run(main(args.requests, args.concurrency, args.latency, args.jitter, args.tail_share, args.tail_latency))
@@ -0,0 +1,128 @@
+"""
+Image handoff to the model: the old path, a resized PIL image that the SDK converts to
+lossless WebP inside every generate_content call (on the event loop), against the
+EncodedImage path (core.image_pipeline.prepare_payload): compliant uploads forwarded
+as they are, everything else encoded once in the preprocessing worker. Reports per
+upload kind the CPU time per request, split into worker and event loop, and the payload
+bytes sent upstream per call; then bytes, encode time and PSNR of the re-encode per
+format and quality, to tune IMAGE_ENCODE_FORMAT / IMAGE_ENCODE_QUALITY. Run from the
+app directory:
+
+    python -m benchmarks.image_handoff --images 20
+"""
+import argparse
+import io
+import random
+import time
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+from google.generativeai.types import content_types
+from PIL import Image
+
+from benchmarks.card_crop import scene
+from benchmarks.common import percentile
+from benchmarks.prescreen_eval import synthetic_card
+from config import MAX_HEIGHT, MAX_WIDTH
+from core.card_crop import CardCropper
+from core.image_pipeline import decode_and_resize, encode_image, prepare_payload
+from core.prescreen import ImagePrescreener
+
+PROMPT = "Extract the front side of this ID card as JSON."
+
+
+def encode(img: Image.Image, fmt: str, **params) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def uploads(rng: random.Random, images: int) -> Dict[str, List[bytes]]:
+    """Upload kinds: a compact JPEG already at the model size, a phone photo, a PNG scan."""
+    kinds: Dict[str, List[bytes]] = {"compact jpeg": [], "phone photo": [], "png scan": []}
+    for _ in range(images):
+        card = synthetic_card(rng)
+        compact = card.copy()
+        compact.thumbnail((MAX_WIDTH, MAX_HEIGHT), Image.LANCZOS)
+        kinds["compact jpeg"].append(encode(compact, "JPEG", quality=90))
+        kinds["phone photo"].append(scene(rng)[0])
+        kinds["png scan"].append(encode(card, "PNG"))
+    return kinds
+
+
+def cpu(fn: Callable):
+    start = time.process_time()
+    result = fn()
+    return result, time.process_time() - start
+
+
+def sent_bytes(content) -> int:
+    return sum(len(part.inline_data.data) for part in content.parts if part.inline_data.data)
+
+
+def handoff_report(kinds: Dict[str, List[bytes]], prescreener: ImagePrescreener, cropper: CardCropper):
+    print(f"{'upload':<13} {'path':<13} {'worker p50':>11} {'loop p50':>9} {'cpu/request':>12} "
+          f"{'loop/retry':>11} {'bytes/call':>11}")
+    for kind, raws in kinds.items():
+        rows: Dict[str, Dict[str, List[float]]] = {"pil image": {}, "encoded": {}}
+        for raw in raws:
+            def before():
+                img = decode_and_resize(raw, cropper=cropper)
+                prescreener.screen(img)
+                return img
+
+            img, worker = cpu(before)
+            content, loop = cpu(lambda: content_types.to_content([PROMPT, img]))
+            row = rows["pil image"]
+            row.setdefault("worker", []).append(worker)
+            row.setdefault("loop", []).append(loop)
+            row.setdefault("bytes", []).append(sent_bytes(content))
+
+            (payload, _), worker = cpu(lambda: prepare_payload(raw, prescreener, cropper))
+            content, loop = cpu(lambda: content_types.to_content([PROMPT, payload.as_blob()]))
+            row = rows["encoded"]
+            row.setdefault("worker", []).append(worker)
+            row.setdefault("loop", []).append(loop)
+            row.setdefault("bytes", []).append(sent_bytes(content))
+            row.setdefault("passthrough", []).append(0 if payload.reencoded else 1)
+
+        for path, row in rows.items():
+            worker, loop = percentile(row["worker"], 50) * 1000, percentile(row["loop"], 50) * 1000
+            note = f"  passthrough {int(sum(row['passthrough']))}/{len(raws)}" if "passthrough" in row else ""
+            # The old path converts the image again in every retry and hedge
+            print(f"{kind:<13} {path:<13} {worker:>9.1f}ms {loop:>7.2f}ms {worker + loop:>10.1f}ms "
+                  f"{loop:>9.2f}ms {np.mean(row['bytes']) / 1024:>9.1f}KB{note}")
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    diff = np.asarray(a, dtype=np.float32) - np.asarray(b, dtype=np.float32)
+    mse = float((diff ** 2).mean())
+    return float("inf") if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def quality_report(raws: List[bytes], cropper: CardCropper):
+    resized = [decode_and_resize(raw, cropper=cropper) for raw in raws]
+    lossless = np.mean([len(encode(img, "WEBP", lossless=True)) for img in resized])
+    print(f"\nre-encode of {len(resized)} model-size card images (lossless WebP, the old payload: {lossless / 1024:.1f}KB)")
+    print(f"{'format':<6} {'quality':>7} {'bytes':>9} {'encode p50':>11} {'PSNR p5':>8} {'PSNR p50':>9}")
+    for fmt, qualities in (("JPEG", (70, 80, 85, 90, 95)), ("WEBP", (70, 80, 85, 90))):
+        for quality in qualities:
+            sizes, seconds, scores = [], [], []
+            for img in resized:
+                payload, elapsed = cpu(lambda: encode_image(img, fmt, quality))
+                sizes.append(len(payload.data))
+                seconds.append(elapsed)
+                scores.append(psnr(img, Image.open(io.BytesIO(payload.data)).convert("RGB")))
+            print(f"{fmt:<6} {quality:>7} {np.mean(sizes) / 1024:>7.1f}KB {percentile(seconds, 50) * 1000:>9.1f}ms "
+                  f"{percentile(scores, 5):>7.1f}dB {percentile(scores, 50):>8.1f}dB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=20, help="uploads per kind")
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+    kinds = uploads(random.Random(args.seed), args.images)
+    cropper = CardCropper()
+    handoff_report(kinds, ImagePrescreener(), cropper)
+    quality_report(kinds["phone photo"], cropper)
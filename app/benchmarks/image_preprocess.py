@@ -0,0 +1,92 @@
+"""
+Event-loop stall and latency of image preprocessing on phone-camera sized
+uploads: the old inline decode/resize versus the thread and process-pool
+ImagePreprocessor. Run from the app directory:
+
+    python -m benchmarks.image_preprocess --images 8 --workers 2
+"""
+import argparse
+import asyncio
+import io
+import time
+
+from PIL import Image
+
+from benchmarks.common import install_fake_keys, percentile, summarize
+
+install_fake_keys(1)
+
+from config import MAX_HEIGHT, MAX_WIDTH  # noqa: E402
+from core.image_pipeline import ImagePreprocessor  # noqa: E402
+from utils.prompt_utils import resize_id_card_image  # noqa: E402
+
+
+def make_upload(fmt: str, size: tuple) -> bytes:
+    """A noisy gradient, so the encoders cannot shortcut flat areas the way they would on a blank image."""
+    width, height = size
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 12)
+    img = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **({"quality": 92} if fmt == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def inline_prepare(raw: bytes) -> Image.Image:
+    # The pre-pool code path: full decode on the event loop, then resize
+    return resize_id_card_image(Image.open(io.BytesIO(raw)), MAX_WIDTH, MAX_HEIGHT)
+
+
+async def heartbeat(lags: list, stop: asyncio.Event, interval: float = 0.005):
+    """Wake every `interval` and record how late the loop let us run."""
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def run_mode(mode: str, raw: bytes, images: int, workers: int):
+    preprocessor = None
+    if mode != "inline":
+        preprocessor = ImagePreprocessor(workers=workers if mode == "process" else 0)
+        await preprocessor.start()
+
+    async def one():
+        start = time.perf_counter()
+        if preprocessor is None:
+            inline_prepare(raw)
+        else:
+            await preprocessor.prepare(raw)
+        latencies.append(time.perf_counter() - start)
+
+    lags, latencies = [], []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, stop))
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(images)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await beat
+    if preprocessor is not None:
+        await preprocessor.stop()
+    return elapsed, latencies, lags
+
+
+async def main(images: int, workers: int, size: tuple):
+    for fmt in ("JPEG", "PNG"):
+        raw = make_upload(fmt, size)
+        print(f"--- {fmt} {size[0]}x{size[1]}, {len(raw) / 1e6:.1f} MB, {images} concurrent uploads")
+        for mode in ("inline", "thread", "process"):
+            elapsed, latencies, lags = await run_mode(mode, raw, images, workers)
+            print(f"{mode:<8} wall={elapsed * 1000:8.1f}ms  max_stall={max(lags, default=0) * 1000:8.1f}ms  "
+                  f"lag_p99={percentile(lags, 99) * 1000:7.1f}ms  " + summarize("per image", latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=8, help="uploads preprocessed concurrently")
+    parser.add_argument("--workers", type=int, default=2, help="process pool size")
+    parser.add_argument("--size", type=int, nargs=2, default=[4032, 3024], help="upload width height")
+    args = parser.parse_args()
+    asyncio.run(main(args.images, args.workers, tuple(args.size)))
@@ -0,0 +1,224 @@
+"""
+Load test of the whole service, offline: /front, /back and /transcript are driven at a
+target rate (open loop, so a slow service builds a backlog instead of slowing the load
+down) through the ASGI app in this process. The model is benchmarks.fake_gemini's
+ReplayBackend, answering from a recording (--recording, made with LLM_RECORD_PATH) or
+synthetic answers, with a latency distribution, fault injection and per-key quotas.
+Reports per endpoint the throughput, status codes, p50/p95/p99 latency and upstream
+calls per successful request (from its PV, which counts answered calls), plus every
+call the backend saw by outcome and the process RSS (load generator included). With
+--max-error-rate / --max-p99 it exits non-zero when a threshold is crossed, for CI.
+Run from the app directory:
+
+    python -m benchmarks.load_test --rps 5 --duration 30 --latency lognormal:1.2,0.4
+    python -m benchmarks.load_test --recording answers.jsonl --latency recorded --rate-429 0.02 --key-rpm 15
+    python -m benchmarks.load_test --duration 10 --max-error-rate 0.01 --max-p99 5
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from benchmarks.common import install_fake_keys, percentile
+
+ENDPOINTS = ("front", "back", "transcript")
+RECORD = {"idNumber": "", "lastName": "Ben Ali", "firstName": "Mohamed", "fatherFullName": "Salah Ben Ahmed",
+          "dateOfBirth": "1990-01-15", "placeOfBirth": "Tunis", "motherFullName": "Fatma Bent Ali",
+          "job": "Eleve", "address": "10 Rue 9 Avril, Ariana", "dateOfCreation": "2015-06-01"}
+
+
+def rss_mb() -> float:
+    """Current resident set size (Linux /proc), falling back to the peak elsewhere."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    scale = 1e6 if sys.platform == "darwin" else 1e3
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / scale / 1024
+
+
+def card_images(kind: str, count: int, seed: int) -> List[bytes]:
+    """Distinct card photos: compact (a JPEG already at the model size) or photo (a phone shot of a card on a table)."""
+    from PIL import Image
+
+    from benchmarks.card_crop import scene
+    from benchmarks.prescreen_eval import synthetic_card
+    from config import MAX_HEIGHT, MAX_WIDTH
+
+    rng = random.Random(seed)
+    images = []
+    for _ in range(count):
+        if kind == "photo":
+            images.append(scene(rng)[0])
+            continue
+        card = synthetic_card(rng)
+        card.thumbnail((MAX_WIDTH, MAX_HEIGHT), Image.LANCZOS)
+        buffer = io.BytesIO()
+        card.save(buffer, format="JPEG", quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+class LoadGenerator:
+    def __init__(self, client, images: List[bytes], records: int, unique: bool, seed: int):
+        self.client = client
+        self.images = images
+        self.records = records
+        self.unique = unique
+        self.rng = random.Random(seed)
+        self.sequence = 0
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.upstream_calls: Dict[str, List[int]] = defaultdict(list)
+
+    def _image(self) -> bytes:
+        raw = self.images[self.sequence % len(self.images)]
+        if self.unique:
+            # Bytes after the JPEG end marker are ignored by decoders but change the result cache key
+            raw += self.sequence.to_bytes(8, "big")
+        return raw
+
+    async def one(self, endpoint: str):
+        self.sequence += 1
+        start = time.perf_counter()
+        try:
+            if endpoint == "transcript":
+                base = self.sequence * 1000 if self.unique else 0
+                body = [dict(RECORD, idNumber=f"{base + i:08d}") for i in range(self.records)]
+                response = await self.client.post("/transcript", json=body)
+            else:
+                response = await self.client.post(f"/{endpoint}", files={"image": ("card.jpg", self._image(), "image/jpeg")})
+            status = response.status_code
+        except Exception as e:
+            status, response = type(e).__name__, None
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        self.statuses[endpoint][status] += 1
+        if response is not None and status == 200:
+            payload = response.json()
+            pv = payload.get("audit") or payload.get("pv") or {}
+            self.upstream_calls[endpoint].append(pv.get("total_api_calls", 0))
+
+    async def drive(self, endpoint: str, rps: float, duration: float, poisson: bool):
+        """Open loop: requests start on schedule whether or not the earlier ones have finished."""
+        tasks = []
+        deadline = time.perf_counter() + duration
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+            tasks.append(asyncio.create_task(self.one(endpoint)))
+            next_at += self.rng.expovariate(rps) if poisson else 1 / rps
+        await asyncio.gather(*tasks)
+
+
+async def run(args) -> bool:
+    install_fake_keys(args.keys)
+    import httpx
+
+    from benchmarks.fake_gemini import Faults, LatencyModel, Recording, ReplayBackend, ReplaySessionPool
+    from core.transport import AsyncTransport
+    import main
+    from api import limiter, llm
+
+    rng = random.Random(args.seed)
+    backend = ReplayBackend(
+        recording=Recording.load(args.recording) if args.recording else None,
+        latency=LatencyModel.parse(args.latency, rng),
+        faults=Faults(rate_429=args.rate_429, rate_5xx=args.rate_5xx, rate_timeout=args.rate_timeout,
+                      rate_bad_answer=args.rate_bad_answer, timeout=args.timeout),
+        key_rpm=args.key_rpm,
+        key_tpm=args.key_tpm,
+        seed=args.seed,
+    )
+    llm.transport = AsyncTransport(ReplaySessionPool(backend))
+    # The service budgets each key like the backend's quotas (0: unlimited on both sides)
+    llm.api_key_manager.set_rate_limits(args.key_rpm, args.key_tpm)
+    # All requests come from one client address here; per-client limits would only measure themselves
+    limiter.enabled = args.client_limits
+
+    images = card_images(args.images, 32, args.seed)
+    baseline_rss = rss_mb()
+    rss_samples = [baseline_rss]
+
+    async def sample_rss():
+        while True:
+            await asyncio.sleep(0.5)
+            rss_samples.append(rss_mb())
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=None) as client:
+            generator = LoadGenerator(client, images, args.records, not args.repeat_inputs, args.seed)
+            sampler = asyncio.create_task(sample_rss())
+            start = time.perf_counter()
+            await asyncio.gather(*(generator.drive(endpoint, args.rps, args.duration, args.arrivals == "poisson")
+                                   for endpoint in args.endpoints))
+            elapsed = time.perf_counter() - start
+            sampler.cancel()
+
+    print(f"{len(args.endpoints)} endpoint(s) at {args.rps:g} rps each for {args.duration:g}s ({args.arrivals} arrivals), "
+          f"latency {args.latency}, {args.keys} keys, key quotas rpm={args.key_rpm or '-'} tpm={args.key_tpm or '-'}")
+    print(f"{'endpoint':<11} {'sent':>6} {'ok/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'calls/req':>10}  statuses")
+    failures = total = 0
+    worst_p99 = 0.0
+    for endpoint in args.endpoints:
+        latencies = generator.latencies[endpoint]
+        statuses = generator.statuses[endpoint]
+        calls = generator.upstream_calls[endpoint]
+        sent = sum(statuses.values())
+        total += sent
+        failures += sent - statuses.get(200, 0)
+        p99 = percentile(latencies, 99)
+        worst_p99 = max(worst_p99, p99)
+        print(f"{endpoint:<11} {sent:>6} {statuses.get(200, 0) / elapsed:>7.2f} "
+              f"{percentile(latencies, 50):>7.2f}s {percentile(latencies, 95):>7.2f}s {p99:>7.2f}s "
+              f"{sum(calls) / len(calls) if calls else 0:>10.2f}  {dict(sorted(statuses.items(), key=str))}")
+    print(f"backend: {backend.calls} call(s), {backend.calls / max(1, total):.2f} per request, {dict(backend.outcomes)}")
+    print(f"rss: start {baseline_rss:.0f}MB, max {max(rss_samples):.0f}MB, end {rss_samples[-1]:.0f}MB, "
+          f"peak {peak_rss_mb():.0f}MB (load generator included)")
+
+    error_rate = failures / max(1, total)
+    ok = True
+    if args.max_error_rate is not None and error_rate > args.max_error_rate:
+        print(f"FAIL: error rate {error_rate:.3f} > {args.max_error_rate}")
+        ok = False
+    if args.max_p99 is not None and worst_p99 > args.max_p99:
+        print(f"FAIL: p99 {worst_p99:.2f}s > {args.max_p99}s")
+        ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--rps", type=float, default=2.0, help="target requests per second, per endpoint")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--arrivals", choices=("poisson", "uniform"), default="poisson")
+    parser.add_argument("--images", choices=("compact", "photo"), default="compact", help="uploaded card images")
+    parser.add_argument("--records", type=int, default=10, help="records per /transcript request")
+    parser.add_argument("--repeat-inputs", action="store_true", help="reuse inputs, so the result cache can hit")
+    parser.add_argument("--keys", type=int, default=8)
+    parser.add_argument("--recording", help="JSONL written with LLM_RECORD_PATH; synthetic answers without it")
+    parser.add_argument("--latency", default="lognormal:1.0,0.35", help="fixed:S, uniform:LO,HI, lognormal:MEDIAN,SIGMA, exp:MEAN or recorded")
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    parser.add_argument("--rate-timeout", type=float, default=0.0)
+    parser.add_argument("--rate-bad-answer", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds before an injected timeout fails")
+    parser.add_argument("--key-rpm", type=int, default=0, help="per-key requests per minute, 0 for none")
+    parser.add_argument("--key-tpm", type=int, default=0, help="per-key input tokens per minute, 0 for none")
+    parser.add_argument("--client-limits", action="store_true", help="keep the per-client rate limits (CLIENT_RATE_LIMITS)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 when the share of non-200 responses is above")
+    parser.add_argument("--max-p99", type=float, help="exit 1 when an endpoint's p99 latency (s) is above")
+    sys.exit(0 if asyncio.run(run(parser.parse_args())) else 1)
@@ -0,0 +1,122 @@
+"""
+Request throughput of the full app at INFO level with the old synchronous
+FileHandler + StreamHandler setup versus the queue-based JSON pipeline, with and
+without per-module sampling. Upstream calls go to the offline fake backend;
+--disk-latency adds a sleep to every log file write to stand in for a slow or
+contended disk. Run from the app directory:
+
+    python -m benchmarks.logging_throughput --requests 3000 --concurrency 64 --disk-latency 0 0.0005
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+
+from benchmarks.common import install_fake_keys, summarize
+
+install_fake_keys(8)
+
+import httpx  # noqa: E402
+
+from benchmarks.fake_gemini import FakeSessionPool  # noqa: E402
+from core.transport import AsyncTransport  # noqa: E402
+import main  # noqa: E402
+from api import llm  # noqa: E402
+from utils.logging_utils import TEXT_FORMAT, setup_logging  # noqa: E402
+
+RECORDS = [
+    {"idNumber": str(i), "lastName": "Ben Ali", "firstName": "Mohamed", "fatherFullName": "Salah",
+     "dateOfBirth": "1990/01/01", "placeOfBirth": "Tunis", "motherFullName": "Fatma", "job": "Eleve",
+     "address": "10, Rue de la Liberte, Tunis", "dateOfCreation": "2010/01/01"}
+    for i in range(3)
+]
+
+
+class SlowFile:
+    """File wrapper whose writes take `latency` extra seconds (GIL released, like real blocking I/O)."""
+
+    def __init__(self, f, latency: float):
+        self.f = f
+        self.latency = latency
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+
+def slow_down(handlers, disk_latency: float):
+    for handler in handlers:
+        if isinstance(handler, logging.FileHandler):
+            handler.stream = SlowFile(handler.stream, disk_latency)
+
+
+def sync_logging(path: str, devnull):
+    """The configuration main.py used before: both handlers write on the calling thread."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in (logging.FileHandler(path), logging.StreamHandler(devnull)):
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    return None
+
+
+async def drive(requests: int, concurrency: int):
+    transport = httpx.ASGITransport(app=main.app)
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/transcript", json=RECORDS)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start, latencies
+
+
+async def run(mode: str, requests: int, concurrency: int, disk_latency: float, workdir: str, devnull):
+    path = os.path.join(workdir, f"{mode}-{disk_latency}.log")
+    if mode == "sync":
+        listener = sync_logging(path, devnull)
+    else:
+        listener = setup_logging(path=path, sampling={} if mode == "queue" else None, console=devnull)
+    slow_down(listener.handlers if listener is not None else logging.getLogger().handlers, disk_latency)
+    await drive(50, concurrency)  # warm-up
+    elapsed, latencies = await drive(requests, concurrency)
+    dropped = sum(getattr(handler, "dropped", 0) for handler in logging.getLogger().handlers)
+    if listener is not None:
+        listener.stop()
+    with open(path, encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+    print(f"disk+{disk_latency * 1000:.1f}ms {mode:<15} throughput={requests / elapsed:8.1f} req/s  log_lines={lines:<7} dropped={dropped:<6} " + summarize("latency", latencies))
+
+
+async def main_async(requests: int, concurrency: int, disk_latencies: list):
+    llm.transport = AsyncTransport(FakeSessionPool(latency=0.0, text="```json\n" + json.dumps(RECORDS) + "\n```"))
+    llm.api_key_manager.set_rate_limits(0, 0)  # fake keys have no quota
+    llm.coalesce_requests = False  # identical benchmark prompts would otherwise share one upstream call
+    with tempfile.TemporaryDirectory() as workdir, open(os.devnull, "w") as devnull:
+        for disk_latency in disk_latencies:
+            for mode in ("sync", "queue", "queue+sampling"):
+                await run(mode, requests, concurrency, disk_latency, workdir, devnull)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--disk-latency", type=float, nargs="+", default=[0.0, 0.0005], help="seconds added per log write")
+    args = parser.parse_args()
+    asyncio.run(main_async(args.requests, args.concurrency, args.disk_latency))
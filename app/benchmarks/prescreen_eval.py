@@ -0,0 +1,166 @@
+"""
+Offline evaluation of the local image pre-screen (core/prescreen.py). Each image goes
+through the same decode, card crop and resize as the service, then the pre-screen (the
+aspect ratio only counts for a cropped card, as in the service); the report has the
+false rejects of valid cards, the missed invalid uploads, the rejects per reason, the
+screening time and the score percentiles per label, to tune the PRESCREEN_* thresholds.
+
+Labelled dataset: a directory whose `valid/` subdirectory holds good card photos and
+whose other subdirectories (e.g. `photocopy/`, `blank/`, `not_a_card/`) hold uploads that
+should be rejected. Without --dataset a synthetic set is generated. Run from the app directory:
+
+    python -m benchmarks.prescreen_eval --dataset ~/prescreen-set --min-colorfulness 5
+    python -m benchmarks.prescreen_eval --synthetic 50
+    python -m benchmarks.prescreen_eval --hash specimen1.jpg specimen2.jpg > prescreen_templates.json
+"""
+import argparse
+import io
+import json
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from benchmarks.common import percentile
+from config import CARD_CROP_ENABLED
+from core.card_crop import CardCropper
+from core.image_pipeline import decode_and_resize, decode_card
+from core.prescreen import ImagePrescreener, perceptual_hash
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+SCORES = ("colorfulness", "saturation", "contrast", "sharpness", "aspect_ratio")
+
+
+def iter_dataset(root: str) -> Iterator[Tuple[str, str, bytes]]:
+    """(label, path, raw bytes); the label is the subdirectory name."""
+    for label in sorted(os.listdir(root)):
+        directory = os.path.join(root, label)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(directory, name)
+                with open(path, "rb") as f:
+                    yield label, path, f.read()
+
+
+def synthetic_card(rng: random.Random, size=(1600, 1010)) -> Image.Image:
+    """A photo-like colour card: tinted background, photo block and lines of 'text', with sensor noise."""
+    width, height = size
+    base = tuple(rng.randint(120, 230) for _ in range(3))
+    img = Image.new("RGB", size, base)
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((width * 0.05, height * 0.2, width * 0.3, height * 0.85),
+                   fill=tuple(rng.randint(40, 160) for _ in range(3)))
+    for row in range(8):
+        y = height * (0.2 + row * 0.08)
+        x = width * 0.36
+        while x < width * 0.9:
+            word = rng.randint(20, 90)
+            draw.rectangle((x, y, x + word, y + height * 0.03), fill=(rng.randint(0, 60),) * 3)
+            x += word + rng.randint(10, 25)
+    noise = Image.merge("RGB", [Image.effect_noise(size, 12)] * 3)
+    return Image.blend(img, noise, 0.08)
+
+
+def iter_synthetic(count: int, seed: int = 7) -> Iterator[Tuple[str, str, bytes]]:
+    rng = random.Random(seed)
+
+    def encode(img: Image.Image) -> bytes:
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    for i in range(count):
+        card = synthetic_card(rng)
+        yield "valid", f"synthetic/valid/{i}", encode(card)
+        yield "valid", f"synthetic/valid_portrait/{i}", encode(card.rotate(90, expand=True))
+        # A square photo of a card on a plain surface: the card crop may or may not find it
+        square = Image.new("RGB", (2000, 2000), tuple(rng.randint(60, 200) for _ in range(3)))
+        square.paste(card, (200, 495))
+        yield "valid", f"synthetic/valid_square/{i}", encode(square)
+        yield "photocopy", f"synthetic/photocopy/{i}", encode(card.convert("L").convert("RGB"))
+        yield "blank", f"synthetic/blank/{i}", encode(Image.new("RGB", (1600, 1200), (rng.randint(0, 255),) * 3))
+        yield "blurry", f"synthetic/blurry/{i}", encode(card.filter(ImageFilter.GaussianBlur(rng.uniform(8, 15))))
+        yield "not_a_card", f"synthetic/banner/{i}", encode(card.resize((3200, 700)))
+
+
+def evaluate(samples: Iterator[Tuple[str, str, bytes]], prescreener: ImagePrescreener):
+    totals: Counter = Counter()
+    rejected: Counter = Counter()
+    reasons: Dict[str, Counter] = defaultdict(Counter)
+    scores: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    timings: List[float] = []
+    mistakes: List[str] = []
+    cropper = CardCropper() if CARD_CROP_ENABLED else None
+
+    for label, path, raw in samples:
+        img, card_crop = decode_card(raw, cropper=cropper)
+        start = time.perf_counter()
+        result = prescreener.screen(img, card_crop=card_crop)
+        timings.append(time.perf_counter() - start)
+
+        totals[label] += 1
+        for name in SCORES:
+            scores[label][name].append(result.scores[name])
+        if not result.passed:
+            rejected[label] += 1
+            reasons[label][result.reason] += 1
+        if (label == "valid") != result.passed:
+            mistakes.append(f"  {'false reject' if label == 'valid' else 'missed':<12} {path}: "
+                            f"{result.detail or 'passed'}")
+
+    print(f"{'label':<14} {'images':>7} {'rejected':>9}  reasons")
+    for label in sorted(totals):
+        print(f"{label:<14} {totals[label]:>7} {rejected[label]:>9}  {dict(reasons[label])}")
+
+    valid = totals["valid"]
+    invalid = sum(totals.values()) - valid
+    caught = sum(rejected.values()) - rejected["valid"]
+    print(f"\nfalse reject rate {rejected['valid'] / valid if valid else 0:.3f} ({rejected['valid']}/{valid}), "
+          f"recall on invalid {caught / invalid if invalid else 0:.3f} ({caught}/{invalid})")
+    print(f"screen time p50={percentile(timings, 50) * 1000:.2f}ms p99={percentile(timings, 99) * 1000:.2f}ms")
+
+    print(f"\n{'label':<14} {'score':<13} {'p5':>9} {'p50':>9} {'p95':>9}")
+    for label in sorted(scores):
+        for name in SCORES:
+            values = scores[label][name]
+            print(f"{label:<14} {name:<13} {percentile(values, 5):9.3f} {percentile(values, 50):9.3f} "
+                  f"{percentile(values, 95):9.3f}")
+    if mistakes:
+        print("\n" + "\n".join(mistakes))
+
+
+def print_hashes(paths: List[str]):
+    """Templates file content for PRESCREEN_TEMPLATES_PATH."""
+    hashes = {}
+    for path in paths:
+        with open(path, "rb") as f:
+            hashes[os.path.basename(path)] = f"{perceptual_hash(decode_and_resize(f.read())):016x}"
+    print(json.dumps(hashes, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--dataset", help="labelled directory (valid/ + one directory per reject kind)")
+    parser.add_argument("--synthetic", type=int, default=30, help="synthetic cards per label without --dataset")
+    parser.add_argument("--hash", nargs="+", metavar="IMAGE", help="print the pHash templates of these images and exit")
+    parser.add_argument("--min-colorfulness", type=float)
+    parser.add_argument("--min-saturation", type=float)
+    parser.add_argument("--min-contrast", type=float)
+    parser.add_argument("--min-sharpness", type=float)
+    parser.add_argument("--aspect-range", type=float, nargs=2)
+    args = parser.parse_args()
+
+    if args.hash:
+        print_hashes(args.hash)
+    else:
+        overrides = {name: value for name, value in vars(args).items()
+                     if name.startswith(("min_", "aspect_")) and value is not None}
+        if "aspect_range" in overrides:
+            overrides["aspect_range"] = tuple(overrides["aspect_range"])
+        evaluate(iter_dataset(args.dataset) if args.dataset else iter_synthetic(args.synthetic),
+                 ImagePrescreener(**overrides))
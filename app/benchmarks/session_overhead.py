@@ -0,0 +1,84 @@
+"""
+Per-call overhead of `LLM._call_api` before and after the per-key session pool.
+
+The upstream request is replaced by an instant fake response, so the numbers are
+pure client-side overhead (thread hops, `genai.configure` under the global lock,
+model construction). Run from the app directory:
+
+    python -m benchmarks.session_overhead --calls 2000 --concurrency 64
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+from benchmarks.common import install_fake_keys, summarize
+
+install_fake_keys(8)
+
+import google.generativeai as genai  # noqa: E402
+
+from config import MAX_OUTPUT_TOKENS  # noqa: E402
+from core.llm_client import LLM  # noqa: E402
+
+
+class FakeResponse:
+    text = "```json\n{}\n```"
+
+
+def fake_generate_content(self, prompt, **kwargs):
+    return FakeResponse()
+
+
+_legacy_lock = threading.Lock()
+
+
+def legacy_create_fresh_session(model_name: str, key: str):
+    # Previous behaviour: configure the process-wide client under a global lock on every call
+    client_config = genai.types.GenerationConfig(candidate_count=1, max_output_tokens=MAX_OUTPUT_TOKENS)
+    with _legacy_lock:
+        genai.configure(api_key=key)
+    return genai.GenerativeModel(model_name=model_name, generation_config=client_config)
+
+
+async def legacy_call_api(llm: LLM, prompt, key: str):
+    client = await asyncio.to_thread(legacy_create_fresh_session, llm.model_name, key)
+    return await asyncio.to_thread(client.generate_content, prompt)
+
+
+async def run(call, llm: LLM, calls: int, concurrency: int) -> list:
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one(i: int):
+        key = llm.api_key_manager.api_keys[i % len(llm.api_key_manager.api_keys)]
+        async with semaphore:
+            start = time.perf_counter()
+            await call(["benchmark prompt"], key)
+            samples.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return samples
+
+
+async def main(calls: int, concurrency: int):
+    genai.GenerativeModel.generate_content = fake_generate_content
+    llm = LLM()
+
+    # Warm up both paths so one-time client construction is not counted
+    await run(lambda p, k: legacy_call_api(llm, p, k), llm, 50, concurrency)
+    await run(llm._call_api, llm, 50, concurrency)
+
+    before = await run(lambda p, k: legacy_call_api(llm, p, k), llm, calls, concurrency)
+    after = await run(llm._call_api, llm, calls, concurrency)
+    print(f"calls={calls} concurrency={concurrency} keys={len(llm.api_key_manager.api_keys)}")
+    print(summarize("before (fresh session)", before))
+    print(summarize("after (session pool)", after))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    asyncio.run(main(args.calls, args.concurrency))
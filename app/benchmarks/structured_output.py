@@ -0,0 +1,198 @@
+"""
+JSON extraction from model answers: the old fenced-only regex against the tolerant
+parser (utils.prompt_utils.extract_json_from_response), which structured output mode
+relies on for bare JSON. Each answer is parsed and validated as LLM._parse does, and
+counted as ok, invalid card or retry (NoResponseError / ValidationError: the call is
+paid again after a 0.5 * attempt backoff). Reports per answer shape and in total the
+validation-retry rate, the parse time and the latency retries add per request.
+
+Answers are recorded model responses, one JSON object per line, as written with
+LLM_RECORD_PATH (core.transport.RecordingTransport):
+    {"text": "...", "output_model": "TunisianIDCardFront", "many": false, ...}
+(output_model: TunisianIDCardFront, TunisianIDCardBack or TunisianIDCardData; `many`
+for transcription lists). Without --responses, one synthetic answer of every shape seen
+from Gemini is used. With --dataset, the real model is called on a labelled card set
+(see benchmarks.card_crop) with structured output off and on; GOOGLE_API_KEY_* must be set.
+Run from the app directory:
+
+    python -m benchmarks.structured_output --responses recorded.jsonl --call-latency 2.5
+    python -m benchmarks.structured_output --dataset ~/id-samples
+"""
+import argparse
+import asyncio
+import json
+import re
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Dict, Iterator, List, Tuple, Type
+
+from pydantic import BaseModel, ValidationError
+
+from benchmarks.common import percentile
+from config import VALIDATION_MAX_RETRIES
+from models.id_card import TunisianIDCardBack, TunisianIDCardData, TunisianIDCardFront
+from utils.prompt_utils import extract_json_from_response, is_invalid_id_card_message
+
+MODELS = {model.__name__: model for model in (TunisianIDCardFront, TunisianIDCardBack, TunisianIDCardData)}
+FRONT = {"idNumber": "12345678", "lastName": "بن علي", "firstName": "محمد", "fatherFullName": "صالح",
+         "dateOfBirth": "1990-01-01", "placeOfBirth": "تونس"}
+RECORD = {"idNumber": "12345678", "lastName": "Ben Ali", "firstName": "Mohamed", "fatherFullName": "Salah",
+          "dateOfBirth": "1990-01-01", "placeOfBirth": "Tunis", "motherFullName": "Fatma", "job": "Eleve",
+          "address": "10, Rue de Rome, Tunis", "dateOfCreation": "2010-01-01"}
+
+
+def legacy_extract(text: str):
+    """extract_json_from_response before the tolerant parser: a ```json fence or nothing."""
+    match = re.search(r'```json\s*([\s\S]*?)\s*```', text, re.DOTALL)
+    if not match:
+        return []
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return []
+
+
+def synthetic_answers() -> Iterator[Tuple[str, str, str, bool]]:
+    """(shape, text, output model name, many)"""
+    front = json.dumps(FRONT, ensure_ascii=False, indent=2)
+    records = json.dumps([RECORD, dict(RECORD, idNumber="87654321")], ensure_ascii=False)
+    yield "fenced", f"```json\n{front}\n```", "TunisianIDCardFront", False
+    yield "fenced + prose", f"Voici les données :\n```json\n{front}\n```\nN'hésitez pas.", "TunisianIDCardFront", False
+    yield "fenced JSON (caps)", f"```JSON\n{front}\n```", "TunisianIDCardFront", False
+    yield "fenced, no tag", f"```\n{front}\n```", "TunisianIDCardFront", False
+    yield "fence not closed", f"```json\n{front}", "TunisianIDCardFront", False
+    yield "bare (structured)", front, "TunisianIDCardFront", False
+    yield "bare + prose", f"Here is the extracted data:\n{front}", "TunisianIDCardFront", False
+    yield "bare list (structured)", records, "TunisianIDCardData", True
+    yield "invalid id card", "invalid id card", "TunisianIDCardFront", False
+    yield "invalid, JSON mode", '"invalid id card"', "TunisianIDCardFront", False
+    yield "no JSON", "I cannot read the text on this image.", "TunisianIDCardFront", False
+
+
+def load_answers(path: str) -> Iterator[Tuple[str, str, str, bool]]:
+    """Recorded answers; failed calls and models not listed in MODELS (the card pair) are skipped."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            answer = json.loads(line)
+            if answer.get("text") is None or answer.get("output_model") not in MODELS:
+                continue
+            shape = f"recorded {answer.get('kind', '')}".strip()
+            if "structured" in answer:
+                shape += " (structured)" if answer["structured"] else " (free text)"
+            yield shape, answer["text"], answer["output_model"], bool(answer.get("many"))
+
+
+def outcome(parser: Callable, text: str, output_model: Type[BaseModel], many: bool) -> str:
+    """ok, invalid_card or retry, as LLM._parse would decide (allow_partial for lists)."""
+    parsed = parser(text)
+    if not parsed:
+        return "invalid_card" if is_invalid_id_card_message(text) else "retry"
+    try:
+        if isinstance(parsed, list):
+            valid = 0
+            for item in parsed:
+                try:
+                    output_model(**item)
+                    valid += 1
+                except (ValidationError, TypeError):
+                    pass
+            # Lists are validated item by item (allow_partial); otherwise every item must pass
+            return "ok" if (valid if many else valid == len(parsed)) else "retry"
+        output_model(**parsed)
+        return "ok"
+    except (ValidationError, TypeError):
+        return "retry"
+
+
+def added_latency(retry_rate: float, call_latency: float, max_retries: int = VALIDATION_MAX_RETRIES) -> float:
+    """Expected extra seconds per request when each attempt needs a retry with probability `retry_rate`."""
+    return sum(retry_rate ** n * (call_latency + 0.5 * n) for n in range(1, max_retries + 1))
+
+
+def parse_report(answers: List[Tuple[str, str, str, bool]], call_latency: float, repeat: int):
+    parsers = {"fenced regex": legacy_extract, "tolerant": extract_json_from_response}
+    outcomes: Dict[str, Dict[str, Counter]] = {name: defaultdict(Counter) for name in parsers}
+    timings: Dict[str, List[float]] = {name: [] for name in parsers}
+    for shape, text, model_name, many in answers:
+        for name, parser in parsers.items():
+            outcomes[name][shape][outcome(parser, text, MODELS[model_name], many)] += 1
+            for _ in range(repeat):
+                start = time.perf_counter()
+                parser(text)
+                timings[name].append(time.perf_counter() - start)
+
+    print(f"{'shape':<34} " + " ".join(f"{name:>16}" for name in parsers))
+    for shape in outcomes["tolerant"]:
+        cells = []
+        for name in parsers:
+            counts = outcomes[name][shape]
+            cells.append(f"{'/'.join(f'{k}={v}' for k, v in sorted(counts.items())):>16}")
+        print(f"{shape:<34} " + " ".join(cells))
+
+    print(f"\n{'parser':<14} {'answers':>8} {'retry rate':>11} {'parse p50':>10} {'parse p99':>10} "
+          f"{'added latency/request':>22}")
+    for name in parsers:
+        total = Counter()
+        for counts in outcomes[name].values():
+            total.update(counts)
+        answers_count = sum(total.values())
+        rate = total["retry"] / answers_count if answers_count else 0.0
+        print(f"{name:<14} {answers_count:>8} {rate:>11.3f} {percentile(timings[name], 50) * 1e6:>8.1f}us "
+              f"{percentile(timings[name], 99) * 1e6:>8.1f}us {added_latency(rate, call_latency) * 1000:>19.0f}ms")
+    print(f"(added latency: retry chains of up to {VALIDATION_MAX_RETRIES} calls of {call_latency:.1f}s "
+          f"plus the 0.5s * attempt backoff; 'no JSON' answers are retried by both, as they should)")
+
+
+async def live_report(root: str):
+    import core.llm_client as llm_client
+    from benchmarks.card_crop import load_dataset
+    from core.extraction import CARD_SCHEMA, CARD_SIDES
+    from core.image_pipeline import prepare_payload
+
+    samples = load_dataset(root)
+    if not samples:
+        print(f"No labelled images under {root}/front or {root}/back")
+        return
+    for label, structured, parser in (("fenced regex, free text", False, legacy_extract),
+                                      ("tolerant, structured", True, extract_json_from_response)):
+        llm_client.extract_json_from_response = parser
+        llm = llm_client.LLM(structured_output=structured)
+        llm.coalesce_requests = False
+        calls = retries = failed = 0
+        durations = []
+        for side, name, raw, _ in samples:
+            spec = CARD_SIDES[side]
+            payload, _ = await asyncio.to_thread(prepare_payload, raw, None)
+            start = time.perf_counter()
+            try:
+                result_with_pv = await llm.generate([spec.prompt, payload], spec.output_model, schema=CARD_SCHEMA)
+                pv = result_with_pv["pv"]
+            except Exception as e:
+                failed += 1
+                pv = getattr(e, "pv", None) or {}
+                print(f"  {label}: {side}/{name} failed: {e}")
+            durations.append(time.perf_counter() - start)
+            calls += pv.get("total_api_calls", 0)
+            retries += sum(1 for a in pv.get("attempts", []) if a.get("status") == "validation_error")
+        print(f"{label:<24} requests={len(samples)} calls={calls} validation retries={retries} "
+              f"({retries / max(1, calls):.3f} of calls) failed={failed} "
+              f"latency p50={percentile(durations, 50):.2f}s p95={percentile(durations, 95):.2f}s")
+    llm_client.extract_json_from_response = extract_json_from_response
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--responses", help="recorded answers, JSONL (see above)")
+    parser.add_argument("--call-latency", type=float, default=2.0, help="seconds per model call, for the added latency")
+    parser.add_argument("--repeat", type=int, default=200, help="timed parses per answer")
+    parser.add_argument("--dataset", help="labelled card images, calls the real model")
+    args = parser.parse_args()
+    if args.dataset:
+        asyncio.run(live_report(args.dataset))
+    else:
+        answers = list(load_answers(args.responses) if args.responses else synthetic_answers())
+        if not args.responses:
+            print("synthetic: one answer per shape, so the totals are not a production rate (use --responses)\n")
+        parse_report(answers, args.call_latency, args.repeat)
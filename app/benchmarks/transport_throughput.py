@@ -0,0 +1,57 @@
+"""
+Throughput of `LLM.generate` over the thread and async transports against the
+offline fake Gemini backend. Run from the app directory:
+
+    python -m benchmarks.transport_throughput --latency 0.2 --concurrency 50 200 1000
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import install_fake_keys, summarize
+
+install_fake_keys(8)
+
+from pydantic import BaseModel  # noqa: E402
+
+from benchmarks.fake_gemini import FakeSessionPool  # noqa: E402
+from core.llm_client import LLM  # noqa: E402
+from core.transport import AsyncTransport, ThreadTransport  # noqa: E402
+
+
+class Echo(BaseModel):
+    ok: bool
+
+
+async def drive(llm: LLM, concurrency: int, rounds: int):
+    latencies = []
+
+    async def one():
+        start = time.perf_counter()
+        await llm.generate(["benchmark prompt"], Echo)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(concurrency * rounds)))
+    return time.perf_counter() - start, latencies
+
+
+async def main(latency: float, levels: list, rounds: int):
+    sessions = FakeSessionPool(latency=latency)
+    for transport_cls in (ThreadTransport, AsyncTransport):
+        llm = LLM(transport=transport_cls(sessions))
+        llm.api_key_manager.set_rate_limits(0, 0)  # fake keys have no quota
+        for concurrency in levels:
+            elapsed, latencies = await drive(llm, concurrency, rounds)
+            calls = concurrency * rounds
+            print(f"{transport_cls.name:<7} concurrency={concurrency:<5} "
+                  f"throughput={calls / elapsed:9.1f} calls/s  " + summarize("latency", latencies))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream latency in seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("--rounds", type=int, default=3, help="requests per concurrency slot")
+    args = parser.parse_args()
+    asyncio.run(main(args.latency, args.concurrency, args.rounds))
@@ -0,0 +1,133 @@
+"""
+Peak worker memory under concurrent large uploads to /front: the old handler, which
+read every upload in full with no cap, against the capped streaming path
+(RequestSizeLimitMiddleware + read_image_upload). Each (mode, scenario) runs in its
+own process so its peak RSS is measured alone. Scenarios:
+- valid: real JPEG photos under the cap
+- oversized: uploads over MAX_IMAGE_BYTES, with and without a Content-Length
+- not-image: large payloads that are not images
+Upstream calls go to the offline fake backend. Run from the app directory:
+
+    python -m benchmarks.upload_memory --uploads 16 --size-mb 40
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import install_fake_keys
+
+SCENARIOS = ("valid", "oversized", "oversized-chunked", "not-image")
+FRONT = {"idNumber": "12345678", "lastName": "بن علي", "firstName": "محمد", "fatherFullName": "صالح",
+         "dateOfBirth": "1990", "placeOfBirth": "تونس"}
+BOUNDARY = "benchmarkboundary"
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def write_payload(path: str, scenario: str, size_mb: int):
+    if scenario == "valid":
+        from PIL import Image
+        size = (4032, 3024)
+        img = Image.merge("RGB", (Image.effect_noise(size, 40), Image.linear_gradient("L").resize(size),
+                                  Image.effect_noise(size, 60)))  # in colour, so the pre-screen lets it through
+        img.save(path, format="JPEG", quality=97)
+        return
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8\xff\xe0" if scenario.startswith("oversized") else b"%PDF-1.7\n")
+        chunk = os.urandom(1024 * 1024)
+        for _ in range(size_mb if scenario.startswith("oversized") else min(size_mb, 12)):
+            f.write(chunk)
+
+
+async def chunked_body(path: str):
+    """Multipart body streamed without a Content-Length, so only the running count can stop it."""
+    yield (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"card.jpg\"\r\n"
+           f"Content-Type: image/jpeg\r\n\r\n").encode()
+    with open(path, "rb") as f:
+        while chunk := f.read(256 * 1024):
+            yield chunk
+    yield f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+async def child(mode: str, scenario: str, uploads: int, size_mb: int):
+    install_fake_keys(8)
+    import httpx
+    from benchmarks.fake_gemini import FakeSessionPool
+    from core.extraction import image_preprocessor
+    from core.transport import AsyncTransport
+    import main
+    from api import admission, extract_front, llm
+    from utils.upload_utils import RequestSizeLimitMiddleware
+
+    llm.transport = AsyncTransport(FakeSessionPool(latency=0.05, text="```json\n" + json.dumps(FRONT) + "\n```"))
+    llm.api_key_manager.set_rate_limits(0, 0)
+    image_preprocessor.workers = 0  # decode in this process, so it shows in the measured RSS
+    admission.max_wait = 3600
+    if mode == "buffered":
+        async def read_everything(upload, max_bytes=None):
+            return await upload.read()
+        extract_front.read_image_upload = read_everything
+        main.app.user_middleware = [m for m in main.app.user_middleware if m.cls is not RequestSizeLimitMiddleware]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "payload")
+        write_payload(path, scenario, size_mb)
+        payload_mb = os.path.getsize(path) / 1e6
+        baseline = peak_rss_mb()
+        statuses = {}
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            async def one():
+                if scenario == "oversized-chunked":
+                    response = await client.post(
+                        "/front", content=chunked_body(path),
+                        headers={"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+                else:
+                    with open(path, "rb") as f:
+                        response = await client.post("/front", files={"image": ("card.jpg", f, "image/jpeg")})
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(uploads)))
+            elapsed = time.perf_counter() - start
+    print(json.dumps({"payload_mb": payload_mb, "baseline_mb": baseline, "peak_mb": peak_rss_mb(),
+                      "elapsed": elapsed, "statuses": statuses}))
+
+
+def run(mode: str, scenario: str, uploads: int, size_mb: int) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.upload_memory", "--child", mode, scenario,
+         "--uploads", str(uploads), "--size-mb", str(size_mb)],
+        capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(uploads: int, size_mb: int):
+    print(f"{uploads} concurrent uploads per scenario, oversized payloads {size_mb} MB")
+    for scenario in SCENARIOS:
+        for mode in ("buffered", "streaming"):
+            r = run(mode, scenario, uploads, size_mb)
+            print(f"{scenario:<18} {mode:<10} payload={r['payload_mb']:6.1f}MB  "
+                  f"peak_rss_growth={r['peak_mb'] - r['baseline_mb']:8.1f}MB  "
+                  f"wall={r['elapsed'] * 1000:8.1f}ms  statuses={r['statuses']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=16, help="concurrent uploads")
+    parser.add_argument("--size-mb", type=int, default=40, help="size of the oversized payloads")
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "SCENARIO"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        asyncio.run(child(*args.child, args.uploads, args.size_mb))
+    else:
+        main(args.uploads, args.size_mb)
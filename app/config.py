@@ -23,6 +23,19 @@ PROMPT_TUNISIAN_ID_FRONT = (
         "- The output must be a single valid JSON object with these fields."
     )
 
+PROMPT_TUNISIAN_ID_CARD = (
+    "You are an assistant specialized in analyzing images of Tunisian ID cards.\n"
+    "- You receive two images of the same card: the first is the front side, the second is the back side.\n"
+    "- If either image is not the expected side of a Tunisian ID card, or if it is a photocopy (e.g., black and white, grayscale, low contrast, missing color features), "
+    "you must respond with exactly this message and nothing else:\n\n"
+    "invalid id card\n\n"
+    "- Do not extract or output any information for invalid or photocopied cards.\n"
+    "- If both sides are valid and in color, extract the following fields:\n"
+    "  • from the front side: idNumber, lastName, firstName, fatherFullName, dateOfBirth, placeOfBirth\n"
+    "  • from the back side: motherFullName, job, address, dateOfCreation\n"
+    "- The output must be a single valid JSON object wrapped in ```json ... ```, with the front fields under \"front\" and the back fields under \"back\"."
+)
+
 PROMPT_TRANSCRIPTION = (
     "Vous êtes un assistant spécialisé dans la transcription et la traduction des champs des cartes d'identité tunisiennes à partir de l'arabe.\n"
     "- Transcrivez tous les **noms** et **lieux** en alphabet latin en utilisant les règles officielles de translittération tunisiennes.\n"
@@ -56,7 +69,20 @@ PROMPT_TRANSCRIPTION = (
 #-------------------------------------------------
 #---------------Transcription---------------------
 
-MAX_BATCH_SIZE = 20
+MAX_BATCH_SIZE = 50          # upper bound; batches are sized from estimated output tokens
+MAX_CONCURRENT_BATCHES = 8
+BATCH_OUTPUT_HEADROOM = 0.75  # plan each batch to fill this share of the learned output limit
+BATCH_OUTPUT_RATIO = 1.5      # starting estimate of output tokens per input token, refined as batches complete
+BATCH_HISTORY_RECORDS = 50    # most recent transcription PVs replayed from the audit log at startup
+
+#-------------------------------------------------
+#---------------Transcription Jobs----------------
+
+JOBS_DB_PATH = "logs/jobs/jobs.sqlite"
+JOB_WORKERS = 4
+JOB_POLL_INTERVAL = 1.0
+JOB_MAX_BATCH_ATTEMPTS = 3
+JOB_STALE_AFTER = 600  # a batch claimed longer ago than this is assumed orphaned and re-queued
 
 
 #-------------------------------------------------
@@ -64,12 +90,47 @@ MAX_BATCH_SIZE = 20
 
 DEFAULT_COOLDOWN = 60
 VALIDATION_FAILURE_PENALTY = 10
+MAX_IN_FLIGHT_PER_KEY = 2
+KEY_RPM_LIMIT = 0              # per-key requests per minute; 0 disables, so RPM 429s are only handled after the fact.
+                               # Set it to the keys' tier to pace keys ahead of their quota and adapt (AIMD) within it,
+                               # e.g. 15 for gemini-2.0-flash free tier keys, or your paid tier's RPM (see docs.html)
+KEY_TPM_LIMIT = 1_000_000      # per-key input tokens per minute; 0 disables
+RATE_LIMIT_DECREASE = 0.7      # a quota error multiplies the limit it hit by this
+RATE_LIMIT_RECOVERY = 0.01     # each success grows the limits back by this share of the ceiling
+RATE_LIMIT_MIN_SHARE = 0.1     # limits never drop below this share of the ceiling
+RATE_LIMIT_MAX_WAIT = 10       # longest generate() waits for a key with budget before using one anyway
+
+#-------------------------------------------------
+#----------------Shared Key State-----------------
+
+KEY_STATE_BACKEND = "sqlite"    # "sqlite" (shared by the workers on one host) or "none" (each worker on its own)
+KEY_STATE_PATH = "logs/keys/key_state.sqlite"
+KEY_STATE_SYNC_INTERVAL = 1.0   # seconds between exchanges with the shared store
+KEY_STATE_USAGE_TTL = 600       # usage published by a worker silent this long is forgotten
 
 
 #--------------------------------------------------
 #----------------llm wraper Configs----------------
 SYSTEM_MAX_RETRIES = 3
 VALIDATION_MAX_RETRIES = 2
+MAX_OUTPUT_TOKENS = 2048
+LLM_TRANSPORT = "async"  # "async" (native SDK async) or "thread" (generate_content in a worker thread)
+STRUCTURED_OUTPUT = True  # bare JSON answers (application/json), held to the output model's schema where the call allows it
+COALESCE_IDENTICAL_REQUESTS = True  # identical concurrent generate() calls share one upstream call
+LLM_RECORD_PATH = ""      # append every model answer to this JSONL for offline replay (benchmarks.fake_gemini);
+                          # answers hold card data, so only set it on test traffic. Empty disables
+
+#---------------------------------------------------
+#---------------Hedged Requests---------------------
+
+HEDGE_REQUESTS = False    # /front, /back and /card send a second attempt on another key when the first is slow;
+                          # every hedge is a second paid call on the keys' budget, so deployments opt in
+HEDGE_PERCENTILE = 0.95   # hedge once the first attempt is slower than this share of recent calls of its kind
+HEDGE_MIN_DELAY = 0.5     # seconds; bounds of the adaptive delay
+HEDGE_MAX_DELAY = 15
+HEDGE_WINDOW = 200        # recent latencies kept per output model
+HEDGE_MIN_SAMPLES = 20    # no hedging until this many latencies were observed
+HEDGE_MAX_SHARE = 0.1     # at most this share of requests is hedged
 
 #---------------------------------------------------
 #---------------Image Target Size-------------------
@@ -77,10 +138,117 @@ VALIDATION_MAX_RETRIES = 2
 MAX_WIDTH = 768
 MAX_HEIGHT = 512
 
+#---------------------------------------------------
+#---------------Image Preprocessing-----------------
+
+IMAGE_WORKERS = 2                      # decode/resize processes; 0 runs them on a thread instead
+MAX_IMAGE_BYTES = 15 * 1024 * 1024     # encoded upload size
+MAX_IMAGE_PIXELS = 50_000_000          # width * height read from the header, checked before decoding
+IMAGE_PASSTHROUGH_FORMATS = ("JPEG", "WEBP")  # uploads already within MAX_WIDTH x MAX_HEIGHT are sent as uploaded
+IMAGE_PASSTHROUGH_MAX_BYTES = 512 * 1024     # ... unless they are bigger than this (a near-lossless file is re-encoded)
+IMAGE_ENCODE_FORMAT = "JPEG"           # format of re-encoded images: JPEG or WEBP
+IMAGE_ENCODE_QUALITY = 85              # see `python -m benchmarks.image_handoff` for bytes and fidelity per quality
+
+#---------------------------------------------------
+#---------------Card Crop---------------------------
+
+CARD_CROP_ENABLED = True               # cut the card out of the photo (and straighten it) before the resize
+CARD_CROP_AREA_RANGE = (0.08, 0.85)    # share of the frame the detected card may cover; outside, the full frame is kept
+CARD_CROP_ASPECT_RANGE = (1.35, 1.85)  # long/short side of the detected card (ID-1 cards are 1.586)
+CARD_CROP_MARGIN = 0.03                # the crop is grown by this share so the card edges stay in
+
+#---------------------------------------------------
+#---------------Image Pre-screen--------------------
+
+PRESCREEN_ENABLED = True                # reject obvious non-cards locally, before the model call
+PRESCREEN_MIN_COLORFULNESS = 6.0        # grayscale photocopy when both colorfulness and saturation are below
+PRESCREEN_MIN_SATURATION = 0.06         # mean HSV saturation, 0-1
+PRESCREEN_MIN_CONTRAST = 8.0            # luminance standard deviation, 0-255; below is a blank image
+PRESCREEN_MIN_SHARPNESS = 25.0          # variance of the Laplacian at 384 px; below is too blurry to read
+PRESCREEN_ASPECT_RANGE = (1.15, 2.4)    # long/short side of a cropped card; full frames (no card found) are not checked
+PRESCREEN_TEMPLATES_PATH = "prescreen_templates.json"  # {"name": "hex pHash"} of known bad images
+PRESCREEN_TEMPLATE_DISTANCE = 6         # max Hamming distance (of 64 bits) to count as a template match
+
+#---------------------------------------------------
+#---------------Uploads-----------------------------
+
+UPLOAD_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp")  # sniffed from the first bytes, not the client's content type
+MAX_REQUEST_BYTES = 2 * MAX_IMAGE_BYTES + 1024 * 1024           # whole request body (/card carries two images)
+MAX_REQUEST_BYTES_BY_PATH = {                                   # overrides of MAX_REQUEST_BYTES
+    "/bulk": 2 * 1024 * 1024 * 1024,
+}
+
+#---------------------------------------------------
+#---------------Audit Log---------------------------
+
+AUDIT_LOG_DIR = "logs/audit"
+AUDIT_QUEUE_SIZE = 10000               # PV records held in memory; new ones are dropped (and counted) beyond this
+AUDIT_FLUSH_INTERVAL = 2               # seconds between background writes
+AUDIT_FLUSH_BATCH = 500                # write early once this many records are waiting
+AUDIT_ROTATE_BYTES = 64 * 1024 * 1024  # active JSONL segment size before it is gzipped
+
+#---------------------------------------------------
+#---------------Metrics-----------------------------
+
+METRICS_DIR = "logs/metrics"   # per-worker snapshots merged by /metrics
+METRICS_FLUSH_INTERVAL = 5     # seconds between snapshots; 0 keeps metrics worker-local
+
+#---------------------------------------------------
+#---------------Admission Control-------------------
+
+ADMISSION_QUEUE_SIZE = 200            # requests waiting for a slot; beyond this they get 503
+ADMISSION_MAX_WAIT = 30               # seconds; requests that would (or did) wait longer are shed
+ADMISSION_INITIAL_SERVICE_TIME = 5.0  # seconds per request until real durations are measured
+ADMISSION_PRIORITIES = {              # lower is admitted first
+    "front": 0,
+    "back": 0,
+    "card": 0,
+    "transcript": 1,
+    "bulk": 2,
+    "jobs": 2,
+}
+CLIENT_RATE_LIMIT_STORAGE = "memory://"  # slowapi storage, per worker; "redis://host:6379" shares it
+CLIENT_RATE_LIMITS = {                   # per client address
+    "front": "60/minute",
+    "back": "60/minute",
+    "card": "60/minute",
+    "transcript": "30/minute",
+    "bulk": "5/minute",
+    "jobs": "10/minute",
+}
+
+#---------------------------------------------------
+#---------------Bulk Extraction---------------------
+
+BULK_WORKERS = 8
+BULK_QUEUE_SIZE = 16  # cards buffered between upload reading, workers and the response stream
+BULK_MAX_FILES = 5000
+BULK_MAX_ITEM_BYTES = 15 * 1024 * 1024  # per image, also caps decompressed zip members
+BULK_MAX_BACKPRESSURE_WAIT = 5  # seconds between key pool checks while every key is cooling
+
+#---------------------------------------------------
+#---------------Result Cache------------------------
+
+RESULT_CACHE_BACKEND = "memory"  # "memory" (per worker), "sqlite" (shared by workers on one host) or "none"
+RESULT_CACHE_TTL = 3600
+RESULT_CACHE_MAX_ENTRIES = 1024
+RESULT_CACHE_MAX_BYTES = 16 * 1024 * 1024
+RESULT_CACHE_PATH = "logs/cache/results.sqlite"
+
 #---------------------------------------------------
 #---------------System conf-------------------------
 
 LOGS_PATH = "logs/service.log"
-PV_PATH = "logs/pv"
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "json"             # service.log format: "json" (one object per line) or "text"; the console stays text
+LOG_QUEUE_SIZE = 10000          # records waiting for the writer thread; beyond this they are dropped
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Share of INFO lines kept per logger (prefix match), sampled per request; warnings are always kept
+LOG_SAMPLING = {
+    "core.api_key_manager": 0.1,
+    "core.llm_client": 0.1,
+    "core.session_pool": 0.1,
+}
 PORT= 8000
 HOST="0.0.0.0"
\ No newline at end of file
@@ -0,0 +1,148 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+from config import (
+    ADMISSION_INITIAL_SERVICE_TIME, ADMISSION_MAX_WAIT, ADMISSION_PRIORITIES, ADMISSION_QUEUE_SIZE,
+    MAX_IN_FLIGHT_PER_KEY
+)
+from core.api_key_manager import APIKeyManager
+from core.metrics import ADMISSION_WAIT, ADMISSIONS
+from exceptions.admission_exceptions import AdmissionRejectedError
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    """
+    Priority gate in front of the LLM client.
+
+    At most `capacity()` requests run at once: what the ready keys can take at
+    `max_in_flight_per_key` each. Further requests wait in a bounded queue, lowest priority
+    value first (ADMISSION_PRIORITIES per endpoint), FIFO within a priority. A request that
+    can be shed is rejected up front when waiting would be pointless:
+    - 429 when every key is cooling or out of budget for longer than `max_wait`;
+    - 503 when the queue is full or the estimated wait exceeds `max_wait`, or when it has
+      waited `max_wait` without being admitted.
+    Both carry the estimated wait as Retry-After. Background work (bulk items, job batches)
+    is never shed; it just queues behind the interactive endpoints.
+    """
+
+    def __init__(self,
+                 api_key_manager: APIKeyManager,
+                 max_queue: int = ADMISSION_QUEUE_SIZE,
+                 max_wait: float = ADMISSION_MAX_WAIT,
+                 max_in_flight_per_key: int = MAX_IN_FLIGHT_PER_KEY):
+        self.api_key_manager = api_key_manager
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.max_in_flight_per_key = max_in_flight_per_key
+        self.active = 0
+        self.queued = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._service_time = ADMISSION_INITIAL_SERVICE_TIME  # EWMA of admitted request durations
+
+    def capacity(self) -> int:
+        return max(1, self.api_key_manager.ready_key_count() * self.max_in_flight_per_key)
+
+    def estimate_wait(self, priority: int) -> float:
+        """Seconds a new request of `priority` would wait: key recovery, or its turn in the queue."""
+        key_wait = self.api_key_manager.seconds_until_ready()
+        capacity = self.capacity()
+        ahead = sum(1 for p, _, fut in self._waiters if p <= priority and not fut.done())
+        if self.active < capacity and ahead == 0:
+            return key_wait
+        # Requests ahead (plus the running ones) drain `capacity` at a time
+        rounds = (ahead + max(0, self.active - capacity + 1)) / capacity
+        return max(key_wait, rounds * self._service_time)
+
+    def stats(self) -> dict:
+        return {"active": self.active, "queued": self.queued, "capacity": self.capacity(),
+                "service_time": self._service_time}
+
+    @asynccontextmanager
+    async def admit(self, endpoint: str, shed: bool = True):
+        """Hold one slot for the body of the `async with`; raises AdmissionRejectedError when shed."""
+        priority = ADMISSION_PRIORITIES.get(endpoint, max(ADMISSION_PRIORITIES.values(), default=0))
+        waited = await self._acquire(endpoint, priority, shed)
+        ADMISSION_WAIT.observe(waited, endpoint=endpoint)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._service_time = 0.9 * self._service_time + 0.1 * (time.monotonic() - start)
+            self.active -= 1
+            self._dispatch()
+
+    def _reject(self, endpoint: str, outcome: str, status_code: int, retry_after: float, message: str):
+        ADMISSIONS.inc(endpoint=endpoint, outcome=outcome)
+        logger.warning(f"[ADMISSION] Shedding {endpoint}: {message} (retry after {retry_after:.1f}s)")
+        raise AdmissionRejectedError(message, status_code, retry_after)
+
+    async def _acquire(self, endpoint: str, priority: int, shed: bool) -> float:
+        if shed:
+            key_wait = self.api_key_manager.seconds_until_ready()
+            if key_wait > self.max_wait:
+                self._reject(endpoint, "rejected_keys", 429, key_wait, "All API keys are cooling or out of quota")
+
+        if not self.queued and self.active < self.capacity():
+            self.active += 1
+            ADMISSIONS.inc(endpoint=endpoint, outcome="admitted")
+            return 0.0
+
+        if shed:
+            if self.queued >= self.max_queue:
+                self._reject(endpoint, "rejected_queue_full", 503, self.estimate_wait(priority),
+                             f"Admission queue full ({self.max_queue})")
+            estimate = self.estimate_wait(priority)
+            if estimate > self.max_wait:
+                self._reject(endpoint, "rejected_wait", 503, estimate, f"Estimated wait {estimate:.1f}s")
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            while not future.done():
+                # Re-check now and then: capacity grows when cooling keys come back
+                timeout = 1.0
+                if shed:
+                    timeout = min(timeout, self.max_wait - (time.monotonic() - start))
+                    if timeout <= 0:
+                        break
+                await asyncio.wait({future}, timeout=timeout)
+                self._dispatch()
+        except BaseException:
+            self._abandon(future)
+            raise
+        if not future.done():
+            self._abandon(future)
+            self._reject(endpoint, "rejected_timeout", 503, self.estimate_wait(priority),
+                         f"Not admitted within {self.max_wait:.0f}s")
+        ADMISSIONS.inc(endpoint=endpoint, outcome="admitted")
+        return time.monotonic() - start
+
+    def _abandon(self, future: asyncio.Future):
+        if future.done():
+            # Admitted just as we gave up: hand the slot on
+            if not future.cancelled():
+                self.active -= 1
+                self._dispatch()
+        else:
+            future.cancel()
+            self.queued -= 1
+
+    def _dispatch(self):
+        capacity = self.capacity()
+        while self._waiters and self.active < capacity:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue  # abandoned
+            self.queued -= 1
+            self.active += 1
+            future.set_result(None)
@@ -1,109 +1,457 @@
+import hashlib
 import os
 import random
 import time
 import heapq
 import threading
 import logging
-from typing import List, Dict
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
 from dotenv import load_dotenv
 
-from config import DEFAULT_COOLDOWN, VALIDATION_FAILURE_PENALTY
+from config import (
+    DEFAULT_COOLDOWN, KEY_RPM_LIMIT, KEY_TPM_LIMIT, MAX_IN_FLIGHT_PER_KEY, VALIDATION_FAILURE_PENALTY
+)
+from core.rate_limiter import KeyBudget
 load_dotenv(dotenv_path="./api_keys.env")
 
 logger = logging.getLogger(__name__)
 
-class APIKeyManager:
-    """Efficient API key manager with cooldown and failure tracking."""
+def key_id(key: str) -> str:
+    """Stable, non-secret label for a key (Google keys all share the same leading characters)."""
+    return "k-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:8]
+
+
+class _KeyBag:
+    """Unordered key set with O(1) add, discard and uniform random choice."""
 
+    __slots__ = ("items", "index")
 
     def __init__(self):
+        self.items: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def add(self, key: str):
+        if key not in self.index:
+            self.index[key] = len(self.items)
+            self.items.append(key)
+
+    def discard(self, key: str):
+        i = self.index.pop(key, None)
+        if i is None:
+            return
+        last = self.items.pop()
+        if last != key:
+            self.items[i] = last
+            self.index[last] = i
+
+    def choice(self) -> str:
+        return random.choice(self.items)
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class APIKeyManager:
+    """Efficient API key manager with cooldown and failure tracking.
+
+    Every key lives in exactly one place:
+    - ready: bucketed by failure_count, with a heap of non-empty levels
+    - saturated: ready but already at `max_in_flight_per_key`
+    - cooling: a lazy-deletion heap ordered by the later of cooldown_until (failures) and
+      throttled_until (out of RPM/TPM budget)
+    so selecting a key and marking success/failure are O(log n) under the lock.
+    A ready key found out of budget at selection time is parked in cooling until its budget refills.
+    """
+
+
+    def __init__(self,
+                 max_in_flight_per_key: int = MAX_IN_FLIGHT_PER_KEY,
+                 keys: Optional[List[str]] = None,
+                 rpm_limit: float = KEY_RPM_LIMIT,
+                 tpm_limit: float = KEY_TPM_LIMIT):
+        self.max_in_flight_per_key = max_in_flight_per_key
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._budgets: Dict[str, KeyBudget] = {}
+        # Shared-state bookkeeping (see core.key_state): local changes not yet published,
+        # cumulative usage per key, and when each key's shared fields last changed
+        self._by_id: Dict[str, str] = {}
+        self._dirty: Set[str] = set()
+        self._usage: Dict[str, List[float]] = {}
+        self._usage_dirty: Set[str] = set()
+        self._state_updated: Dict[str, float] = {}
         self.api_keys: List[str] = []
         self.key_metadata: Dict[str, dict] = {}
-        self.available_keys: List[tuple[float, str]] = []  # Heap of (cooldown_until, key)
         self.lock = threading.RLock()
-        self._initialize_keys()
-
-    def _initialize_keys(self):
-        with self.lock:
-            i = 1
-            while (key := os.getenv(f"GOOGLE_API_KEY_{i}")):
-                if key not in self.key_metadata:
-                    self.api_keys.append(key)
-                    self.key_metadata[key] = {
-                        'success_count': 0,
-                        'failure_count': 0,
-                        'cooldown_until': 0.0
-                    }
-                    heapq.heappush(self.available_keys, (0.0, key))
-                    logger.info(f"[ENV] Loaded GOOGLE_API_KEY_{i}")
-                else:
-                    logger.debug(f"[ENV] Duplicate key GOOGLE_API_KEY_{i} skipped")
-                i += 1
+        self._listeners: List[Callable[[str, str], None]] = []
+        self._ready: Dict[int, _KeyBag] = {}
+        self._ready_levels: List[int] = []  # Heap of failure counts that may have ready keys
+        self._levels_in_heap: Set[int] = set()
+        self._saturated = _KeyBag()
+        self._cooling: List[Tuple[float, int, str]] = []  # Heap of (cooldown_until, version, key)
+        self._cooling_count = 0
+        self._placement: Dict[str, list] = {}  # key -> [state, ready level, heap version]
+        self._initialize_keys(keys)
+
+    def _initialize_keys(self, keys: Optional[List[str]] = None):
+        with self.lock:
+            if keys is not None:
+                for key in keys:
+                    self._register_key(key)
+            else:
+                i = 1
+                while (key := os.getenv(f"GOOGLE_API_KEY_{i}")):
+                    if key not in self.key_metadata:
+                        self._register_key(key)
+                        logger.info(f"[ENV] Loaded GOOGLE_API_KEY_{i}")
+                    else:
+                        logger.debug(f"[ENV] Duplicate key GOOGLE_API_KEY_{i} skipped")
+                    i += 1
 
             if not self.api_keys:
                 raise RuntimeError("No API keys found in .env file.")
             logger.info(f"[ENV] Total API keys loaded: {len(self.api_keys)}")
 
-    def get_best_key(self) -> str:
+    def _register_key(self, key: str):
+        self.api_keys.append(key)
+        self.key_metadata[key] = {
+            'success_count': 0,
+            'failure_count': 0,
+            'cooldown_until': 0.0,
+            'throttled_until': 0.0,
+            'quota_errors': 0,  # consecutive, reset by a success
+            'in_flight': 0
+        }
+        self._budgets[key] = KeyBudget(self.rpm_limit, self.tpm_limit, time.time())
+        self._by_id[key_id(key)] = key
+        self._usage[key] = [0.0, 0.0]
+        self._state_updated[key] = 0.0
+        self._placement[key] = [None, None, 0]
+        self._place(key, time.time())
+
+    def _detach(self, key: str):
+        placement = self._placement[key]
+        state, level = placement[0], placement[1]
+        if state == "ready":
+            self._ready[level].discard(key)
+        elif state == "saturated":
+            self._saturated.discard(key)
+        elif state == "cooling":
+            # The heap entry goes stale through the version bump in _place
+            self._cooling_count -= 1
+        placement[0] = None
+
+    def _place(self, key: str, now: float):
+        """Move `key` to the structure matching its current metadata."""
+        self._detach(key)
+        md = self.key_metadata[key]
+        placement = self._placement[key]
+        until = max(md['cooldown_until'], md['throttled_until'])
+        if until > now:
+            placement[0] = "cooling"
+            placement[2] += 1
+            heapq.heappush(self._cooling, (until, placement[2], key))
+            self._cooling_count += 1
+        elif md['in_flight'] >= self.max_in_flight_per_key:
+            placement[0] = "saturated"
+            self._saturated.add(key)
+        else:
+            level = md['failure_count']
+            placement[0], placement[1] = "ready", level
+            self._ready.setdefault(level, _KeyBag()).add(key)
+            if level not in self._levels_in_heap:
+                self._levels_in_heap.add(level)
+                heapq.heappush(self._ready_levels, level)
+
+    def _peek_cooling(self) -> Optional[Tuple[float, int, str]]:
+        # Drop entries superseded by a later placement of the same key
+        while self._cooling:
+            cd, version, key = self._cooling[0]
+            placement = self._placement.get(key)
+            if placement is not None and placement[0] == "cooling" and placement[2] == version:
+                return self._cooling[0]
+            heapq.heappop(self._cooling)
+        return None
+
+    def _promote_expired(self, now: float):
+        while (entry := self._peek_cooling()) is not None and entry[0] <= now:
+            heapq.heappop(self._cooling)
+            self._placement[entry[2]][0] = None
+            self._cooling_count -= 1
+            self._place(entry[2], now)
+
+    def _lowest_ready_bucket(self) -> Optional[_KeyBag]:
+        while self._ready_levels:
+            level = self._ready_levels[0]
+            bucket = self._ready.get(level)
+            if bucket:
+                return bucket
+            heapq.heappop(self._ready_levels)
+            self._levels_in_heap.discard(level)
+            self._ready.pop(level, None)
+        return None
+
+    def _has_budget(self, key: str, tokens: float, now: float) -> bool:
+        """True when `key` can take a request of `tokens` now; otherwise park it until it can."""
+        wait = self._budgets[key].wait(tokens, now)
+        if wait <= 0:
+            return True
+        self.key_metadata[key]['throttled_until'] = now + wait
+        self._place(key, now)
+        logger.debug(f"[BUDGET] {key_id(key)} out of budget for {wait:.1f}s")
+        return False
+
+    def _select(self, tokens: float, now: float, oversubscribe: bool = True) -> Optional[str]:
+        # Ready keys under their in-flight cap with the lowest failure_count (random among ties)
+        while (bucket := self._lowest_ready_bucket()) is not None:
+            chosen = bucket.choice()
+            if self._has_budget(chosen, tokens, now):
+                logger.debug(f"Selected ready key {key_id(chosen)} with failure_count={self.key_metadata[chosen]['failure_count']}")
+                return chosen
+
+        # All ready keys are at their in-flight cap: oversubscribe one of them
+        while oversubscribe and self._saturated:
+            chosen = self._saturated.choice()
+            if self._has_budget(chosen, tokens, now):
+                logger.debug(f"All ready keys saturated; oversubscribing {key_id(chosen)}")
+                return chosen
+        return None
+
+    def get_best_key(self, tokens: float = 0.0) -> str:
+        """Pick a key; `tokens` is the estimated input size of the request it will carry."""
         with self.lock:
+            if not self.api_keys:
+                raise RuntimeError("No API keys available")
             now = time.time()
-            logger.debug("Entering get_best_key()")
-            # Drain heap once
-            ready_keys = []
-            temp = []
-            while self.available_keys:
-                cd, k = heapq.heappop(self.available_keys)
-                md = self.key_metadata[k]
-                if md['cooldown_until'] <= now:
-                    ready_keys.append(k)
-                else:
-                    temp.append((md['cooldown_until'], k))
-
-            # Restore cooling keys
-            for entry in temp:
-                heapq.heappush(self.available_keys, entry)
-
-            # If any ready, pick the one with lowest failure_count (randomize ties)
-            if ready_keys:
-                # gather min failure_count
-                min_fail = min(self.key_metadata[k]['failure_count'] for k in ready_keys)
-                candidates = [k for k in ready_keys if self.key_metadata[k]['failure_count'] == min_fail]
-                chosen = random.choice(candidates) if len(candidates) > 1 else candidates[0]
-                logger.debug(f"Selected ready key {chosen[:6]} with failure_count={min_fail}")
-                # Refresh its heap entry
-                self._refresh_key_in_heap(chosen)
+            self._promote_expired(now)
+            chosen = self._select(tokens, now)
+            if chosen is not None:
                 return chosen
 
             # Otherwise fallback to the soonest cooling key
-            soonest = min(self.key_metadata, key=lambda k: self.key_metadata[k]['cooldown_until'])
-            logger.warning(f"All keys cooling; using soonest: {soonest[:6]}")
+            soonest = self._peek_cooling()[2]
+            logger.warning(f"All keys cooling or out of budget; using soonest: {key_id(soonest)}")
             return soonest
 
+    def acquire_key(self, tokens: float = 0.0) -> str:
+        """
+        Select the best key, charge one request and `tokens` to its budget, and count it as
+        in flight until `release_key` is called.
+        """
+        with self.lock:
+            key = self.get_best_key(tokens)
+            self._check_out(key, tokens, time.time())
+            return key
+
+    def try_acquire_key(self, tokens: float = 0.0, exclude: Optional[str] = None) -> Optional[str]:
+        """
+        Like `acquire_key`, for optional extra calls (hedges): only a ready key under its in-flight
+        cap, with budget, other than `exclude`; None rather than oversubscribing or a cooling key.
+        """
+        with self.lock:
+            now = time.time()
+            self._promote_expired(now)
+            set_aside = exclude is not None and self._placement.get(exclude, [None])[0] == "ready"
+            if set_aside:
+                self._detach(exclude)
+            try:
+                key = self._select(tokens, now, oversubscribe=False)
+            finally:
+                if set_aside:
+                    self._place(exclude, now)
+            if key is not None:
+                self._check_out(key, tokens, now)
+            return key
+
+    def _check_out(self, key: str, tokens: float, now: float):
+        self._budgets[key].take(tokens, now)
+        usage = self._usage[key]
+        usage[0] += 1
+        usage[1] += tokens
+        self._usage_dirty.add(key)
+        self.key_metadata[key]['in_flight'] += 1
+        if self._placement[key][0] == "ready":
+            self._place(key, now)
+
+    def release_key(self, key: str):
+        with self.lock:
+            md = self.key_metadata.get(key)
+            if md and md['in_flight'] > 0:
+                md['in_flight'] -= 1
+                if self._placement[key][0] == "saturated":
+                    self._place(key, time.time())
+
+    def ready_key_count(self) -> int:
+        with self.lock:
+            self._promote_expired(time.time())
+            return len(self.api_keys) - self._cooling_count
+
+    def seconds_until_ready(self) -> float:
+        """0 when a key is ready now, otherwise the time until the soonest cooldown ends."""
+        with self.lock:
+            now = time.time()
+            self._promote_expired(now)
+            if self._cooling_count < len(self.api_keys):
+                return 0.0
+            entry = self._peek_cooling()
+            return max(0.0, entry[0] - now) if entry else 0.0
+
+    def pool_stats(self) -> dict:
+        """
+        Monitoring snapshot: key count per state and per-key counters and current limits labelled
+        with `key_id`. "throttled" keys are cooling only because they are out of budget.
+        """
+        with self.lock:
+            now = time.time()
+            self._promote_expired(now)
+            throttled = sum(1 for key, md in self.key_metadata.items()
+                            if self._placement[key][0] == "cooling" and md['cooldown_until'] <= now)
+            return {
+                "ready": sum(len(bag) for bag in self._ready.values()),
+                "saturated": len(self._saturated),
+                "cooling": self._cooling_count - throttled,
+                "throttled": throttled,
+                "keys": {key_id(key): {**md, **self._budgets[key].snapshot()}
+                         for key, md in self.key_metadata.items()},
+            }
+
     def mark_key_success(self, key: str):
         with self.lock:
             if key not in self.key_metadata:
-                logger.warning(f"mark_key_success: unknown key {key[:6]}")
+                logger.warning(f"mark_key_success: unknown key {key_id(key)}")
                 return
             md = self.key_metadata[key]
+            budget = self._budgets[key]
+            if md['failure_count'] or md['cooldown_until'] or not budget.at_ceiling():
+                self._touch(key)
             md['success_count'] += 1
             md['failure_count'] = 0
+            md['quota_errors'] = 0
             md['cooldown_until'] = 0.0
-            self._refresh_key_in_heap(key)
-            logger.info(f"[KEY-SUCCESS] {key[:6]} success_count={md['success_count']} cooldown reset")
+            budget.on_success()
+            self._place(key, time.time())
+            logger.info(f"[KEY-SUCCESS] {key_id(key)} success_count={md['success_count']} cooldown reset",
+                        extra={"key": key_id(key)})
 
     def mark_key_failure(self, key: str, cooldown_seconds: float = None):
         with self.lock:
             if key not in self.key_metadata:
-                logger.warning(f"mark_key_failure: unknown key {key[:6]}")
+                logger.warning(f"mark_key_failure: unknown key {key_id(key)}")
                 return
             md = self.key_metadata[key]
             md['failure_count'] += 1
             base = cooldown_seconds or DEFAULT_COOLDOWN
             cd = base * (1.5 ** min(md['failure_count'], 4))
-            md['cooldown_until'] = time.time() + cd
-            self._refresh_key_in_heap(key)
-            logger.warning(f"[KEY-FAIL] {key[:6]} failure_count={md['failure_count']} cooldown={cd:.1f}s")
+            now = time.time()
+            md['cooldown_until'] = now + cd
+            self._touch(key)
+            self._place(key, now)
+            logger.warning(f"[KEY-FAIL] {key_id(key)} failure_count={md['failure_count']} cooldown={cd:.1f}s",
+                           extra={"key": key_id(key), "cooldown_s": round(cd, 1)})
+
+    def mark_quota_exceeded(self, key: str, kind: Optional[str] = None, retry_after: Optional[float] = None):
+        """
+        A ResourceExhausted on `key`: cut the limit named by `kind` ("rpm", "tpm", None for both)
+        and park the key until its budget refills or `retry_after` passes, whichever is later.
+        Without a `retry_after`, or when the named limit is disabled, the budget says nothing
+        about when the key recovers: it is parked for at least a backoff growing with each
+        consecutive quota error, from `retry_after` or DEFAULT_COOLDOWN. Daily quota errors
+        fall back to the failure cooldown.
+        """
+        if kind == "daily":
+            self.mark_key_failure(key)
+            return
+        with self.lock:
+            if key not in self.key_metadata:
+                logger.warning(f"mark_quota_exceeded: unknown key {key_id(key)}")
+                return
+            budget = self._budgets[key]
+            budget.on_quota_error(kind)
+            now = time.time()
+            md = self.key_metadata[key]
+            md['quota_errors'] += 1
+            wait = max(retry_after or 0.0, budget.wait(0.0, now))
+            if retry_after is None or not budget.enforces(kind):
+                # Grows from the server's hint when it gave one, from the failure cooldown otherwise
+                backoff = (retry_after or DEFAULT_COOLDOWN) * 1.5 ** min(md['quota_errors'] - 1, 4)
+                wait = max(wait, backoff)
+            md['throttled_until'] = max(md['throttled_until'], now + wait)
+            self._touch(key)
+            self._place(key, now)
+            limits = budget.snapshot()
+            logger.warning(f"[KEY-QUOTA] {key_id(key)} {kind or 'quota'} exceeded, rpm={limits['rpm_limit']:.1f} "
+                           f"tpm={limits['tpm_limit']:.0f}, parked {wait:.1f}s",
+                           extra={"key": key_id(key), "parked_s": round(wait, 1)})
+
+    def set_rate_limits(self, rpm_limit: float, tpm_limit: float):
+        """Replace every key's budget (fresh, full buckets); 0 disables a limit."""
+        with self.lock:
+            self.rpm_limit, self.tpm_limit = rpm_limit, tpm_limit
+            now = time.time()
+            for key, md in self.key_metadata.items():
+                self._budgets[key] = KeyBudget(rpm_limit, tpm_limit, now)
+                md['throttled_until'] = 0.0
+                self._place(key, now)
+
+    # ---- shared state (see core.key_state) ----
+
+    def _touch(self, key: str):
+        self._state_updated[key] = time.time()
+        self._dirty.add(key)
+
+    def export_shared_state(self) -> Tuple[Dict[str, dict], Dict[str, List[float]]]:
+        """
+        Changes to publish, by `key_id`: shared fields of keys touched since the last export,
+        and the cumulative (requests, tokens) this process has sent through each key.
+        """
+        with self.lock:
+            states = {}
+            for key in self._dirty:
+                md = self.key_metadata[key]
+                states[key_id(key)] = {
+                    'failure_count': md['failure_count'],
+                    'cooldown_until': md['cooldown_until'],
+                    'throttled_until': md['throttled_until'],
+                    **self._budgets[key].snapshot(),
+                    'updated_at': self._state_updated[key],
+                }
+            usage = {key_id(key): list(self._usage[key]) for key in self._usage_dirty}
+            self._dirty.clear()
+            self._usage_dirty.clear()
+            return states, usage
+
+    def requeue_shared_state(self, key_ids: List[str]):
+        """Mark keys for export again after a failed publish."""
+        with self.lock:
+            for kid in key_ids:
+                key = self._by_id.get(kid)
+                if key is not None:
+                    self._dirty.add(key)
+                    self._usage_dirty.add(key)
+
+    def apply_shared_state(self, states: Dict[str, dict], usage: Dict[str, List[float]]):
+        """
+        Merge other processes' view: newer shared fields win (throttling never shortens), and
+        their usage since the last merge is charged to the local budgets.
+        """
+        with self.lock:
+            now = time.time()
+            for kid, state in states.items():
+                key = self._by_id.get(kid)
+                if key is None or state['updated_at'] <= self._state_updated[key]:
+                    continue
+                md = self.key_metadata[key]
+                md['failure_count'] = state['failure_count']
+                md['cooldown_until'] = state['cooldown_until']
+                md['throttled_until'] = max(md['throttled_until'], state['throttled_until'])
+                self._budgets[key].set_limits(state['rpm_limit'], state['tpm_limit'])
+                self._state_updated[key] = state['updated_at']
+                self._place(key, now)
+            for kid, (requests, tokens) in usage.items():
+                key = self._by_id.get(kid)
+                if key is not None:
+                    self._budgets[key].charge(requests, tokens, now)
 
     def mark_validation_failure(self, key: str):
         self.mark_key_failure(key, VALIDATION_FAILURE_PENALTY)
@@ -111,20 +459,37 @@ class APIKeyManager:
     def add_api_key(self, key: str):
         with self.lock:
             if key in self.key_metadata:
-                logger.info(f"[ADD] Key {key[:6]} already present")
+                logger.info(f"[ADD] Key {key_id(key)} already present")
                 return
-            self.api_keys.append(key)
-            self.key_metadata[key] = {
-                'success_count': 0,
-                'failure_count': 0,
-                'cooldown_until': 0.0
-            }
-            heapq.heappush(self.available_keys, (0.0, key))
-            logger.info(f"[ADD] New key {key[:6]} added")
-
-    def _refresh_key_in_heap(self, key: str):
-        # Remove stale entries and reinsert with updated cooldown
-        cd = self.key_metadata[key]['cooldown_until']
-        self.available_keys = [(c, k) for (c, k) in self.available_keys if k != key]
-        heapq.heappush(self.available_keys, (cd, key))
-        heapq.heapify(self.available_keys)
+            self._register_key(key)
+            logger.info(f"[ADD] New key {key_id(key)} added")
+        self._notify("added", key)
+
+    def remove_api_key(self, key: str):
+        with self.lock:
+            if key not in self.key_metadata:
+                logger.info(f"[REMOVE] Key {key_id(key)} not present")
+                return
+            self._detach(key)
+            self.api_keys.remove(key)
+            del self.key_metadata[key]
+            del self._budgets[key]
+            del self._by_id[key_id(key)]
+            del self._usage[key]
+            del self._state_updated[key]
+            self._dirty.discard(key)
+            self._usage_dirty.discard(key)
+            del self._placement[key]
+            logger.info(f"[REMOVE] Key {key_id(key)} removed")
+        self._notify("removed", key)
+
+    def add_listener(self, callback: Callable[[str, str], None]):
+        """Register `callback(event, key)`, called with "added" or "removed" when the key set changes."""
+        self._listeners.append(callback)
+
+    def _notify(self, event: str, key: str):
+        for callback in self._listeners:
+            try:
+                callback(event, key)
+            except Exception as e:
+                logger.warning(f"[LISTENER] {event} callback failed for key {key_id(key)}: {e}")
@@ -0,0 +1,260 @@
+"""
+Append-only audit log of prompt values (PV).
+
+Requests hand their PV to `audit_log.record()`, which only serializes it into an
+in-memory queue. A background task appends the queue to a per-worker JSONL segment;
+full segments (and the last one, on shutdown) are gzipped. Cost reports read the
+segments back with `iter_records` / `aggregate`, or from the command line:
+
+    python -m core.audit_log --since 2026-10-01 --by indicator day
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter as Tally
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from config import (
+    AUDIT_FLUSH_BATCH, AUDIT_FLUSH_INTERVAL, AUDIT_LOG_DIR, AUDIT_QUEUE_SIZE, AUDIT_ROTATE_BYTES
+)
+from core.metrics import AUDIT_RECORDS
+
+logger = logging.getLogger(__name__)
+
+
+class AuditLog:
+    """Buffered PV sink: never blocks the caller, drops (and counts) records once the queue is full."""
+
+    def __init__(self,
+                 directory: str = AUDIT_LOG_DIR,
+                 max_queue: int = AUDIT_QUEUE_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL,
+                 flush_batch: int = AUDIT_FLUSH_BATCH,
+                 rotate_bytes: int = AUDIT_ROTATE_BYTES):
+        self.directory = directory
+        self.max_queue = max_queue
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.rotate_bytes = rotate_bytes
+        self.dropped = 0
+        self._pending: List[str] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._write_lock = threading.Lock()
+        self._segment: Optional[str] = None
+        self._segment_size = 0
+        self._segment_seq = 0
+
+    def record(self, indicator: str, pv: dict) -> bool:
+        """Queue one PV; returns False when it was dropped because the queue is full."""
+        if len(self._pending) >= self.max_queue:
+            self.dropped += 1
+            AUDIT_RECORDS.inc(outcome="dropped")
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"[AUDIT] Queue full ({self.max_queue}), {self.dropped} record(s) dropped so far")
+            return False
+        self._pending.append(json.dumps({
+            "timestamp": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+            "indicator": indicator,
+            "pid": os.getpid(),
+            "pv": pv,
+        }, ensure_ascii=False, default=list))
+        if len(self._pending) >= self.flush_batch and self._wakeup is not None:
+            self._wakeup.set()
+        return True
+
+    async def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Write everything still queued and compress the active segment."""
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        await asyncio.to_thread(self._close_segment)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        lines, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+            AUDIT_RECORDS.inc(len(lines), outcome="written")
+        except Exception as e:
+            logger.error(f"[AUDIT] Writing {len(lines)} record(s) failed: {e}")
+            # Keep them for the next flush, as far as the queue bound allows
+            room = max(0, self.max_queue - len(self._pending))
+            self._pending[:0] = lines[-room:] if room else []
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    # ---- segments (writer thread) ----
+
+    def _write(self, lines: List[str]):
+        data = ("\n".join(lines) + "\n").encode("utf-8")
+        with self._write_lock:
+            if self._segment is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._segment_seq += 1
+                stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+                # Time first so segments sort chronologically; pid + seq keep workers and rotations apart
+                self._segment = os.path.join(self.directory, f"audit-{stamp}-{os.getpid()}-{self._segment_seq}.jsonl")
+                self._segment_size = 0
+            with open(self._segment, "ab") as f:
+                f.write(data)
+            self._segment_size += len(data)
+            if self._segment_size >= self.rotate_bytes:
+                self._compress_segment()
+
+    def _close_segment(self):
+        with self._write_lock:
+            if self._segment is not None:
+                self._compress_segment()
+
+    def _compress_segment(self):
+        path, self._segment = self._segment, None
+        with open(path, "rb") as src, gzip.open(f"{path}.gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        logger.info(f"[AUDIT] Rotated {os.path.basename(path)} ({self._segment_size} bytes)")
+
+
+audit_log = AuditLog()
+
+
+# ---- query helpers ----
+
+def segment_paths(directory: str = AUDIT_LOG_DIR) -> List[str]:
+    """Compressed and active segments, oldest first."""
+    paths = glob.glob(os.path.join(directory, "audit-*.jsonl")) + glob.glob(os.path.join(directory, "audit-*.jsonl.gz"))
+    return sorted(paths, key=os.path.basename)
+
+
+def _read_segment(path: str) -> Iterator[dict]:
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # last line of a worker that died mid-write
+    except (OSError, EOFError) as e:
+        logger.warning(f"[AUDIT] Skipping unreadable segment {path}: {e}")
+
+
+def iter_records(directory: str = AUDIT_LOG_DIR,
+                 indicators: Optional[Sequence[str]] = None,
+                 since: Optional[float] = None,
+                 until: Optional[float] = None) -> Iterator[dict]:
+    """Records in segment order, filtered by indicator and by PV start_time (epoch seconds)."""
+    for path in segment_paths(directory):
+        for record in _read_segment(path):
+            if indicators and record.get("indicator") not in indicators:
+                continue
+            start = record.get("pv", {}).get("start_time", 0)
+            if (since is not None and start < since) or (until is not None and start >= until):
+                continue
+            yield record
+
+
+def recent_records(directory: str = AUDIT_LOG_DIR,
+                   indicators: Optional[Sequence[str]] = None,
+                   limit: int = 50) -> List[dict]:
+    """The last `limit` matching records, oldest first, reading segments from the newest back."""
+    collected: List[dict] = []
+    for path in reversed(segment_paths(directory)):
+        matching = [r for r in _read_segment(path) if not indicators or r.get("indicator") in indicators]
+        collected[:0] = matching
+        if len(collected) >= limit:
+            break
+    return collected[-limit:] if limit > 0 else []
+
+
+def _group_value(record: dict, field: str) -> str:
+    if field == "day":
+        return datetime.fromtimestamp(record["pv"].get("start_time", 0), timezone.utc).strftime("%Y-%m-%d")
+    if field == "hour":
+        return datetime.fromtimestamp(record["pv"].get("start_time", 0), timezone.utc).strftime("%Y-%m-%d %H:00")
+    return str(record.get(field))
+
+
+def aggregate(records: Iterable[dict], by: Sequence[str] = ("indicator",)) -> Dict[tuple, dict]:
+    """Cost totals per group (`by` fields: indicator, pid, day, hour)."""
+    groups: Dict[tuple, dict] = {}
+    for record in records:
+        pv = record.get("pv", {})
+        group = tuple(_group_value(record, field) for field in by)
+        totals = groups.setdefault(group, {
+            "requests": 0, "api_calls": 0, "input_tokens": 0.0, "output_tokens": 0.0, "image_bytes": 0,
+            "cache_hits": 0, "coalesced": 0, "duration_total": 0.0, "attempts": Tally(),
+        })
+        totals["requests"] += 1
+        totals["api_calls"] += pv.get("total_api_calls", 0)
+        totals["input_tokens"] += pv.get("total_input_tokens", 0)
+        totals["output_tokens"] += pv.get("total_output_tokens", 0)
+        totals["image_bytes"] += pv.get("image_bytes", 0)
+        totals["cache_hits"] += bool(pv.get("cache_hit"))
+        totals["coalesced"] += bool(pv.get("coalesced"))
+        totals["duration_total"] += pv.get("duration_total") or 0.0
+        totals["attempts"].update(attempt.get("status") or "unknown" for attempt in pv.get("attempts", []))
+    return groups
+
+
+def _parse_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Cost report from the PV audit log")
+    parser.add_argument("--dir", default=AUDIT_LOG_DIR)
+    parser.add_argument("--since", help="ISO date/time (UTC), inclusive")
+    parser.add_argument("--until", help="ISO date/time (UTC), exclusive")
+    parser.add_argument("--indicator", action="append", help="repeat to include several")
+    parser.add_argument("--by", nargs="+", default=["indicator"], choices=["indicator", "pid", "day", "hour"])
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    records = iter_records(args.dir, args.indicator, _parse_date(args.since), _parse_date(args.until))
+    groups = aggregate(records, args.by)
+    print(f"{' / '.join(args.by):<40} {'requests':>9} {'calls':>7} {'in_tok':>11} {'out_tok':>10} {'img_mb':>8} "
+          f"{'cache':>6} {'avg_s':>7}  attempts")
+    for group, totals in sorted(groups.items()):
+        avg = totals["duration_total"] / totals["requests"] if totals["requests"] else 0.0
+        attempts = ", ".join(f"{status}={count}" for status, count in sorted(totals["attempts"].items()))
+        print(f"{' / '.join(group):<40} {totals['requests']:>9} {totals['api_calls']:>7} "
+              f"{totals['input_tokens']:>11.0f} {totals['output_tokens']:>10.0f} "
+              f"{totals['image_bytes'] / 1e6:>8.1f} {totals['cache_hits']:>6} "
+              f"{avg:>7.2f}  {attempts}")
+    print(f"({sum(t['requests'] for t in groups.values())} record(s) in {time.perf_counter() - started:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
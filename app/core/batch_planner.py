@@ -0,0 +1,93 @@
+import json
+import logging
+from typing import List
+
+from config import (
+    AUDIT_LOG_DIR, BATCH_HISTORY_RECORDS, BATCH_OUTPUT_HEADROOM, BATCH_OUTPUT_RATIO, MAX_BATCH_SIZE,
+    MAX_OUTPUT_TOKENS, PROMPT_TRANSCRIPTION
+)
+from core.audit_log import recent_records
+from utils.client_utils import calculate_text_tokens
+
+logger = logging.getLogger(__name__)
+
+HISTORY_INDICATORS = ("id_card_transcription", "id_card_transcription_job")
+
+
+class AdaptiveBatcher:
+    """
+    Sizes transcription batches from estimated tokens instead of a fixed count.
+
+    Everything is measured with the PV token estimator, so its bias cancels out:
+    - `output_ratio` (output tokens per input token) is an EWMA over successful calls;
+    - `output_limit` is where answers get truncated, lowered by every truncated call
+      and raised by any successful call that produced more. Successful calls also
+      let it creep back towards MAX_OUTPUT_TOKENS, so one odd truncation is not sticky.
+    Both are replayed from the PV audit log at startup and updated as batches complete.
+    """
+
+    def __init__(self,
+                 max_batch_size: int = MAX_BATCH_SIZE,
+                 headroom: float = BATCH_OUTPUT_HEADROOM,
+                 output_ratio: float = BATCH_OUTPUT_RATIO,
+                 output_limit: float = MAX_OUTPUT_TOKENS,
+                 smoothing: float = 0.2,
+                 recovery: float = 0.02):
+        self.max_batch_size = max_batch_size
+        self.headroom = headroom
+        self.output_ratio = output_ratio
+        self.output_limit = float(output_limit)
+        self.ceiling = float(output_limit)
+        self.recovery = recovery
+        self.smoothing = smoothing
+        self.prompt_tokens = calculate_text_tokens(PROMPT_TRANSCRIPTION)
+
+    def estimate_output_tokens(self, record: dict) -> float:
+        return self.output_ratio * max(1, calculate_text_tokens(json.dumps(record, ensure_ascii=False, indent=2)))
+
+    @property
+    def output_budget(self) -> float:
+        return self.output_limit * self.headroom
+
+    def plan(self, records: List[dict]) -> List[List[dict]]:
+        """Greedily fill batches up to the output budget, never above `max_batch_size` records."""
+        budget = self.output_budget
+        batches, current, used = [], [], 0.0
+        for record in records:
+            cost = self.estimate_output_tokens(record)
+            if current and (len(current) >= self.max_batch_size or used + cost > budget):
+                batches.append(current)
+                current, used = [], 0.0
+            current.append(record)
+            used += cost
+        if current:
+            batches.append(current)
+        logger.info(f"[BATCHER] {len(records)} record(s) -> {len(batches)} batch(es) of {[len(b) for b in batches]} "
+                    f"(budget {budget:.0f} tokens, ratio {self.output_ratio:.2f})")
+        return batches
+
+    def observe(self, pv: dict):
+        """Learn from the attempts of one `LLM.generate` PV (or a merged one)."""
+        for attempt in pv.get("attempts", []):
+            output_tokens = attempt.get("output_tokens") or 0
+            if attempt.get("error_type") == "TruncatedResponseError":
+                if output_tokens:
+                    self.output_limit = min(self.output_limit, output_tokens)
+            elif attempt.get("status") in ("success", "partial") and output_tokens:
+                records_tokens = (attempt.get("input_tokens") or 0) - self.prompt_tokens
+                if records_tokens > 0:
+                    sample = output_tokens / records_tokens
+                    self.output_ratio += self.smoothing * (sample - self.output_ratio)
+                self.output_limit = max(self.output_limit, output_tokens)
+                if self.output_limit < self.ceiling:
+                    self.output_limit += self.recovery * (self.ceiling - self.output_limit)
+
+    def load_history(self, directory: str = AUDIT_LOG_DIR, limit: int = BATCH_HISTORY_RECORDS) -> int:
+        """Replay the most recent transcription PVs from the audit log, oldest first; returns how many were read."""
+        records = recent_records(directory, HISTORY_INDICATORS, limit)
+        for record in records:
+            self.observe(record.get("pv", {}))
+        if records:
+            logger.info(f"[BATCHER] Learned from {len(records)} PV record(s): ratio {self.output_ratio:.2f}, "
+                        f"output limit {self.output_limit:.0f} tokens")
+        return len(records)
@@ -0,0 +1,56 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Sequence
+
+from config import MAX_CONCURRENT_BATCHES, MAX_IN_FLIGHT_PER_KEY
+from core.api_key_manager import APIKeyManager
+
+logger = logging.getLogger(__name__)
+
+
+class BatchScheduler:
+    """Bounded concurrent runner that fans batches out across the ready API keys."""
+
+    def __init__(self,
+                 api_key_manager: APIKeyManager,
+                 max_concurrency: int = MAX_CONCURRENT_BATCHES,
+                 max_in_flight_per_key: int = MAX_IN_FLIGHT_PER_KEY):
+        self.api_key_manager = api_key_manager
+        self.max_concurrency = max_concurrency
+        self.max_in_flight_per_key = max_in_flight_per_key
+
+    def concurrency_limit(self) -> int:
+        # Never exceed what the ready keys can take, but always make progress
+        ready = self.api_key_manager.ready_key_count()
+        return max(1, min(self.max_concurrency, ready * self.max_in_flight_per_key))
+
+    async def run(self,
+                  batches: Sequence[Any],
+                  worker: Callable[[int, Any], Awaitable[Any]],
+                  on_result: Optional[Callable[[int, Any], None]] = None) -> List[Any]:
+        """
+        Run `worker(index, batch)` for every batch and return the results in input order.
+        `on_result` is called as soon as each batch finishes, in completion order.
+        The first failing batch cancels the remaining ones and its exception is re-raised.
+        """
+        limit = self.concurrency_limit()
+        semaphore = asyncio.Semaphore(limit)
+        results: List[Any] = [None] * len(batches)
+        logger.info(f"[SCHEDULER] Running {len(batches)} batch(es) with concurrency {limit}")
+
+        async def run_one(index: int, batch: Any):
+            async with semaphore:
+                result = await worker(index, batch)
+            results[index] = result
+            if on_result is not None:
+                on_result(index, result)
+
+        tasks = [asyncio.create_task(run_one(i, b)) for i, b in enumerate(batches)]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return results
@@ -0,0 +1,79 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+from config import BULK_MAX_BACKPRESSURE_WAIT, BULK_QUEUE_SIZE, BULK_WORKERS
+from core.api_key_manager import APIKeyManager
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class BulkPipeline:
+    """Bounded worker pipeline that yields each item's outcome as soon as it finishes.
+
+    Items are pulled from the source only as fast as workers free up (bounded
+    queues on both sides), so memory stays flat regardless of the input size.
+    Workers hold off while every API key is cooling instead of piling up retries.
+    """
+
+    def __init__(self,
+                 api_key_manager: APIKeyManager,
+                 workers: int = BULK_WORKERS,
+                 queue_size: int = BULK_QUEUE_SIZE):
+        self.api_key_manager = api_key_manager
+        self.workers = workers
+        self.queue_size = queue_size
+
+    async def _wait_for_capacity(self):
+        while (delay := self.api_key_manager.seconds_until_ready()) > 0:
+            delay = min(BULK_MAX_BACKPRESSURE_WAIT, delay)
+            logger.info(f"[BULK] All keys cooling, holding workers for {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def run(self,
+                  items: AsyncIterator[Any],
+                  handler: Callable[[Any], Awaitable[Any]]) -> AsyncIterator[Tuple[Any, Any, Optional[Exception]]]:
+        """Yield `(item, result, error)` in completion order; a failing source is re-raised at the end."""
+        in_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        out_queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        source_error: list = []
+
+        async def produce():
+            try:
+                async for item in items:
+                    await in_queue.put(item)
+            except Exception as e:
+                logger.error(f"[BULK] Reading input failed: {e}")
+                source_error.append(e)
+            for _ in range(self.workers):
+                await in_queue.put(_DONE)
+
+        async def work():
+            while (item := await in_queue.get()) is not _DONE:
+                await self._wait_for_capacity()
+                try:
+                    outcome = (item, await handler(item), None)
+                except Exception as e:
+                    outcome = (item, None, e)
+                await out_queue.put(outcome)
+            await out_queue.put(_DONE)
+
+        tasks = [asyncio.create_task(produce())]
+        tasks += [asyncio.create_task(work()) for _ in range(self.workers)]
+        try:
+            finished = 0
+            while finished < self.workers:
+                outcome = await out_queue.get()
+                if outcome is _DONE:
+                    finished += 1
+                    continue
+                yield outcome
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        if source_error:
+            raise source_error[0]
@@ -0,0 +1,144 @@
+"""
+Card-region detection, crop and deskew, CPU-only with NumPy/Pillow.
+
+Phone photos show the card on a table: the full frame wastes most of the model input on
+background. On a small working copy, pixels that differ from the colour of the image
+border (the background) are segmented, cleaned up with min/max filters, and the minimum-
+area rectangle around their convex hull gives the card quadrilateral. The card is then
+cut out and straightened with one QUAD transform at source resolution, so the resize
+that follows spends the whole model input on the card.
+
+When no plausible card is found (too small, filling the frame already, wrong shape) the
+full frame is used as before.
+"""
+from typing import List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from config import CARD_CROP_ASPECT_RANGE, CARD_CROP_AREA_RANGE, CARD_CROP_MARGIN
+
+WORK_SIZE = 320   # long side of the copy the detection runs on
+_BORDER = 6       # pixels of the working copy sampled as background
+
+
+def _otsu(values: np.ndarray) -> float:
+    hist, edges = np.histogram(values, bins=128)
+    centers = (edges[:-1] + edges[1:]) / 2
+    weight = np.cumsum(hist)
+    total = weight[-1]
+    mean = np.cumsum(hist * centers)
+    between = (mean[-1] * weight - mean * total) ** 2 / np.maximum(weight * (total - weight), 1)
+    return float(centers[np.argmax(between)])
+
+
+def _convex_hull(points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    """Andrew's monotone chain; `points` sorted by x then y."""
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return lower[:-1] + upper[:-1]
+
+
+def _min_area_rect(hull: np.ndarray) -> Tuple[np.ndarray, float, float]:
+    """Corners (4x2, in order around the rectangle), width and height of the smallest enclosing rectangle."""
+    edges = np.roll(hull, -1, axis=0) - hull
+    angles = np.unique(np.mod(np.arctan2(edges[:, 1], edges[:, 0]), np.pi / 2))
+    cos, sin = np.cos(angles)[:, None], np.sin(angles)[:, None]
+    # Hull in the frame of every candidate edge direction
+    xs = hull[:, 0] * cos + hull[:, 1] * sin
+    ys = -hull[:, 0] * sin + hull[:, 1] * cos
+    areas = (xs.max(axis=1) - xs.min(axis=1)) * (ys.max(axis=1) - ys.min(axis=1))
+    best = int(np.argmin(areas))
+    x0, x1 = xs[best].min(), xs[best].max()
+    y0, y1 = ys[best].min(), ys[best].max()
+    c, s = cos[best, 0], sin[best, 0]
+    local = np.array([(x0, y0), (x0, y1), (x1, y1), (x1, y0)])
+    corners = np.stack([local[:, 0] * c - local[:, 1] * s, local[:, 0] * s + local[:, 1] * c], axis=1)
+    return corners, x1 - x0, y1 - y0
+
+
+def _order_corners(corners: np.ndarray) -> np.ndarray:
+    """Upper-left, lower-left, lower-right, upper-right, as Image.QUAD expects."""
+    center = corners.mean(axis=0)
+    angles = np.arctan2(corners[:, 1] - center[1], corners[:, 0] - center[0])
+    ring = corners[np.argsort(angles)]  # clockwise on screen, starting around the upper-left
+    start = int(np.argmin(ring.sum(axis=1)))
+    ring = np.roll(ring, -start, axis=0)  # upper-left, upper-right, lower-right, lower-left
+    return ring[[0, 3, 2, 1]]
+
+
+class CardCropper:
+    """Finds the card in a photo and returns it cropped and deskewed; picklable, so it runs in the preprocessing workers."""
+
+    def __init__(self,
+                 area_range: Tuple[float, float] = CARD_CROP_AREA_RANGE,
+                 aspect_range: Tuple[float, float] = CARD_CROP_ASPECT_RANGE,
+                 margin: float = CARD_CROP_MARGIN):
+        self.area_range = area_range
+        self.aspect_range = aspect_range
+        self.margin = margin
+
+    def find_card(self, img: Image.Image) -> Optional[np.ndarray]:
+        """Card corners in `img` coordinates (upper-left, lower-left, lower-right, upper-right), or None."""
+        width, height = img.size
+        scale = WORK_SIZE / max(width, height)
+        small = img.convert("RGB").resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+        rgb = np.asarray(small, dtype=np.float32)
+        if min(rgb.shape[:2]) <= 4 * _BORDER:
+            return None
+
+        border = np.concatenate([rgb[:_BORDER].reshape(-1, 3), rgb[-_BORDER:].reshape(-1, 3),
+                                 rgb[:, :_BORDER].reshape(-1, 3), rgb[:, -_BORDER:].reshape(-1, 3)])
+        distance = np.linalg.norm(rgb - np.median(border, axis=0), axis=2)
+        # The background's own variation sets a floor, so a plain table does not split in two
+        threshold = max(_otsu(distance), float(np.percentile(np.linalg.norm(border - np.median(border, axis=0), axis=1), 95)))
+        mask = Image.fromarray(((distance > threshold) * 255).astype(np.uint8))
+        # Open (drop background specks), then close (fill text and photo holes in the card)
+        mask = mask.filter(ImageFilter.MinFilter(3)).filter(ImageFilter.MaxFilter(3))
+        mask = mask.filter(ImageFilter.MaxFilter(5)).filter(ImageFilter.MinFilter(5))
+        filled = np.asarray(mask) > 0
+
+        rows = np.nonzero(filled.any(axis=1))[0]
+        if rows.size < 2:
+            return None
+        # Leftmost and rightmost pixel of every row are enough for the hull
+        left = filled[rows].argmax(axis=1)
+        right = filled.shape[1] - 1 - filled[rows, ::-1].argmax(axis=1)
+        points = sorted(set(zip(left.tolist(), rows.tolist())) | set(zip(right.tolist(), rows.tolist())))
+        hull = np.array(_convex_hull([(float(x), float(y)) for x, y in points]))
+        if len(hull) < 3:
+            return None
+
+        corners, rect_w, rect_h = _min_area_rect(hull)
+        area_share = rect_w * rect_h / (filled.shape[0] * filled.shape[1])
+        aspect = max(rect_w, rect_h) / max(1.0, min(rect_w, rect_h))
+        if not self.area_range[0] <= area_share <= self.area_range[1]:
+            return None
+        if not self.aspect_range[0] <= aspect <= self.aspect_range[1]:
+            return None
+
+        center = corners.mean(axis=0)
+        corners = center + (corners - center) * (1 + self.margin)
+        corners = np.clip(corners / scale, 0, [width - 1, height - 1])
+        return _order_corners(corners)
+
+    def crop(self, img: Image.Image) -> Image.Image:
+        """The deskewed card, at the resolution it has in `img`; `img` unchanged when no card is found."""
+        corners = self.find_card(img)
+        if corners is None:
+            return img
+        upper_left, lower_left, lower_right, upper_right = corners
+        out_w = round((np.linalg.norm(upper_right - upper_left) + np.linalg.norm(lower_right - lower_left)) / 2)
+        out_h = round((np.linalg.norm(lower_left - upper_left) + np.linalg.norm(lower_right - upper_right)) / 2)
+        return img.convert("RGB").transform((max(1, out_w), max(1, out_h)), Image.QUAD,
+                                            tuple(corners.flatten().tolist()), resample=Image.BICUBIC)
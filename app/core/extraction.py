@@ -0,0 +1,153 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Type
+
+from pydantic import BaseModel, ValidationError
+
+from config import (
+    CARD_CROP_ENABLED, HEDGE_REQUESTS, PRESCREEN_ENABLED, PROMPT_TUNISIAN_ID_BACK, PROMPT_TUNISIAN_ID_CARD,
+    PROMPT_TUNISIAN_ID_FRONT
+)
+from core.card_crop import CardCropper
+from core.image_pipeline import ImagePreprocessor
+from core.llm_client import LLM
+from core.prescreen import ImagePrescreener
+from core.result_cache import ResultCache, make_cache_key
+from models.id_card import TunisianIDCardBack, TunisianIDCardFront, TunisianIDCardPair
+from models.image import EncodedImage
+from utils.prompt_utils import finalize_merged_pv, merge_pv, new_merged_pv
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CardSide:
+    prompt: str
+    output_model: Type[BaseModel]
+    indicator: str
+
+
+CARD_SIDES = {
+    "front": CardSide(PROMPT_TUNISIAN_ID_FRONT, TunisianIDCardFront, "tunisian_id_front"),
+    "back": CardSide(PROMPT_TUNISIAN_ID_BACK, TunisianIDCardBack, "tunisian_id_back"),
+}
+
+
+# The card prompts may answer "invalid id card", which no response schema allows:
+# structured output for them is JSON mode only
+CARD_SCHEMA = False
+
+image_preprocessor = ImagePreprocessor(
+    prescreener=ImagePrescreener() if PRESCREEN_ENABLED else None,
+    cropper=CardCropper() if CARD_CROP_ENABLED else None,
+)
+
+
+async def prepare_image(raw: bytes) -> EncodedImage:
+    return await image_preprocessor.prepare(raw)
+
+
+def _side_cache_key(llm: LLM, raw: bytes, side: str) -> str:
+    spec = CARD_SIDES[side]
+    return make_cache_key(raw, spec.prompt, llm.model_name, spec.output_model)
+
+
+async def cached_side(llm: LLM, cache: Optional[ResultCache], raw: bytes, side: str) -> Optional[dict]:
+    """`extract_side`'s result when it is in the result cache, otherwise None. No model call, no admission needed."""
+    if cache is None:
+        return None
+    return await cache.get(_side_cache_key(llm, raw, side), CARD_SIDES[side].output_model)
+
+
+async def cached_card(llm: LLM, cache: Optional[ResultCache], raw_front: bytes, raw_back: bytes) -> Optional[dict]:
+    """`extract_card`'s result when both sides are in the result cache, otherwise None."""
+    results = await _cached_sides(llm, cache, {"front": raw_front, "back": raw_back})
+    if len(results) < 2:
+        return None
+    merged_pv = new_merged_pv()
+    merged_pv["cache_hit"] = True
+    merged_pv["cache_hit_sides"] = list(results)
+    return {"pv": finalize_merged_pv(merged_pv), "result": results}
+
+
+async def _cached_sides(llm: LLM, cache: Optional[ResultCache], raws: Dict[str, bytes]) -> Dict[str, BaseModel]:
+    results = {}
+    for side, raw in raws.items():
+        cached = await cached_side(llm, cache, raw, side)
+        if cached is not None:
+            results[side] = cached["result"]
+    return results
+
+
+async def extract_side(llm: LLM, cache: Optional[ResultCache], raw: bytes, side: str, hedge: bool = HEDGE_REQUESTS) -> dict:
+    """Extract one card side from the uploaded bytes, serving repeated uploads from the result cache."""
+    spec = CARD_SIDES[side]
+    cached = await cached_side(llm, cache, raw, side)
+    if cached is not None:
+        return cached
+
+    result_with_pv = await llm.generate([spec.prompt, await prepare_image(raw)], spec.output_model, hedge=hedge,
+                                        schema=CARD_SCHEMA)
+
+    if cache is not None:
+        await cache.set(_side_cache_key(llm, raw, side), result_with_pv)
+    return result_with_pv
+
+
+async def extract_card(llm: LLM,
+                       cache: Optional[ResultCache],
+                       raw_front: bytes,
+                       raw_back: bytes,
+                       hedge: bool = HEDGE_REQUESTS) -> dict:
+    """
+    Extract both sides of a card with a single multimodal call.
+    Each half is validated on its own, and only a half that fails validation is
+    retried through the single-side flow. Sides already in the result cache are
+    not sent again. `hedge` is passed on to `LLM.generate`.
+    """
+    raws = {"front": raw_front, "back": raw_back}
+    merged_pv = new_merged_pv()
+    results = await _cached_sides(llm, cache, raws)
+    if results:
+        merged_pv["cache_hit_sides"] = list(results)
+    # Only a card served entirely from the cache is a cache hit; a mixed one still paid for a call
+    merged_pv["cache_hit"] = len(results) == len(raws)
+
+    missing = [side for side in raws if side not in results]
+    if len(missing) == 1:
+        side = missing[0]
+        result_with_pv = await extract_side(llm, cache, raws[side], side, hedge)
+        merge_pv(merged_pv, result_with_pv["pv"])
+        results[side] = result_with_pv["result"]
+
+    elif missing:
+        front, back = await asyncio.gather(prepare_image(raw_front), prepare_image(raw_back))
+        images = {"front": front, "back": back}
+        pair_with_pv = await llm.generate([PROMPT_TUNISIAN_ID_CARD, images["front"], images["back"]], TunisianIDCardPair,
+                                          hedge=hedge, schema=CARD_SCHEMA)
+        merge_pv(merged_pv, pair_with_pv["pv"])
+        pair = pair_with_pv["result"]
+
+        for side in missing:
+            spec = CARD_SIDES[side]
+            try:
+                result_with_pv = {"pv": pair_with_pv["pv"], "result": spec.output_model(**(getattr(pair, side) or {}))}
+            except ValidationError as e:
+                logger.warning(f"[CARD] {side} side failed validation, retrying it alone: {e}")
+                try:
+                    result_with_pv = await llm.generate([spec.prompt, images[side]], spec.output_model, hedge=hedge,
+                                                        schema=CARD_SCHEMA)
+                except Exception as error:
+                    # The failure's PV should also cover the pair call made before it
+                    if getattr(error, "pv", None):
+                        error.pv = finalize_merged_pv(merge_pv(merged_pv, error.pv))
+                    raise
+                merge_pv(merged_pv, result_with_pv["pv"])
+
+            results[side] = result_with_pv["result"]
+            if cache is not None:
+                await cache.set(_side_cache_key(llm, raws[side], side), result_with_pv)
+
+    finalize_merged_pv(merged_pv)
+    return {"pv": merged_pv, "result": results}
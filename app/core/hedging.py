@@ -0,0 +1,63 @@
+import threading
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from config import (
+    HEDGE_MAX_DELAY, HEDGE_MAX_SHARE, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_PERCENTILE, HEDGE_WINDOW
+)
+
+
+class HedgePolicy:
+    """
+    When to send a second attempt: after the `percentile` latency of the recent calls of the
+    same kind (output model), and only while hedges stay under `max_share` of the requests.
+
+    Latencies of first attempts cancelled by a winning hedge are kept as lower bounds, so the
+    slow tail that triggered hedging does not vanish from the window and shrink the delay.
+    """
+
+    def __init__(self,
+                 percentile: float = HEDGE_PERCENTILE,
+                 window: int = HEDGE_WINDOW,
+                 min_samples: int = HEDGE_MIN_SAMPLES,
+                 min_delay: float = HEDGE_MIN_DELAY,
+                 max_delay: float = HEDGE_MAX_DELAY,
+                 max_share: float = HEDGE_MAX_SHARE):
+        self.percentile = percentile
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_share = max_share
+        self._samples: Dict[str, Deque[float]] = {}
+        self._credit = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(kind)
+            if samples is None:
+                samples = self._samples[kind] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def delay(self, kind: str) -> Optional[float]:
+        """Seconds to wait before hedging a `kind` request; None until enough latencies were seen."""
+        with self._lock:
+            samples = self._samples.get(kind)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        value = ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+        return min(self.max_delay, max(self.min_delay, value))
+
+    def on_request(self):
+        # Every request earns `max_share` of a hedge, banked up to a small burst
+        with self._lock:
+            self._credit = min(10.0, self._credit + self.max_share)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._credit < 1.0:
+                return False
+            self._credit -= 1.0
+            return True
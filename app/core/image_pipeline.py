@@ -0,0 +1,210 @@
+import asyncio
+import io
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from PIL import Image
+
+from config import (
+    IMAGE_ENCODE_FORMAT, IMAGE_ENCODE_QUALITY, IMAGE_PASSTHROUGH_FORMATS, IMAGE_PASSTHROUGH_MAX_BYTES, IMAGE_WORKERS,
+    MAX_HEIGHT, MAX_IMAGE_BYTES, MAX_IMAGE_PIXELS, MAX_WIDTH
+)
+from core.card_crop import CardCropper
+from core.metrics import IMAGE_PAYLOAD_BYTES, IMAGE_PAYLOADS, IMAGE_PREPROCESS_LATENCY, PRESCREEN_REJECTS
+from core.prescreen import SCREEN_SIZE, ImagePrescreener, PrescreenResult
+from exceptions.image_exceptions import ImageTooLargeError, InvalidIDCardError, UnsupportedImageError
+from models.image import EncodedImage
+from utils.prompt_utils import resize_id_card_image
+
+logger = logging.getLogger(__name__)
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+_EXIF_ORIENTATION = 0x0112
+
+
+def encode_image(img: Image.Image,
+                 encode_format: str = IMAGE_ENCODE_FORMAT,
+                 quality: int = IMAGE_ENCODE_QUALITY) -> EncodedImage:
+    buffer = io.BytesIO()
+    img.convert("RGB").save(buffer, format=encode_format, quality=quality)
+    return EncodedImage(buffer.getvalue(), MIME_TYPES[encode_format], img.width, img.height)
+
+
+def _open(raw: bytes, max_pixels: int = MAX_IMAGE_PIXELS) -> Image.Image:
+    """Reads the header only; the pixels are decoded on first access."""
+    try:
+        img = Image.open(io.BytesIO(raw))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except Exception as e:
+        raise UnsupportedImageError(f"Cannot decode image: {e}")
+
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(f"{width}x{height} exceeds {max_pixels} pixels")
+    return img
+
+
+def decode_and_resize(raw: bytes,
+                      max_width: int = MAX_WIDTH,
+                      max_height: int = MAX_HEIGHT,
+                      max_pixels: int = MAX_IMAGE_PIXELS,
+                      cropper: Optional[CardCropper] = None) -> Image.Image:
+    """
+    Decode an upload, crop it to the card when a `cropper` is given, and shrink it to the
+    model input size. Runs in a worker process, so it only takes and returns picklable values.
+    """
+    return decode_card(raw, max_width, max_height, max_pixels, cropper)[0]
+
+
+def decode_card(raw: bytes,
+                max_width: int = MAX_WIDTH,
+                max_height: int = MAX_HEIGHT,
+                max_pixels: int = MAX_IMAGE_PIXELS,
+                cropper: Optional[CardCropper] = None) -> Tuple[Image.Image, bool]:
+    """`decode_and_resize`, and whether the cropper found a card (False: the full frame was kept)."""
+    img = _open(raw, max_pixels)
+    width, height = img.size
+
+    # JPEG can downscale by 1/2, 1/4 or 1/8 while decoding; keep at least twice the
+    # target size (like Image.thumbnail's reducing_gap) so LANCZOS still has detail to work with.
+    # A card covering ~40% of the frame width still fills the target after the crop at 2.5x
+    scale = min(max_width / width, max_height / height, 1.0)
+    reducing_gap = 2.5 if cropper is not None else 2
+    img.draft("RGB", (int(width * scale * reducing_gap), int(height * scale * reducing_gap)))
+    try:
+        found = False
+        if cropper is not None:
+            cropped = cropper.crop(img)
+            found, img = cropped is not img, cropped
+        return resize_id_card_image(img, max_width, max_height), found
+    except Exception as e:
+        raise UnsupportedImageError(f"Cannot decode image: {e}")
+
+
+def can_pass_through(img: Image.Image,
+                     raw_size: int,
+                     formats: Tuple[str, ...] = IMAGE_PASSTHROUGH_FORMATS,
+                     max_width: int = MAX_WIDTH,
+                     max_height: int = MAX_HEIGHT) -> bool:
+    """
+    True when the upload, judged from its header, is already what the resize and encode
+    would produce: a compact RGB JPEG/WebP that the thumbnail step would leave as it is.
+    EXIF rotation must be absent, since the model would apply it and the pipeline does not.
+    """
+    return (img.format in formats
+            and img.mode == "RGB"
+            and img.width <= max_width and img.height <= max_height
+            and raw_size <= IMAGE_PASSTHROUGH_MAX_BYTES
+            and img.getexif().get(_EXIF_ORIENTATION, 1) == 1)
+
+
+def _preview(img: Image.Image) -> Image.Image:
+    """Decoded copy of about SCREEN_SIZE pixels a side (JPEG decodes at 1/2, 1/4 or 1/8 directly)."""
+    scale = min(SCREEN_SIZE / max(img.size), 1.0)
+    img.draft("RGB", (max(1, int(img.width * scale)), max(1, int(img.height * scale))))
+    return img.convert("RGB")
+
+
+def prepare_payload(raw: bytes,
+                    prescreener: Optional[ImagePrescreener],
+                    cropper: Optional[CardCropper] = None,
+                    passthrough_formats: Tuple[str, ...] = IMAGE_PASSTHROUGH_FORMATS,
+                    encode_format: str = IMAGE_ENCODE_FORMAT,
+                    quality: int = IMAGE_ENCODE_QUALITY) -> Tuple[EncodedImage, Optional[PrescreenResult]]:
+    """
+    Model-ready image and pre-screen result for an upload. An upload that can pass through
+    is forwarded byte for byte and only decoded at reduced size, for the pre-screen and the
+    card search (a card to cut out of it sends it down the full path after all). Anything
+    else is decoded, cropped, resized and encoded exactly once.
+    """
+    img = _open(raw)
+    if can_pass_through(img, len(raw), passthrough_formats):
+        try:
+            preview = _preview(img)
+        except Exception as e:
+            raise UnsupportedImageError(f"Cannot decode image: {e}")
+        if cropper is None or cropper.find_card(preview) is None:
+            payload = EncodedImage(raw, MIME_TYPES[img.format], img.width, img.height, reencoded=False)
+            return payload, (prescreener.screen(preview, card_crop=False) if prescreener is not None else None)
+
+    resized, card_crop = decode_card(raw, cropper=cropper)
+    screened = prescreener.screen(resized, card_crop=card_crop) if prescreener is not None else None
+    if screened is not None and not screened.passed:
+        # Not sent anywhere, no need to encode it
+        return EncodedImage(b"", MIME_TYPES[encode_format], resized.width, resized.height), screened
+    return encode_image(resized, encode_format, quality), screened
+
+
+def _warm_up() -> bool:
+    return True
+
+
+class ImagePreprocessor:
+    """
+    Turns uploads into model-ready EncodedImages (see `prepare_payload`) off the event loop.
+    A process pool keeps the CPU-bound Pillow work from stalling other requests;
+    with `workers=0` the work runs on a thread instead.
+    """
+
+    def __init__(self,
+                 workers: int = IMAGE_WORKERS,
+                 max_bytes: int = MAX_IMAGE_BYTES,
+                 prescreener: Optional[ImagePrescreener] = None,
+                 cropper: Optional[CardCropper] = None):
+        self.workers = workers
+        self.max_bytes = max_bytes
+        self.prescreener = prescreener
+        self.cropper = cropper
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    async def start(self):
+        """Fork the workers up front, before the gRPC clients open their channels and threads."""
+        if self.workers > 0:
+            await asyncio.get_running_loop().run_in_executor(self._get_executor(), _warm_up)
+            logger.info(f"[IMAGE] Started {self.workers} preprocessing process(es)")
+
+    async def stop(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+    async def prepare(self, raw: bytes) -> EncodedImage:
+        """Model-ready image; raises InvalidIDCardError when the pre-screen rejects it."""
+        if len(raw) > self.max_bytes:
+            raise ImageTooLargeError(f"{len(raw)} bytes exceeds {self.max_bytes}")
+        start = time.perf_counter()
+        try:
+            payload, screened = await self._prepare(raw)
+        finally:
+            IMAGE_PREPROCESS_LATENCY.observe(time.perf_counter() - start, mode="process" if self.workers > 0 else "thread")
+        if screened is not None and not screened.passed:
+            PRESCREEN_REJECTS.inc(reason=screened.reason)
+            logger.info(f"[PRESCREEN] Rejected upload: {screened.detail}")
+            raise InvalidIDCardError(f"{screened.reason} ({screened.detail})", reason=screened.reason)
+        path = "reencoded" if payload.reencoded else "passthrough"
+        IMAGE_PAYLOADS.inc(path=path)
+        IMAGE_PAYLOAD_BYTES.inc(len(payload.data), path=path)
+        return payload
+
+    async def _prepare(self, raw: bytes) -> Tuple[EncodedImage, Optional[PrescreenResult]]:
+        if self.workers <= 0:
+            return await asyncio.to_thread(prepare_payload, raw, self.prescreener, self.cropper)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), prepare_payload, raw, self.prescreener, self.cropper)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM on a hostile image); start a fresh pool for the next requests
+            logger.error("[IMAGE] Preprocessing pool broke, restarting it")
+            broken, self._executor = self._executor, None
+            if broken is not None:
+                broken.shutdown(wait=False, cancel_futures=True)
+            raise UnsupportedImageError("Image preprocessing failed")
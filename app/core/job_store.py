@@ -0,0 +1,233 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from config import JOBS_DB_PATH
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+BATCH_PENDING = "pending"
+BATCH_RUNNING = "running"
+BATCH_DONE = "done"
+BATCH_FAILED = "failed"
+
+
+class JobStore:
+    """Durable SQLite queue of transcription jobs, checkpointed per batch.
+
+    Safe to share between uvicorn workers on one host: batches are claimed
+    inside an IMMEDIATE transaction so each one is handed to a single worker.
+    """
+
+    def __init__(self, path: str = JOBS_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, created_at REAL NOT NULL, updated_at REAL NOT NULL,"
+            " total_batches INTEGER NOT NULL, total_items INTEGER NOT NULL, completed_at REAL);"
+            "CREATE TABLE IF NOT EXISTS batches ("
+            " job_id TEXT NOT NULL, batch_index INTEGER NOT NULL, status TEXT NOT NULL,"
+            " payload TEXT NOT NULL, result TEXT, pv TEXT, error TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL,"
+            " claimed_by TEXT, claimed_at REAL, updated_at REAL NOT NULL,"
+            " PRIMARY KEY (job_id, batch_index));"
+            "CREATE INDEX IF NOT EXISTS batches_pending ON batches (status, available_at);"
+        )
+
+    def create_job(self, batches: List[List[dict]]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO jobs (id, created_at, updated_at, total_batches, total_items) VALUES (?, ?, ?, ?, ?)",
+                    (job_id, now, now, len(batches), sum(len(b) for b in batches))
+                )
+                self._conn.executemany(
+                    "INSERT INTO batches (job_id, batch_index, status, payload, available_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [(job_id, i, BATCH_PENDING, json.dumps(b, ensure_ascii=False), now, now) for i, b in enumerate(batches)]
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def claim_batch(self, worker_id: str) -> Optional[dict]:
+        """Atomically take the oldest pending batch, or return None when the queue is empty."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT b.job_id, b.batch_index, b.payload, b.attempts, b.pv FROM batches b "
+                    "JOIN jobs j ON j.id = b.job_id "
+                    "WHERE b.status = ? AND b.available_at <= ? "
+                    "ORDER BY j.created_at, b.batch_index LIMIT 1",
+                    (BATCH_PENDING, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE batches SET status = ?, claimed_by = ?, claimed_at = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE job_id = ? AND batch_index = ?",
+                    (BATCH_RUNNING, worker_id, now, now, row["job_id"], row["batch_index"])
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return {
+            "job_id": row["job_id"],
+            "batch_index": row["batch_index"],
+            "batch": json.loads(row["payload"]),
+            "attempts": row["attempts"] + 1,
+            "pv": json.loads(row["pv"]) if row["pv"] else None,  # spent by the earlier attempts
+        }
+
+    def complete_batch(self, job_id: str, batch_index: int, result: List[dict], pv: dict):
+        self._finish_batch(job_id, batch_index, BATCH_DONE, result=json.dumps(result, ensure_ascii=False),
+                           pv=json.dumps(pv, ensure_ascii=False, default=list))
+
+    def fail_batch(self, job_id: str, batch_index: int, error: str, retry_after: Optional[float] = None,
+                   pv: Optional[dict] = None):
+        """
+        Record a failed attempt; with `retry_after` the batch goes back to the queue, otherwise it is final.
+        `pv` replaces the batch's PV, so it should include the earlier attempts.
+        """
+        pv_json = json.dumps(pv, ensure_ascii=False, default=list) if pv is not None else None
+        if retry_after is None:
+            self._finish_batch(job_id, batch_index, BATCH_FAILED, pv=pv_json, error=error)
+        else:
+            self._finish_batch(job_id, batch_index, BATCH_PENDING, pv=pv_json, error=error,
+                               available_at=time.time() + retry_after)
+
+    def requeue_batch(self, job_id: str, batch_index: int):
+        """Hand a claimed batch back untouched (shutdown): the attempt is not counted, its PV is kept."""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET status = ?, attempts = MAX(attempts - 1, 0), available_at = ?, claimed_by = NULL, "
+                "updated_at = ? WHERE job_id = ? AND batch_index = ? AND status = ?",
+                (BATCH_PENDING, now, now, job_id, batch_index, BATCH_RUNNING)
+            )
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def _finish_batch(self, job_id: str, batch_index: int, status: str,
+                      result: Optional[str] = None, pv: Optional[str] = None,
+                      error: Optional[str] = None, available_at: Optional[float] = None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "UPDATE batches SET status = ?, result = COALESCE(?, result), pv = COALESCE(?, pv), error = ?, "
+                "available_at = COALESCE(?, available_at), claimed_by = NULL, updated_at = ? "
+                "WHERE job_id = ? AND batch_index = ?",
+                (status, result, pv, error, available_at, now, job_id, batch_index)
+            )
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+
+    def requeue_stale(self, older_than: float) -> int:
+        """Put back batches whose worker died mid-run (claimed longer than `older_than` seconds ago)."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batches SET status = ?, claimed_by = NULL, available_at = ?, updated_at = ? "
+                "WHERE status = ? AND claimed_at < ?",
+                (BATCH_PENDING, now, now, BATCH_RUNNING, now - older_than)
+            )
+            return cursor.rowcount
+
+    def retry_failed(self, job_id: str) -> int:
+        """Re-queue the failed batches of a job; finished batches are kept as they are."""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE batches SET status = ?, attempts = 0, error = NULL, available_at = ?, updated_at = ? "
+                "WHERE job_id = ? AND status = ?",
+                (BATCH_PENDING, now, now, job_id, BATCH_FAILED)
+            )
+            self._conn.execute("UPDATE jobs SET updated_at = ? WHERE id = ?", (now, job_id))
+            return cursor.rowcount
+
+    def mark_completed(self, job_id: str) -> bool:
+        """True for exactly one caller once every batch is done, so completion work runs once."""
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET completed_at = ? WHERE id = ? AND completed_at IS NULL "
+                "AND NOT EXISTS (SELECT 1 FROM batches WHERE job_id = ? AND status != ?)",
+                (time.time(), job_id, job_id, BATCH_DONE)
+            )
+            return cursor.rowcount == 1
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM batches WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            errors = [
+                {"batch_index": row["batch_index"], "error": row["error"], "attempts": row["attempts"]}
+                for row in self._conn.execute(
+                    "SELECT batch_index, error, attempts FROM batches WHERE job_id = ? AND status = ? ORDER BY batch_index",
+                    (job_id, BATCH_FAILED)
+                )
+            ]
+
+        done = counts.get(BATCH_DONE, 0)
+        failed = counts.get(BATCH_FAILED, 0)
+        if done == job["total_batches"]:
+            status = JOB_COMPLETED
+        elif failed and done + failed == job["total_batches"]:
+            status = JOB_FAILED
+        elif done or failed or counts.get(BATCH_RUNNING, 0):
+            status = JOB_RUNNING
+        else:
+            status = JOB_QUEUED
+        return {
+            "job_id": job_id,
+            "status": status,
+            "total_batches": job["total_batches"],
+            "total_items": job["total_items"],
+            "done_batches": done,
+            "failed_batches": failed,
+            "created_at": job["created_at"],
+            "updated_at": job["updated_at"],
+            "errors": errors,
+        }
+
+    def get_batch_pvs(self, job_id: str) -> List[dict]:
+        """PV of every batch that made calls, failed and re-queued attempts included, in batch order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pv FROM batches WHERE job_id = ? AND pv IS NOT NULL ORDER BY batch_index", (job_id,)
+            ).fetchall()
+        return [json.loads(row["pv"]) for row in rows]
+
+    def get_batch_outputs(self, job_id: str) -> List[dict]:
+        """Results and PV of the finished batches, in batch order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT batch_index, result, pv FROM batches WHERE job_id = ? AND status = ? ORDER BY batch_index",
+                (job_id, BATCH_DONE)
+            ).fetchall()
+        return [
+            {"batch_index": row["batch_index"], "result": json.loads(row["result"]), "pv": json.loads(row["pv"])}
+            for row in rows
+        ]
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import os
+from typing import List, Optional
+
+from config import JOB_MAX_BATCH_ATTEMPTS, JOB_POLL_INTERVAL, JOB_STALE_AFTER, JOB_WORKERS
+from core.admission import AdmissionController
+from core.batch_planner import AdaptiveBatcher
+from core.job_store import JobStore
+from core.llm_client import LLM
+from core.transcription import transcribe_batch
+from exceptions.llm_exceptions import ValidationRetryError
+from core.audit_log import audit_log
+from utils.logging_utils import request_id_var
+from utils.prompt_utils import finalize_merged_pv, merge_pv, new_merged_pv
+
+logger = logging.getLogger(__name__)
+
+
+def merged_job_pv(job: dict, pvs: List[dict]) -> dict:
+    merged_pv = new_merged_pv()
+    merged_pv["start_time"] = job["created_at"]
+    for pv in pvs:
+        merge_pv(merged_pv, pv)
+    finalize_merged_pv(merged_pv)
+    merged_pv["duration_total"] = job["updated_at"] - job["created_at"]
+    return merged_pv
+
+
+def add_attempt_pv(spent: Optional[dict], pv: Optional[dict]) -> Optional[dict]:
+    """PV of a batch so far: the earlier attempts' `spent` plus this attempt's `pv`."""
+    if spent is None or pv is None:
+        return pv if spent is None else spent
+    merged_pv = new_merged_pv()
+    merged_pv["start_time"] = spent["start_time"]
+    merge_pv(merged_pv, spent)
+    merge_pv(merged_pv, pv)
+    return finalize_merged_pv(merged_pv)
+
+
+class JobWorker:
+    """Background workers draining the transcription job queue, one checkpoint per batch."""
+
+    def __init__(self,
+                 llm: LLM,
+                 store: JobStore,
+                 workers: int = JOB_WORKERS,
+                 batcher: Optional[AdaptiveBatcher] = None,
+                 admission: Optional[AdmissionController] = None):
+        self.llm = llm
+        self.batcher = batcher
+        self.admission = admission
+        self.store = store
+        self.workers = workers
+        self.worker_id = f"{os.getpid()}-{llm.client_id}"
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+
+    async def start(self):
+        requeued = await asyncio.to_thread(self.store.requeue_stale, JOB_STALE_AFTER)
+        if requeued:
+            logger.warning(f"[JOBS] Re-queued {requeued} batch(es) left running by a previous worker")
+        self._stopping.clear()
+        self._tasks = [asyncio.create_task(self._run(i)) for i in range(self.workers)]
+        logger.info(f"[JOBS] Started {self.workers} job worker(s)")
+
+    async def stop(self):
+        self._stopping.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self, slot: int):
+        while not self._stopping.is_set():
+            try:
+                claimed = await asyncio.to_thread(self.store.claim_batch, f"{self.worker_id}-{slot}")
+            except Exception as e:
+                logger.error(f"[JOBS] Claiming a batch failed: {e}")
+                claimed = None
+            if claimed is None:
+                await asyncio.sleep(JOB_POLL_INTERVAL)
+                continue
+            await self._process(claimed)
+
+    async def _process(self, claimed: dict):
+        job_id, batch_index = claimed["job_id"], claimed["batch_index"]
+        tag = f"[JOB {job_id[:8]} BATCH {batch_index}]"
+        request_id_var.set(f"job-{job_id[:8]}-{batch_index}")
+        logger.info(f"{tag} Attempt {claimed['attempts']} with {len(claimed['batch'])} item(s)")
+        try:
+            if self.admission is not None:
+                # Lowest priority and never shed: batches wait for the interactive endpoints
+                async with self.admission.admit("jobs", shed=False):
+                    response_with_pv = await transcribe_batch(self.llm, claimed["batch"], self.batcher)
+            else:
+                response_with_pv = await transcribe_batch(self.llm, claimed["batch"], self.batcher)
+        except asyncio.CancelledError:
+            # Shutting down mid-batch: hand it back so the next worker picks it up immediately, without
+            # charging the attempt (restarts must not use up JOB_MAX_BATCH_ATTEMPTS); the PV of the
+            # earlier attempts stays with the batch
+            await asyncio.to_thread(self.store.requeue_batch, job_id, batch_index)
+            raise
+        except Exception as e:
+            retry_after: Optional[float] = None
+            if claimed["attempts"] < JOB_MAX_BATCH_ATTEMPTS:
+                retry_after = 0 if isinstance(e, ValidationRetryError) else min(60, 2 ** claimed["attempts"])
+            logger.error(f"{tag} Failed: {type(e).__name__}: {e}"
+                         + (f", retrying in {retry_after}s" if retry_after is not None else ", giving up"))
+            # The failed attempt's calls were paid for: keep them in the batch's PV for the job totals
+            spent = add_attempt_pv(claimed["pv"], getattr(e, "pv", None))
+            await asyncio.to_thread(self.store.fail_batch, job_id, batch_index, f"{type(e).__name__}: {e}",
+                                    retry_after, spent)
+            return
+
+        result = [item.model_dump() for item in response_with_pv["result"]]
+        await asyncio.to_thread(self.store.complete_batch, job_id, batch_index, result,
+                                add_attempt_pv(claimed["pv"], response_with_pv["pv"]))
+        logger.info(f"{tag} Checkpointed {len(result)} item(s)")
+
+        if await asyncio.to_thread(self.store.mark_completed, job_id):
+            job = await asyncio.to_thread(self.store.get_job, job_id)
+            pvs = await asyncio.to_thread(self.store.get_batch_pvs, job_id)
+            audit_log.record("id_card_transcription_job", merged_job_pv(job, pvs))
+            logger.info(f"[JOB {job_id[:8]}] Completed")
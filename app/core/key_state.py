@@ -0,0 +1,193 @@
+"""
+Key-pool state shared by every worker (and replica) using the same API keys.
+
+Selection stays in each worker's in-memory `APIKeyManager`; a `KeyStateSync` task
+periodically exchanges it with a shared store:
+- failure counts, cooldowns, quota throttling and the adaptive RPM/TPM limits of keys a
+  worker touched are published, and the newest write per key is applied everywhere;
+- every worker publishes its cumulative requests/tokens per key, and the others charge the
+  growth to their own budgets, so the per-key limits hold for the pool as a whole.
+Keys are only ever stored by `key_id`, never the key itself.
+"""
+import asyncio
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import KEY_STATE_BACKEND, KEY_STATE_PATH, KEY_STATE_SYNC_INTERVAL, KEY_STATE_USAGE_TTL
+from core.api_key_manager import APIKeyManager
+
+logger = logging.getLogger(__name__)
+
+States = Dict[str, dict]                     # key_id -> shared fields + updated_at
+Usage = Dict[str, List[float]]               # key_id -> cumulative [requests, tokens]
+PeerUsage = Dict[str, Usage]                 # worker -> Usage
+
+
+class KeyStateBackend:
+    """Storage interface for `KeyStateSync`.
+
+    `exchange` is one round-trip: store this worker's changes, return what other workers
+    wrote. A Redis implementation can keep one hash per key_id (written only when its
+    `updated_at` is newer, e.g. in a Lua script), an INCR counter as the version, and one
+    hash of usage per worker with an expiry of `KEY_STATE_USAGE_TTL`.
+    """
+
+    def exchange(self, worker: str, states: States, usage: Usage, since: int) -> Tuple[States, PeerUsage, int]:
+        """
+        Write `states` (newer `updated_at` wins) and this worker's `usage`; return the states
+        other workers wrote after version `since`, every other live worker's usage, and the
+        current version.
+        """
+        raise NotImplementedError
+
+
+class SQLiteKeyStateBackend(KeyStateBackend):
+    """Host-wide store shared by the uvicorn workers through one SQLite file."""
+
+    def __init__(self, path: str = KEY_STATE_PATH, usage_ttl: float = KEY_STATE_USAGE_TTL):
+        self.path = path
+        self.usage_ttl = usage_ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS key_state ("
+            "key_id TEXT PRIMARY KEY, failure_count INTEGER NOT NULL, cooldown_until REAL NOT NULL, "
+            "throttled_until REAL NOT NULL, rpm_limit REAL NOT NULL, tpm_limit REAL NOT NULL, "
+            "updated_at REAL NOT NULL, worker TEXT NOT NULL, version INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS key_usage ("
+            "worker TEXT NOT NULL, key_id TEXT NOT NULL, requests REAL NOT NULL, tokens REAL NOT NULL, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (worker, key_id))"
+        )
+
+    def exchange(self, worker: str, states: States, usage: Usage, since: int) -> Tuple[States, PeerUsage, int]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._conn.execute("SELECT COALESCE(MAX(version), 0) FROM key_state").fetchone()[0]
+                for kid, state in states.items():
+                    version += 1
+                    self._conn.execute(
+                        "INSERT INTO key_state (key_id, failure_count, cooldown_until, throttled_until, "
+                        "rpm_limit, tpm_limit, updated_at, worker, version) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                        "ON CONFLICT(key_id) DO UPDATE SET failure_count = excluded.failure_count, "
+                        "cooldown_until = excluded.cooldown_until, throttled_until = excluded.throttled_until, "
+                        "rpm_limit = excluded.rpm_limit, tpm_limit = excluded.tpm_limit, "
+                        "updated_at = excluded.updated_at, worker = excluded.worker, version = excluded.version "
+                        "WHERE excluded.updated_at > key_state.updated_at",
+                        (kid, state['failure_count'], state['cooldown_until'], state['throttled_until'],
+                         state['rpm_limit'], state['tpm_limit'], state['updated_at'], worker, version)
+                    )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO key_usage (worker, key_id, requests, tokens, updated_at) VALUES (?, ?, ?, ?, ?)",
+                    [(worker, kid, requests, tokens, now) for kid, (requests, tokens) in usage.items()]
+                )
+                self._conn.execute("DELETE FROM key_usage WHERE updated_at < ?", (now - self.usage_ttl,))
+
+                remote_states = {
+                    row[0]: {
+                        'failure_count': row[1], 'cooldown_until': row[2], 'throttled_until': row[3],
+                        'rpm_limit': row[4], 'tpm_limit': row[5], 'updated_at': row[6],
+                    }
+                    for row in self._conn.execute(
+                        "SELECT key_id, failure_count, cooldown_until, throttled_until, rpm_limit, tpm_limit, "
+                        "updated_at FROM key_state WHERE version > ? AND worker != ?", (since, worker)
+                    )
+                }
+                peer_usage: PeerUsage = {}
+                for peer, kid, requests, tokens in self._conn.execute(
+                        "SELECT worker, key_id, requests, tokens FROM key_usage WHERE worker != ?", (worker,)):
+                    peer_usage.setdefault(peer, {})[kid] = [requests, tokens]
+                version = self._conn.execute("SELECT COALESCE(MAX(version), 0) FROM key_state").fetchone()[0]
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return remote_states, peer_usage, version
+
+
+class KeyStateSync:
+    """Background exchange between one `APIKeyManager` and a `KeyStateBackend`."""
+
+    def __init__(self,
+                 api_key_manager: APIKeyManager,
+                 backend: KeyStateBackend,
+                 interval: float = KEY_STATE_SYNC_INTERVAL):
+        self.api_key_manager = api_key_manager
+        self.backend = backend
+        self.interval = interval
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"
+        self._version: Optional[int] = None  # None until the first exchange
+        self._seen: Dict[Tuple[str, str], List[float]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _usage_growth(self, peer_usage: PeerUsage) -> Usage:
+        """Usage peers added since the last exchange; the first exchange only sets the baseline."""
+        baseline = self._version is None
+        growth: Usage = {}
+        for peer, usage in peer_usage.items():
+            for kid, (requests, tokens) in usage.items():
+                seen = self._seen.get((peer, kid), [0.0, 0.0])
+                # Counters going backwards mean the peer restarted under the same id
+                if requests < seen[0] or tokens < seen[1]:
+                    seen = [0.0, 0.0]
+                if not baseline:
+                    total = growth.setdefault(kid, [0.0, 0.0])
+                    total[0] += requests - seen[0]
+                    total[1] += tokens - seen[1]
+                self._seen[(peer, kid)] = [requests, tokens]
+        return growth
+
+    def sync_once(self):
+        states, usage = self.api_key_manager.export_shared_state()
+        try:
+            remote_states, peer_usage, version = self.backend.exchange(
+                self.worker, states, usage, self._version or 0)
+        except Exception:
+            self.api_key_manager.requeue_shared_state(list(states) + list(usage))
+            raise
+        growth = self._usage_growth(peer_usage)
+        self._version = version
+        if remote_states or growth:
+            self.api_key_manager.apply_shared_state(remote_states, growth)
+
+    async def start(self):
+        self.worker = f"{socket.gethostname()}-{os.getpid()}"  # the app may have been imported before the fork
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        try:
+            # Publish the last failures and usage so the other workers don't re-learn them
+            await asyncio.to_thread(self.sync_once)
+        except Exception as e:
+            logger.warning(f"[KEY-STATE] Final sync failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.sync_once)
+            except Exception as e:
+                logger.warning(f"[KEY-STATE] Sync failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+def build_key_state_sync(api_key_manager: APIKeyManager, backend: str = KEY_STATE_BACKEND) -> Optional[KeyStateSync]:
+    if backend == "none":
+        return None
+    if backend == "sqlite":
+        return KeyStateSync(api_key_manager, SQLiteKeyStateBackend())
+    raise RuntimeError(f"Configuration error: unknown key state backend '{backend}'")
@@ -1,13 +1,13 @@
+import copy
+import hashlib
 import json
 import os
 import asyncio
 import random
-import threading
 import time
-from typing import List, Type, Union
+from typing import List, Optional, Type, Union
 from PIL import Image
 from dotenv import load_dotenv
-import google.generativeai as genai
 from google.api_core.exceptions import (
     InvalidArgument, PermissionDenied, ResourceExhausted, GoogleAPIError
 )
@@ -15,11 +15,23 @@ from google.api_core.exceptions import (
 import logging
 from pydantic import BaseModel, ValidationError
 
-from config import SYSTEM_MAX_RETRIES, VALIDATION_MAX_RETRIES
-from core.api_key_manager import APIKeyManager
-from exceptions.llm_exceptions import NoResponseError, ValidationRetryError
-from utils.client_utils import calculate_input_tokens, calculate_output_tokens
-from utils.prompt_utils import extract_json_from_response
+from config import (
+    COALESCE_IDENTICAL_REQUESTS, LLM_RECORD_PATH, LLM_TRANSPORT, RATE_LIMIT_MAX_WAIT, STRUCTURED_OUTPUT,
+    SYSTEM_MAX_RETRIES, VALIDATION_MAX_RETRIES
+)
+from core.api_key_manager import APIKeyManager, key_id
+from core.hedging import HedgePolicy
+from core.metrics import ATTEMPTS, HEDGES, PARSE_LATENCY, UPSTREAM_LATENCY
+from core.rate_limiter import parse_quota_error
+from core.session_pool import SessionPool
+from core.single_flight import SingleFlight
+from core.structured_output import response_config
+from core.transport import build_transport
+from exceptions.image_exceptions import InvalidIDCardError
+from exceptions.llm_exceptions import NoResponseError, TruncatedResponseError, ValidationRetryError
+from models.image import EncodedImage
+from utils.client_utils import calculate_image_bytes, calculate_input_tokens, calculate_output_tokens
+from utils.prompt_utils import extract_json_from_response, is_invalid_id_card_message
 
 load_dotenv(dotenv_path="./api_keys.env")
 logger = logging.getLogger(__name__)
@@ -28,15 +40,24 @@ logger = logging.getLogger(__name__)
 class LLM:
     """Robust LLM client with proper key rotation and session isolation"""
 
-    
-    _global_lock = threading.Lock()  # Protects global genai.configure
-
-    def __init__(self, model_name: str = "gemini-2.0-flash", max_validation_retries: int = VALIDATION_MAX_RETRIES):
+    def __init__(self,
+                 model_name: str = "gemini-2.0-flash",
+                 max_validation_retries: int = VALIDATION_MAX_RETRIES,
+                 transport=None,
+                 structured_output: bool = STRUCTURED_OUTPUT):
         self.model_name = model_name
         self.max_validation_retries = max_validation_retries
+        self.structured_output = structured_output
         self.api_key_manager = APIKeyManager()
+        self.sessions = SessionPool(model_name)
+        self.api_key_manager.add_listener(self.sessions.on_key_event)
+        # Any object with `async generate(key, prompt, generation_config)` can be plugged in (e.g. an offline fake)
+        self.transport = transport or build_transport(LLM_TRANSPORT, self.sessions, LLM_RECORD_PATH)
         self.MAX_QUOTA_RETRIES = max(5, self._count_api_keys() * 2)
         self.client_id = f"cli-{time.time_ns()}-{random.randint(10000,99999)}"
+        self.coalesce_requests = COALESCE_IDENTICAL_REQUESTS
+        self._single_flight = SingleFlight()
+        self.hedge_policy = HedgePolicy()
 
     def _count_api_keys(self) -> int:
         i, count = 1, 0
@@ -45,86 +66,182 @@ class LLM:
             i += 1
         return count
 
-    def _create_fresh_session(self, key: str):
-        client_config = genai.types.GenerationConfig(
-            candidate_count=1,
-            max_output_tokens=2048,
-        )
-        with LLM._global_lock:
-            genai.configure(api_key=key)
-        return genai.GenerativeModel(
-            model_name=self.model_name,
-            generation_config=client_config
-        )
-
-    async def _call_api(self, prompt: Union[str, List[Union[str, Image.Image]]]):
-        key = self.api_key_manager.get_best_key()
-        client = await asyncio.to_thread(self._create_fresh_session, key)
-        logger.info(f"[CALL] Using key {key[:9]} for this request")
-        response = await asyncio.to_thread(client.generate_content, prompt)
+    async def _call_api(self,
+                        prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]],
+                        key: str,
+                        generation_config: Optional[dict] = None):
+        logger.info(f"[CALL] Using key {key_id(key)} for this request", extra={"key": key_id(key)})
+        if isinstance(prompt, list):
+            # Encoded images go as inline data, exactly as prepared
+            prompt = [part.as_blob() if isinstance(part, EncodedImage) else part for part in prompt]
+        response = await self.transport.generate(key, prompt, generation_config)
         if response is None or not hasattr(response, 'text'):
             # Mark as failure and raise clear error
             self.api_key_manager.mark_key_failure(key)
             raise RuntimeError("No valid response from LLM")
-        return response, key
+        return response
+
+    @staticmethod
+    def _is_truncated(response, text: str) -> bool:
+        """True when the model hit max_output_tokens before closing its answer."""
+        candidates = getattr(response, "candidates", None)
+        if candidates:
+            reason = getattr(candidates[0], "finish_reason", None)
+            return getattr(reason, "name", reason) == "MAX_TOKENS"
+        # Responses without candidate metadata: an opened but never closed ```json fence
+        return text.count("```") == 1
+
+    def _fingerprint(self,
+                     prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]],
+                     output_model: Type[BaseModel],
+                     allow_partial: bool = False,
+                     schema: bool = True) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.model_name}|{output_model.__module__}.{output_model.__qualname__}|{allow_partial}|"
+                      f"{self.structured_output and schema}".encode("utf-8"))
+        for part in (prompt if isinstance(prompt, list) else [prompt]):
+            if isinstance(part, str):
+                digest.update(b"s" + part.encode("utf-8"))
+            elif isinstance(part, EncodedImage):
+                digest.update(f"e{part.mime_type}".encode("utf-8") + part.data)
+            elif isinstance(part, Image.Image):
+                digest.update(f"i{part.mode}{part.size}".encode("utf-8"))
+                digest.update(part.tobytes())
+            elif isinstance(part, (bytes, bytearray)):
+                digest.update(b"b" + bytes(part))
+            else:
+                digest.update(b"r" + repr(part).encode("utf-8"))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _validate_items(items: list, output_model: Type[BaseModel]) -> tuple:
+        valid, rejected = [], []
+        for index, item in enumerate(items):
+            try:
+                valid.append(output_model(**item))
+            except ValidationError as e:
+                first = e.errors()[0]
+                rejected.append(f"item {index} {'.'.join(map(str, first['loc']))}: {first['msg']}")
+            except TypeError as e:
+                rejected.append(f"item {index}: {e}")
+        return valid, rejected
+
+    def _parse(self, text: str, output_model: Type[BaseModel], allow_partial: bool) -> tuple:
+        """Extract and validate the JSON answer; returns (result, rejected item errors, items returned)."""
+        start = time.perf_counter()
+        try:
+            parsed = extract_json_from_response(text)
+            if not parsed:
+                if is_invalid_id_card_message(text):
+                    # The card prompts answer this for photocopies and non-cards; asking again won't change it
+                    raise InvalidIDCardError("Model reported an invalid ID card")
+                raise NoResponseError("No parsable content")
+            if isinstance(parsed, list) and allow_partial:
+                result, rejected = self._validate_items(parsed, output_model)
+                if not result:
+                    raise NoResponseError(f"None of the {len(parsed)} item(s) passed validation: {rejected[0]}")
+                return result, rejected, len(parsed)
+            if isinstance(parsed, list):
+                return [output_model(**item) for item in parsed], [], len(parsed)
+            return output_model(**parsed), [], 1
+        finally:
+            PARSE_LATENCY.observe(time.perf_counter() - start, model=output_model.__name__)
+
+    def _record_attempt(self, pv: dict, attempt: dict):
+        pv["attempts"].append(attempt)
+        ATTEMPTS.inc(status=attempt["status"], model=self.model_name)
 
     async def generate(self,
-                       prompt: Union[str, List[Union[str, Image.Image]]],
-                       output_model: Type[BaseModel]) -> Union[dict, BaseModel, List[BaseModel]]:
+                       prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]],
+                       output_model: Type[BaseModel],
+                       allow_partial: bool = False,
+                       hedge: bool = False,
+                       schema: bool = True) -> Union[dict, BaseModel, List[BaseModel]]:
+        """
+        With `allow_partial`, a list answer is validated item by item: the valid items are
+        returned and the invalid ones dropped (attempt status "partial"). Only an answer with
+        no valid item at all is retried.
+        With `hedge`, a slow attempt gets a second one on another key (see `_hedged_attempt`).
+        In structured output mode the answer is bare JSON; with `schema` it is also held to
+        `output_model` (a list of it with `allow_partial`). Calls whose prompt allows an answer
+        outside the model, such as "invalid id card", pass `schema=False`.
+        """
+        if not self.coalesce_requests:
+            return await self._generate(prompt, output_model, allow_partial, hedge, schema)
+
+        start_time = time.time()
+        fingerprint = self._fingerprint(prompt, output_model, allow_partial, schema)
+        shared = fingerprint in self._single_flight
+        try:
+            result_with_pv, _ = await self._single_flight.do(
+                fingerprint,
+                lambda: self._generate(prompt, output_model, allow_partial, hedge, schema)
+            )
+        except Exception as e:
+            if not shared or getattr(e, "pv", None) is None:
+                raise
+            # Followers get their own copy of the leader's error, so its PV is only recorded once
+            error = copy.copy(e)
+            error.pv = self._coalesced_pv(start_time)
+            raise error from e
+        if not shared:
+            return result_with_pv
+        return {"pv": self._coalesced_pv(start_time), "result": result_with_pv["result"]}
+
+    @staticmethod
+    def _coalesced_pv(start_time: float) -> dict:
+        """The leader's PV already accounts for the upstream calls; followers record a zero-cost entry."""
+        return {
+            "total_api_calls": 0,
+            "attempts": [],
+            "total_input_tokens": 0,
+            "total_output_tokens": 0,
+            "keys_used": [],
+            "image_bytes": 0,
+            "start_time": start_time,
+            "duration_total": time.time() - start_time,
+            "coalesced": True,
+        }
+
+    async def _generate(self,
+                        prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]],
+                        output_model: Type[BaseModel],
+                        allow_partial: bool = False,
+                        hedge: bool = False,
+                        schema: bool = True) -> dict:
         val_attempts = 0
         quota_attempts = 0
         system_attempts = 0
-        current_key = None
+        tokens = calculate_input_tokens(prompt)
+        # allow_partial calls are the list answers (transcription batches)
+        generation_config = response_config(output_model, allow_partial, schema) if self.structured_output else None
 
         pv = {
             "total_api_calls": 0,
             "attempts": [],
-            "total_input_tokens": calculate_input_tokens(prompt),
+            "total_input_tokens": tokens,
             "total_output_tokens": 0,
             "keys_used": set(),
+            "image_bytes": 0,
             "start_time": time.time(),
         }
 
         while True:
-            attempt = {
-                "timestamp": time.time(),
-                "key": None,
-                "status": None,
-                "input_tokens": pv["total_input_tokens"],
-                "output_tokens": 0,
-                "error_type": None,
-                "error_msg": None,
-                "duration": None,
-            }
             try:
-                start = time.time()
-                response, current_key = await self._call_api(prompt)
-                duration = time.time() - start
-
-                pv["total_api_calls"] += 1
-                attempt["key"] = current_key[:6]
-                attempt["duration"] = duration
-                pv["keys_used"].add(current_key[:6])
-
-                text = response.text.strip()
-                out_tokens = calculate_output_tokens(text)
-                attempt["output_tokens"] = out_tokens
-                pv["total_output_tokens"] += out_tokens
-                parsed = extract_json_from_response(text)
-                if not parsed:
-                    raise NoResponseError("No parsable content")
-
-                if isinstance(parsed, list):
-                    result = [output_model(**item) for item in parsed]
+                # Wait for a key with RPM/TPM budget rather than spend a call on a 429
+                wait = self.api_key_manager.seconds_until_ready()
+                if wait > 0:
+                    wait = min(wait, RATE_LIMIT_MAX_WAIT)
+                    logger.info(f"[BUDGET] No key available, waiting {wait:.1f}s")
+                    await asyncio.sleep(wait)
+                # Select the key here so failures are charged to the key that was actually used
+                current_key = self.api_key_manager.acquire_key(tokens)
+                if hedge:
+                    result = await self._hedged_attempt(prompt, output_model, allow_partial, pv, current_key, tokens,
+                                                        generation_config)
                 else:
-                    result = output_model(**parsed)
-
-                # Success: mark key
-                logger.info(f"[KEY-SUCCESS] Key {current_key[:6]} reset on success")
-                self.api_key_manager.mark_key_success(current_key)
-                attempt["status"] = "success"
-                pv["attempts"].append(attempt)
-
+                    result = await self._attempt(prompt, output_model, allow_partial, pv, current_key, tokens,
+                                                 generation_config=generation_config)
                 pv["keys_used"] = list(pv["keys_used"])
                 pv["duration_total"] = time.time() - pv["start_time"]
                 return {"pv": pv, "result": result}
@@ -133,40 +250,206 @@ class LLM:
                 # Validation errors: do not rotate key
                 val_attempts += 1
                 logger.warning(f"[VALIDATION] Attempt {val_attempts} failed: {ve}")
-                attempt["status"] = "validation_error"
-                attempt["error_type"], attempt["error_msg"] = type(ve).__name__, str(ve)
-                pv["attempts"].append(attempt)
                 if val_attempts > self.max_validation_retries:
-                    raise ValidationRetryError("Exceeded validation retries")
+                    raise self._with_pv(ValidationRetryError("Exceeded validation retries"), pv)
                 await asyncio.sleep(0.5 * val_attempts)
 
             except ResourceExhausted as rexc:
-                # Quota errors: rotate key
+                # Quota errors: the key's budget was cut and it is parked; the next attempt only
+                # waits if no other key has budget left
                 quota_attempts += 1
                 logger.warning(f"[QUOTA] Attempt {quota_attempts} resource exhausted: {rexc}")
-                self.api_key_manager.mark_key_failure(current_key)
-                attempt["status"] = "resource_exhausted"
-                attempt["error_type"], attempt["error_msg"] = type(rexc).__name__, str(rexc)
-                pv["attempts"].append(attempt)
                 if quota_attempts > self.MAX_QUOTA_RETRIES:
-                    raise RuntimeError("System quota exhausted")
-                await asyncio.sleep(min(60, 2 ** quota_attempts))
+                    raise self._with_pv(RuntimeError("System quota exhausted"), pv)
+
+            except TruncatedResponseError as te:
+                logger.warning(f"[VALIDATION] {te}, not retrying the same prompt")
+                raise self._with_pv(te, pv)
+
+            except InvalidIDCardError as ie:
+                logger.info(f"[VALIDATION] {ie}, not retrying")
+                raise self._with_pv(ie, pv)
 
             except (InvalidArgument, PermissionDenied) as ie:
                 logger.error(f"[FATAL] Configuration error: {ie}")
-                raise RuntimeError("Configuration error")
+                raise self._with_pv(RuntimeError("Configuration error"), pv)
 
             except GoogleAPIError as gae:
                 system_attempts += 1
                 logger.warning(f"[SYSTEM] API error attempt {system_attempts}: {gae}")
-                self.api_key_manager.mark_key_failure(current_key)
-                attempt["status"] = "system_error"
-                attempt["error_type"], attempt["error_msg"] = type(gae).__name__, str(gae)
-                pv["attempts"].append(attempt)
                 if system_attempts >= SYSTEM_MAX_RETRIES:
-                    raise RuntimeError("Persistent API errors")
+                    raise self._with_pv(RuntimeError("Persistent API errors"), pv)
                 await asyncio.sleep(min(30, 2 ** system_attempts))
 
             except Exception as e:
                 logger.error(f"[UNEXPECTED] {type(e).__name__}: {e}", exc_info=True)
                 raise
+
+    @staticmethod
+    def _with_pv(error: Exception, pv: dict) -> Exception:
+        """`error` carrying the calls spent so far, so callers can still account for a failed request."""
+        pv["keys_used"] = list(pv["keys_used"])
+        pv["duration_total"] = time.time() - pv["start_time"]
+        error.pv = pv
+        return error
+
+    async def _attempt(self,
+                       prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]],
+                       output_model: Type[BaseModel],
+                       allow_partial: bool,
+                       pv: dict,
+                       key: str,
+                       tokens: float,
+                       hedged: bool = False,
+                       generation_config: Optional[dict] = None):
+        """
+        One upstream call on an acquired `key`, then parsing. The key is released and marked,
+        the attempt is recorded in `pv`, and errors are re-raised for the retry loop.
+        """
+        attempt = {
+            "timestamp": time.time(),
+            "key": key_id(key),
+            "status": None,
+            "input_tokens": tokens,
+            "output_tokens": 0,
+            "error_type": None,
+            "error_msg": None,
+            "duration": None,
+            "hedged": hedged,
+        }
+        start = time.time()
+        try:
+            try:
+                response = await self._call_api(prompt, key, generation_config)
+            finally:
+                self.api_key_manager.release_key(key)
+                UPSTREAM_LATENCY.observe(time.time() - start, key=key_id(key), model=self.model_name)
+            duration = time.time() - start
+
+            pv["total_api_calls"] += 1
+            pv["image_bytes"] += calculate_image_bytes(prompt)
+            attempt["duration"] = duration
+            pv["keys_used"].add(key_id(key))
+
+            text = response.text.strip()
+            out_tokens = calculate_output_tokens(text)
+            attempt["output_tokens"] = out_tokens
+            pv["total_output_tokens"] += out_tokens
+            if self._is_truncated(response, text):
+                # The call itself went fine; the prompt asks for more than fits in one answer
+                self.api_key_manager.mark_key_success(key)
+                attempt["status"] = "validation_error"
+                attempt["error_type"] = "TruncatedResponseError"
+                attempt["error_msg"] = f"Output truncated after ~{out_tokens:.0f} tokens"
+                raise TruncatedResponseError(attempt["error_msg"])
+            result, rejected, returned = self._parse(text, output_model, allow_partial)
+
+            # Success: mark key
+            logger.info(f"[KEY-SUCCESS] Key {key_id(key)} reset on success",
+                        extra={"key": key_id(key), "latency_ms": round(duration * 1000, 1)})
+            self.api_key_manager.mark_key_success(key)
+            self.hedge_policy.observe(output_model.__name__, duration)
+            attempt["status"] = "success"
+            if rejected:
+                logger.warning(f"[VALIDATION] Kept {len(result)} item(s), dropped {len(rejected)}: {rejected[0]}")
+                attempt["status"] = "partial"
+                attempt["error_type"] = "ValidationError"
+                attempt["error_msg"] = f"{len(rejected)} of {returned} item(s) failed validation: {rejected[0]}"
+            return result
+
+        except asyncio.CancelledError:
+            # Lost a hedge race (or the client went away): the call was made, its answer is ignored
+            elapsed = time.time() - start
+            pv["total_api_calls"] += 1
+            pv["image_bytes"] += calculate_image_bytes(prompt)
+            pv["keys_used"].add(key_id(key))
+            attempt["status"] = "cancelled"
+            attempt["duration"] = elapsed
+            if not hedged:
+                self.hedge_policy.observe(output_model.__name__, elapsed)
+            raise
+
+        except (json.JSONDecodeError, ValidationError, NoResponseError) as ve:
+            attempt["status"] = "validation_error"
+            attempt["error_type"], attempt["error_msg"] = type(ve).__name__, str(ve)
+            raise
+
+        except InvalidIDCardError as ie:
+            # A definitive answer: the key did its job
+            self.api_key_manager.mark_key_success(key)
+            self.hedge_policy.observe(output_model.__name__, attempt["duration"])
+            attempt["status"] = "validation_error"
+            attempt["error_type"], attempt["error_msg"] = type(ie).__name__, str(ie)
+            raise
+
+        except ResourceExhausted as rexc:
+            kind, retry_after = parse_quota_error(rexc)
+            self.api_key_manager.mark_quota_exceeded(key, kind, retry_after)
+            attempt["status"] = "resource_exhausted"
+            attempt["error_type"], attempt["error_msg"] = type(rexc).__name__, str(rexc)
+            raise
+
+        except (InvalidArgument, PermissionDenied):
+            raise
+
+        except GoogleAPIError as gae:
+            self.api_key_manager.mark_key_failure(key)
+            attempt["status"] = "system_error"
+            attempt["error_type"], attempt["error_msg"] = type(gae).__name__, str(gae)
+            raise
+
+        finally:
+            if attempt["status"] is not None:
+                self._record_attempt(pv, attempt)
+
+    async def _hedged_attempt(self,
+                              prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]],
+                              output_model: Type[BaseModel],
+                              allow_partial: bool,
+                              pv: dict,
+                              key: str,
+                              tokens: float,
+                              generation_config: Optional[dict] = None):
+        """
+        `_attempt` on `key`, plus a second one on another key with budget if the first has not
+        answered after the hedge delay of this output model. The first valid answer wins and
+        the other attempt is cancelled; if both fail, the first error is raised.
+        """
+        kind = output_model.__name__
+        self.hedge_policy.on_request()
+        tasks = [asyncio.create_task(self._attempt(prompt, output_model, allow_partial, pv, key, tokens,
+                                                   generation_config=generation_config))]
+        try:
+            delay = self.hedge_policy.delay(kind)
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.hedge_policy.try_spend():
+                    hedge_key = self.api_key_manager.try_acquire_key(tokens, exclude=key)
+                    if hedge_key is not None:
+                        logger.info(f"[HEDGE] {kind} unanswered after {delay:.2f}s on {key_id(key)}, "
+                                    f"hedging on {key_id(hedge_key)}")
+                        HEDGES.inc(model=kind)
+                        pv["total_input_tokens"] += tokens
+                        tasks.append(asyncio.create_task(
+                            self._attempt(prompt, output_model, allow_partial, pv, hedge_key, tokens, hedged=True,
+                                          generation_config=generation_config)))
+
+            first_error = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in tasks:
+                    if task not in done:
+                        continue
+                    error = task.exception()
+                    if error is None:
+                        return task.result()
+                    if isinstance(error, (TruncatedResponseError, InvalidIDCardError)):
+                        raise error  # the same prompt would end the same way on the other key
+                    first_error = first_error or error
+            raise first_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,295 @@
+import asyncio
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(values: dict) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in values.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    items = [f'{k}="{_escape(v)}"' for k, v in labels]
+    return "{" + ",".join(items) + "}" if items else ""
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Counter:
+    def __init__(self, registry: "MetricsRegistry", name: str):
+        self.registry = registry
+        self.name = name
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _labels(labels)
+        with self.registry.lock:
+            values = self.registry.counters[self.name]
+            values[key] = values.get(key, 0.0) + amount
+
+
+class Histogram:
+    def __init__(self, registry: "MetricsRegistry", name: str, buckets: Tuple[float, ...]):
+        self.registry = registry
+        self.name = name
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels):
+        key = _labels(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            series = self.registry.histograms[self.name]
+            state = series.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, +Inf last, then sum
+                state = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+
+class MetricsRegistry:
+    """
+    Minimal Prometheus registry: counters and histograms are plain dict updates under a lock,
+    gauges are collected from callbacks at scrape time.
+
+    Each uvicorn worker keeps its own registry and periodically writes a snapshot to
+    `directory`; a scrape served by any worker merges the live registry with the other
+    workers' snapshots. Counters and histograms of exited workers are kept, their gauges dropped.
+    """
+
+    def __init__(self, directory: str = METRICS_DIR, flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.meta: Dict[str, Tuple[str, str]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, list]] = {}
+        self.buckets: Dict[str, Tuple[float, ...]] = {}
+        self._gauge_collectors: List[Callable[[], Iterable[Tuple[str, dict, float]]]] = []
+        self._flusher: Optional[asyncio.Task] = None
+        self.pid = os.getpid()
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        self.meta[name] = ("counter", help_text)
+        self.counters.setdefault(name, {})
+        return Counter(self, name)
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        self.meta[name] = ("histogram", help_text)
+        self.histograms.setdefault(name, {})
+        self.buckets[name] = tuple(buckets)
+        return Histogram(self, name, self.buckets[name])
+
+    def gauge(self, name: str, help_text: str):
+        self.meta[name] = ("gauge", help_text)
+
+    def add_gauge_collector(self, collector: Callable[[], Iterable[Tuple[str, dict, float]]]):
+        """`collector()` returns (gauge name, labels, value) samples; it runs on every scrape and flush."""
+        self._gauge_collectors.append(collector)
+
+    def collect_gauges(self) -> List[list]:
+        samples = []
+        for collector in self._gauge_collectors:
+            try:
+                samples.extend([name, _labels(labels), value] for name, labels, value in collector())
+            except Exception as e:
+                logger.warning(f"[METRICS] Gauge collector failed: {e}")
+        return samples
+
+    def snapshot(self, gauges: Optional[List[list]] = None) -> dict:
+        with self.lock:
+            counters = [[name, list(labels), value] for name, series in self.counters.items()
+                        for labels, value in series.items()]
+            histograms = [[name, list(labels), list(state)] for name, series in self.histograms.items()
+                          for labels, state in series.items()]
+        return {
+            "pid": self.pid,
+            "written_at": time.time(),
+            "counters": counters,
+            "histograms": histograms,
+            "gauges": [[name, list(labels), value] for name, labels, value in (gauges or [])],
+        }
+
+    # ---- cross-worker sharing ----
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.directory, f"worker-{pid}.json")
+
+    def flush(self, gauges: Optional[List[list]] = None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(self.pid)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(gauges), f)
+        os.replace(tmp, path)
+
+    def _peer_snapshots(self) -> List[dict]:
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, "worker-*.json")):
+            if path == self._snapshot_path(self.pid):
+                continue
+            try:
+                with open(path, encoding="utf-8") as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue  # being replaced or half written by a dying worker
+        return snapshots
+
+    async def start(self):
+        self.pid = os.getpid()  # the registry may have been imported before the worker was forked
+        if self.flush_interval > 0 and self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        try:
+            # Final counters stay on disk so totals survive this worker; gauges of a dead pid are ignored
+            await asyncio.to_thread(self.flush, self.collect_gauges())
+        except Exception as e:
+            logger.warning(f"[METRICS] Final flush failed: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await asyncio.to_thread(self.flush, self.collect_gauges())
+            except Exception as e:
+                logger.warning(f"[METRICS] Flush failed: {e}")
+
+    # ---- exposition ----
+
+    def render(self, gauges: List[list], include_peers: bool = True) -> str:
+        """Prometheus text format (0.0.4) for this worker merged with its peers' snapshots."""
+        snapshots = [self.snapshot(gauges)]
+        if include_peers:
+            snapshots.extend(self._peer_snapshots())
+
+        counters: Dict[str, Dict[Labels, float]] = {}
+        histograms: Dict[str, Dict[Labels, list]] = {}
+        gauge_values: Dict[str, Dict[Labels, float]] = {}
+        for snap in snapshots:
+            for name, labels, value in snap["counters"]:
+                series = counters.setdefault(name, {})
+                key = tuple(map(tuple, labels))
+                series[key] = series.get(key, 0.0) + value
+            for name, labels, state in snap["histograms"]:
+                series = histograms.setdefault(name, {})
+                key = tuple(map(tuple, labels))
+                if key in series and len(series[key]) == len(state):
+                    series[key] = [a + b for a, b in zip(series[key], state)]
+                elif key not in series:
+                    series[key] = list(state)
+            if snap["pid"] == self.pid or _pid_alive(snap["pid"]):
+                for name, labels, value in snap["gauges"]:
+                    key = tuple(map(tuple, labels)) + (("worker", str(snap["pid"])),)
+                    gauge_values.setdefault(name, {})[key] = value
+
+        lines = []
+        for name, (kind, help_text) in sorted(self.meta.items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for labels, value in sorted(counters.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            elif kind == "gauge":
+                for labels, value in sorted(gauge_values.get(name, {}).items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            else:
+                buckets = self.buckets[name]
+                for labels, state in sorted(histograms.get(name, {}).items()):
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float("inf"),), state[:-1]):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                        lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {state[-1]:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+UPSTREAM_LATENCY = registry.histogram(
+    "idcard_upstream_latency_seconds", "Duration of one upstream model call, by key and model")
+ATTEMPTS = registry.counter(
+    "idcard_llm_attempts_total", "LLM attempts by AttemptInfo.status")
+PARSE_LATENCY = registry.histogram(
+    "idcard_llm_parse_seconds", "JSON extraction and validation time of one model answer",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+IMAGE_PREPROCESS_LATENCY = registry.histogram(
+    "idcard_image_preprocess_seconds", "Upload decode and resize time, queueing included")
+HEDGES = registry.counter(
+    "idcard_llm_hedges_total", "Second attempts sent because the first was slower than the hedge delay")
+ADMISSIONS = registry.counter(
+    "idcard_admission_total", "Admission decisions by endpoint and outcome (admitted or rejected_*)")
+ADMISSION_WAIT = registry.histogram(
+    "idcard_admission_wait_seconds", "Time admitted requests spent in the admission queue")
+UPLOADS_REJECTED = registry.counter(
+    "idcard_uploads_rejected_total", "Uploads refused before decoding, by reason")
+IMAGE_PAYLOADS = registry.counter(
+    "idcard_image_payloads_total", "Model-ready images by path (passthrough: upload bytes forwarded, reencoded)")
+IMAGE_PAYLOAD_BYTES = registry.counter(
+    "idcard_image_payload_bytes_total", "Encoded size of the model-ready images, by path")
+PRESCREEN_REJECTS = registry.counter(
+    "idcard_prescreen_rejected_total", "Card images rejected by the local pre-screen, by reason")
+AUDIT_RECORDS = registry.counter(
+    "idcard_audit_records_total", "PV audit records written or dropped on a full queue")
+LOG_RECORDS_DROPPED = registry.counter(
+    "idcard_log_records_dropped_total", "Log records dropped because the logging queue was full")
+registry.gauge("idcard_keys", "API keys by pool state")
+registry.gauge("idcard_key_failures", "Consecutive failure count per API key")
+registry.gauge("idcard_key_in_flight", "Requests in flight per API key")
+registry.gauge("idcard_admission_active", "Requests holding an admission slot")
+registry.gauge("idcard_admission_queued", "Requests waiting for an admission slot")
+registry.gauge("idcard_admission_capacity", "Admission slots the ready keys allow")
+registry.gauge("idcard_key_rpm_limit", "Current adaptive requests-per-minute budget per API key")
+registry.gauge("idcard_key_tpm_limit", "Current adaptive input-tokens-per-minute budget per API key")
+
+
+def key_pool_collector(api_key_manager) -> Callable[[], Iterable[Tuple[str, dict, float]]]:
+    def collect():
+        stats = api_key_manager.pool_stats()
+        for state in ("ready", "saturated", "cooling", "throttled"):
+            yield "idcard_keys", {"state": state}, stats[state]
+        for key_id, md in stats["keys"].items():
+            yield "idcard_key_failures", {"key": key_id}, md["failure_count"]
+            yield "idcard_key_in_flight", {"key": key_id}, md["in_flight"]
+            yield "idcard_key_rpm_limit", {"key": key_id}, md["rpm_limit"]
+            yield "idcard_key_tpm_limit", {"key": key_id}, md["tpm_limit"]
+    return collect
+
+
+def admission_collector(admission) -> Callable[[], Iterable[Tuple[str, dict, float]]]:
+    def collect():
+        stats = admission.stats()
+        yield "idcard_admission_active", {}, stats["active"]
+        yield "idcard_admission_queued", {}, stats["queued"]
+        yield "idcard_admission_capacity", {}, stats["capacity"]
+    return collect
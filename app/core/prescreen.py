@@ -0,0 +1,140 @@
+"""
+Local checks on a decoded card image, run before any model call.
+
+The card prompts make the model answer "invalid id card" for photocopies and non-cards;
+the obvious cases are cheaper to catch here, on the already resized image:
+- grayscale: low colorfulness (Hasler & Suesstrunk) and low mean saturation, i.e. a
+  black-and-white photocopy or scan;
+- blank: almost no luminance contrast;
+- blurry: low variance of the Laplacian (at SCREEN_SIZE, so thresholds don't depend on upload size);
+- aspect_ratio: long/short side ratio of a card cut out by the card crop outside the range
+  a card can have (a full frame has the photo's shape, not the card's, so it is not checked);
+- template: perceptual hash close to a known bad image (specimens, test images).
+Thresholds are in config.py; `python -m benchmarks.prescreen_eval` measures them offline.
+"""
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageStat
+
+from config import (
+    PRESCREEN_ASPECT_RANGE, PRESCREEN_MIN_COLORFULNESS, PRESCREEN_MIN_CONTRAST, PRESCREEN_MIN_SATURATION,
+    PRESCREEN_MIN_SHARPNESS, PRESCREEN_TEMPLATE_DISTANCE, PRESCREEN_TEMPLATES_PATH
+)
+
+HASH_SIZE = 8
+SCREEN_SIZE = 384
+_DCT_SIZE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT = _dct_matrix(_DCT_SIZE)
+
+
+def perceptual_hash(img: Image.Image) -> int:
+    """64-bit pHash: signs of the low DCT frequencies of a 32x32 grayscale thumbnail against their median."""
+    pixels = np.asarray(img.convert("L").resize((_DCT_SIZE, _DCT_SIZE), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])  # the DC term would skew the median
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def load_templates(path: str = PRESCREEN_TEMPLATES_PATH) -> Dict[str, int]:
+    """{name: hex pHash} JSON file; missing file means no templates."""
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return {name: int(value, 16) for name, value in json.load(f).items()}
+
+
+@dataclass(frozen=True)
+class PrescreenResult:
+    reason: Optional[str]  # None when the image passed
+    detail: str = ""
+    scores: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def passed(self) -> bool:
+        return self.reason is None
+
+
+def image_scores(img: Image.Image) -> Dict[str, float]:
+    """Statistics of `img`, measured on a copy of at most SCREEN_SIZE pixels a side so they cost milliseconds."""
+    width, height = img.size
+    small = img.convert("RGB")
+    factor = max(width, height) // SCREEN_SIZE
+    if factor > 1:
+        small = small.reduce(factor)
+
+    rgb = np.asarray(small, dtype=np.float32)
+    rg = rgb[..., 0] - rgb[..., 1]
+    yb = 0.5 * (rgb[..., 0] + rgb[..., 1]) - rgb[..., 2]
+    colorfulness = np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean())
+
+    gray_img = small.convert("L")
+    gray = np.asarray(gray_img, dtype=np.int16)
+    laplacian = gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1] - 4 * gray[1:-1, 1:-1]
+
+    return {
+        "colorfulness": float(colorfulness),
+        "saturation": ImageStat.Stat(small.convert("HSV")).mean[1] / 255,
+        "contrast": ImageStat.Stat(gray_img).stddev[0],
+        "sharpness": float(laplacian.var()) if laplacian.size else 0.0,
+        "aspect_ratio": max(width, height) / max(1, min(width, height)),
+    }
+
+
+class ImagePrescreener:
+    """Rejects obvious non-cards from image statistics; picklable, so it runs in the preprocessing workers."""
+
+    def __init__(self,
+                 min_colorfulness: float = PRESCREEN_MIN_COLORFULNESS,
+                 min_saturation: float = PRESCREEN_MIN_SATURATION,
+                 min_contrast: float = PRESCREEN_MIN_CONTRAST,
+                 min_sharpness: float = PRESCREEN_MIN_SHARPNESS,
+                 aspect_range: Tuple[float, float] = PRESCREEN_ASPECT_RANGE,
+                 templates: Optional[Dict[str, int]] = None,
+                 template_distance: int = PRESCREEN_TEMPLATE_DISTANCE):
+        self.min_colorfulness = min_colorfulness
+        self.min_saturation = min_saturation
+        self.min_contrast = min_contrast
+        self.min_sharpness = min_sharpness
+        self.aspect_range = aspect_range
+        self.templates = load_templates() if templates is None else templates
+        self.template_distance = template_distance
+
+    def screen(self, img: Image.Image, card_crop: bool = True) -> PrescreenResult:
+        """`card_crop`: `img` is the card itself rather than a full frame, so its aspect ratio is checked."""
+        scores = image_scores(img)
+        low, high = self.aspect_range
+        if card_crop and not low <= scores["aspect_ratio"] <= high:
+            return PrescreenResult("aspect_ratio", f"aspect ratio {scores['aspect_ratio']:.2f} outside {low}-{high}", scores)
+        if scores["contrast"] < self.min_contrast:
+            return PrescreenResult("blank", f"contrast {scores['contrast']:.1f} < {self.min_contrast}", scores)
+        if scores["colorfulness"] < self.min_colorfulness and scores["saturation"] < self.min_saturation:
+            return PrescreenResult(
+                "grayscale",
+                f"colorfulness {scores['colorfulness']:.1f} < {self.min_colorfulness} and "
+                f"saturation {scores['saturation']:.3f} < {self.min_saturation}", scores)
+        if scores["sharpness"] < self.min_sharpness:
+            return PrescreenResult("blurry", f"sharpness {scores['sharpness']:.1f} < {self.min_sharpness}", scores)
+        if self.templates:
+            phash = perceptual_hash(img)
+            name, distance = min(((n, hamming(phash, t)) for n, t in self.templates.items()), key=lambda x: x[1])
+            scores["template_distance"] = float(distance)
+            if distance <= self.template_distance:
+                return PrescreenResult("template", f"matches known template '{name}' (distance {distance})", scores)
+        return PrescreenResult(None, "", scores)
@@ -0,0 +1,143 @@
+"""
+Per-key request and token budgets.
+
+Every key gets two continuously refilling token buckets: requests per minute and input
+tokens per minute. Limits start at the configured ceilings and adapt AIMD-style: a quota
+error multiplies the limit it names by RATE_LIMIT_DECREASE and drains the bucket, every
+success grows both limits back by RATE_LIMIT_RECOVERY of the ceiling.
+"""
+import re
+from typing import Optional, Tuple
+
+from config import RATE_LIMIT_DECREASE, RATE_LIMIT_MIN_SHARE, RATE_LIMIT_RECOVERY
+
+_RETRY_IN = re.compile(r"retry in ([\d.]+)\s*s", re.IGNORECASE)
+_RETRY_DELAY = re.compile(r"retry_?delay\W+(?:seconds:\s*)?([\d.]+)", re.IGNORECASE)
+
+
+class TokenBucket:
+    """Refills at `limit` per minute up to `limit`; a ceiling of 0 disables it."""
+
+    __slots__ = ("ceiling", "limit", "level", "updated")
+
+    def __init__(self, ceiling: float, now: float):
+        self.ceiling = float(ceiling)
+        self.limit = self.ceiling
+        self.level = self.ceiling
+        self.updated = now
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60.0)
+            self.updated = now
+
+    def wait(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken; amounts above the limit wait for a full bucket."""
+        if self.ceiling <= 0:
+            return 0.0
+        self._refill(now)
+        missing = min(amount, self.limit) - self.level
+        return missing * 60.0 / self.limit if missing > 0 else 0.0
+
+    def take(self, amount: float, now: float):
+        self.charge(min(amount, self.limit), now)
+
+    def charge(self, amount: float, now: float):
+        if self.ceiling <= 0:
+            return
+        self._refill(now)
+        # A key used over budget (every key exhausted, or by other workers) goes into debt, bounded to one minute
+        self.level = max(-self.limit, self.level - amount)
+
+    def set_limit(self, limit: float):
+        if self.ceiling > 0:
+            self.limit = max(self.ceiling * RATE_LIMIT_MIN_SHARE, min(self.ceiling, limit))
+            self.level = min(self.level, self.limit)
+
+    def decrease(self):
+        if self.ceiling > 0:
+            self.limit = max(self.ceiling * RATE_LIMIT_MIN_SHARE, self.limit * RATE_LIMIT_DECREASE)
+            self.level = min(self.level, 0.0)
+
+    def increase(self):
+        if self.ceiling > 0:
+            self.limit = min(self.ceiling, self.limit + self.ceiling * RATE_LIMIT_RECOVERY)
+
+
+class KeyBudget:
+    def __init__(self, rpm: float, tpm: float, now: float):
+        self.requests = TokenBucket(rpm, now)
+        self.tokens = TokenBucket(tpm, now)
+
+    def wait(self, tokens: float, now: float) -> float:
+        return max(self.requests.wait(1, now), self.tokens.wait(tokens, now))
+
+    def take(self, tokens: float, now: float):
+        self.requests.take(1, now)
+        self.tokens.take(tokens, now)
+
+    def charge(self, requests: float, tokens: float, now: float):
+        """Usage made elsewhere (another worker) on the same key."""
+        self.requests.charge(requests, now)
+        self.tokens.charge(tokens, now)
+
+    def at_ceiling(self) -> bool:
+        return self.requests.limit >= self.requests.ceiling and self.tokens.limit >= self.tokens.ceiling
+
+    def set_limits(self, rpm_limit: float, tpm_limit: float):
+        self.requests.set_limit(rpm_limit)
+        self.tokens.set_limit(tpm_limit)
+
+    def on_success(self):
+        self.requests.increase()
+        self.tokens.increase()
+
+    def on_quota_error(self, kind: Optional[str]):
+        """`kind` is "rpm", "tpm" or None when the error does not say which limit was hit."""
+        if kind in ("rpm", None):
+            self.requests.decrease()
+        if kind in ("tpm", None):
+            self.tokens.decrease()
+
+    def enforces(self, kind: Optional[str]) -> bool:
+        """True when the limit named by `kind` ("rpm", "tpm", None for either) is enabled."""
+        if kind == "rpm":
+            return self.requests.ceiling > 0
+        if kind == "tpm":
+            return self.tokens.ceiling > 0
+        return self.requests.ceiling > 0 or self.tokens.ceiling > 0
+
+    def snapshot(self) -> dict:
+        return {"rpm_limit": self.requests.limit, "tpm_limit": self.tokens.limit}
+
+
+def parse_quota_error(exc: Exception) -> Tuple[Optional[str], Optional[float]]:
+    """
+    Read what a ResourceExhausted says about the limit that was hit: ("rpm" | "tpm" | "daily" | None,
+    retry delay in seconds or None), from the Retry-After header, RetryInfo details or the message.
+    """
+    text = str(exc)
+    for detail in getattr(exc, "details", None) or []:
+        text += " " + str(detail)
+    lowered = text.lower()
+    if "perday" in lowered or "per day" in lowered:
+        kind = "daily"
+    elif "token" in lowered:
+        kind = "tpm"
+    elif "request" in lowered or "perminute" in lowered:
+        kind = "rpm"
+    else:
+        kind = None
+
+    retry_after = None
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None and headers.get("retry-after"):
+        try:
+            retry_after = float(headers.get("retry-after"))
+        except ValueError:
+            pass
+    if retry_after is None:
+        match = _RETRY_DELAY.search(text) or _RETRY_IN.search(text)
+        if match:
+            retry_after = float(match.group(1))
+    return kind, retry_after
@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple, Type
+
+from pydantic import BaseModel
+
+from config import (
+    RESULT_CACHE_BACKEND, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_MAX_ENTRIES,
+    RESULT_CACHE_PATH, RESULT_CACHE_TTL
+)
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(payload: bytes, prompt: str, model_name: str, output_model: Type[BaseModel]) -> str:
+    """Content address of one extraction: uploaded bytes + prompt + model + output schema."""
+    digest = hashlib.sha256()
+    for part in (prompt, model_name, f"{output_model.__module__}.{output_model.__qualname__}"):
+        encoded = part.encode("utf-8")
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    digest.update(payload)
+    return digest.hexdigest()
+
+
+class CacheBackend:
+    """Storage interface for `ResultCache`. Values are opaque bytes.
+
+    Shared backends (e.g. Redis) only need to implement `get` and `set`, honouring the TTL.
+    """
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """In-process LRU bounded by entry count and total bytes, with per-entry expiry."""
+
+    def __init__(self, max_entries: int = RESULT_CACHE_MAX_ENTRIES, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._size = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.time():
+            self._pop(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        self._pop(key)
+        self._entries[key] = (time.time() + ttl, value)
+        self._size += len(value)
+        while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Host-wide cache shared by every uvicorn worker through one SQLite file."""
+
+    def __init__(self,
+                 path: str = RESULT_CACHE_PATH,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)")
+
+    def _get(self, key: str) -> Optional[bytes]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM results WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now + ttl, now)
+            )
+            self._conn.execute("DELETE FROM results WHERE expires_at <= ?", (now,))
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            if count <= self.max_entries and size <= self.max_bytes:
+                return
+            # Evict least recently used rows until both limits hold again
+            victims = []
+            for victim, victim_size in self._conn.execute("SELECT key, size FROM results ORDER BY accessed_at"):
+                if count <= self.max_entries and size <= self.max_bytes:
+                    break
+                victims.append((victim,))
+                count -= 1
+                size -= victim_size
+            self._conn.executemany("DELETE FROM results WHERE key = ?", victims)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: float):
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+
+class ResultCache:
+    """Caches validated `LLM.generate` results so re-uploads of the same card skip the model call."""
+
+    def __init__(self, backend: CacheBackend, ttl: float = RESULT_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    async def get(self, key: str, output_model: Type[BaseModel]) -> Optional[dict]:
+        try:
+            raw = await self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"[CACHE] Lookup failed: {e}")
+            return None
+        if raw is None:
+            return None
+
+        try:
+            entry = json.loads(raw)
+            stored = entry["result"]
+            if isinstance(stored, list):
+                result = [output_model(**item) for item in stored]
+            else:
+                result = output_model(**stored)
+        except Exception as e:
+            logger.warning(f"[CACHE] Dropping unreadable entry {key[:12]}: {e}")
+            return None
+
+        now = time.time()
+        # A hit costs no upstream call; the original call was already accounted when it was made
+        pv = {
+            "total_api_calls": 0,
+            "attempts": [],
+            "total_input_tokens": 0,
+            "total_output_tokens": 0,
+            "keys_used": [],
+            "start_time": now,
+            "duration_total": 0.0,
+            "cache_hit": True,
+        }
+        logger.info(f"[CACHE] Hit {key[:12]} (cached {now - entry['cached_at']:.0f}s ago)")
+        return {"pv": pv, "result": result}
+
+    async def set(self, key: str, result_with_pv: dict):
+        result = result_with_pv["result"]
+        if isinstance(result, list):
+            stored = [item.model_dump() for item in result]
+        else:
+            stored = result.model_dump()
+        raw = json.dumps({"result": stored, "cached_at": time.time()}, ensure_ascii=False).encode("utf-8")
+        try:
+            await self.backend.set(key, raw, self.ttl)
+        except Exception as e:
+            logger.warning(f"[CACHE] Store failed: {e}")
+
+
+def build_result_cache(backend: str = RESULT_CACHE_BACKEND) -> Optional[ResultCache]:
+    if backend == "none":
+        return None
+    if backend == "memory":
+        return ResultCache(MemoryCacheBackend())
+    if backend == "sqlite":
+        return ResultCache(SQLiteCacheBackend())
+    raise RuntimeError(f"Configuration error: unknown result cache backend '{backend}'")
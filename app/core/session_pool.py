@@ -0,0 +1,72 @@
+import logging
+import threading
+from typing import Dict
+
+import google.generativeai as genai
+from google.ai import generativelanguage as glm
+
+from config import MAX_OUTPUT_TOKENS
+from core.api_key_manager import key_id
+
+logger = logging.getLogger(__name__)
+
+
+class SessionPool:
+    """Per-key cache of configured Gemini sessions.
+
+    Each session owns a service client bound to its key through `client_options`,
+    so no global `genai.configure` is needed and calls on different keys never
+    share state or serialize on a lock.
+    """
+
+    def __init__(self, model_name: str, max_output_tokens: int = MAX_OUTPUT_TOKENS):
+        self.model_name = model_name
+        self.generation_config = genai.types.GenerationConfig(
+            candidate_count=1,
+            max_output_tokens=max_output_tokens,
+        )
+        self._sessions: Dict[str, genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+
+    def _build_session(self, key: str) -> genai.GenerativeModel:
+        model = genai.GenerativeModel(
+            model_name=self.model_name,
+            generation_config=self.generation_config
+        )
+        # GenerativeModel falls back to the process-wide default client when `_client` is unset
+        model._client = glm.GenerativeServiceClient(client_options={"api_key": key})
+        return model
+
+    def get(self, key: str) -> genai.GenerativeModel:
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._build_session(key)
+                    self._sessions[key] = session
+                    logger.info(f"[SESSION] Built session for key {key_id(key)}")
+        return session
+
+    def get_async(self, key: str) -> genai.GenerativeModel:
+        """Same session as `get`, with its async client attached.
+
+        The gRPC asyncio channel binds to the running event loop, so it is
+        created on first use from inside the loop rather than in `_build_session`.
+        """
+        session = self.get(key)
+        if session._async_client is None:
+            session._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": key})
+        return session
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if self._sessions.pop(key, None) is not None:
+                logger.info(f"[SESSION] Dropped session for key {key_id(key)}")
+
+    def on_key_event(self, event: str, key: str):
+        # Sessions are rebuilt lazily on next use, so both additions and removals just drop the entry
+        self.invalidate(key)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
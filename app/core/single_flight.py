@@ -0,0 +1,42 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls sharing a key into one execution.
+
+    The first caller (the leader) starts the work; callers arriving while it is
+    still running await the same task instead of starting their own. The task is
+    shielded, so a leader whose request gets cancelled does not fail the others.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Return `(result, shared)`, where `shared` is True for callers that joined an existing call."""
+        task = self._in_flight.get(key)
+        if task is not None:
+            logger.info(f"[COALESCE] Joining in-flight call {key[:12]}")
+            return await asyncio.shield(task), True
+
+        task = asyncio.ensure_future(fn())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task), False
+
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        # Mark the outcome as retrieved even if every waiter was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._in_flight
+
+    def __len__(self) -> int:
+        return len(self._in_flight)
@@ -0,0 +1,41 @@
+"""
+Generation config for structured output.
+
+The model answers with bare JSON (response_mime_type application/json) instead of a
+fenced block inside prose, and where the output model fits Gemini's response schema
+subset it is also held to the model's fields and types. Validators (character sets,
+formats) are still enforced by pydantic when the answer is parsed.
+"""
+import logging
+from functools import lru_cache
+from typing import Type
+
+import google.generativeai as genai
+from google.generativeai.types import generation_types
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+JSON_MIME_TYPE = "application/json"
+
+
+@lru_cache(maxsize=None)
+def response_config(output_model: Type[BaseModel], many: bool = False, schema: bool = True) -> dict:
+    """
+    Per-call generation config, merged by the SDK over the session's own. `many` asks for a
+    list of `output_model`. The schema is converted once here rather than on every call;
+    models it cannot express (free-form dicts, defaults) get JSON mode without a schema.
+    """
+    config = {"response_mime_type": JSON_MIME_TYPE}
+    if not schema:
+        return config
+    try:
+        converted = generation_types.to_generation_config_dict(genai.types.GenerationConfig(
+            response_mime_type=JSON_MIME_TYPE,
+            response_schema=list[output_model] if many else output_model,
+        ))
+    except (TypeError, ValueError) as e:
+        logger.warning(f"[STRUCTURED] No response schema for {output_model.__name__}, JSON mode only: {e}")
+        return config
+    config["response_schema"] = converted["response_schema"]
+    return config
@@ -0,0 +1,113 @@
+import asyncio
+import json
+import logging
+from collections import defaultdict
+from typing import List, Optional
+
+from config import PROMPT_TRANSCRIPTION, VALIDATION_MAX_RETRIES
+from core.batch_planner import AdaptiveBatcher
+from core.llm_client import LLM
+from exceptions.llm_exceptions import TruncatedResponseError, ValidationRetryError
+from models.id_card import TunisianIDCardData
+from utils.prompt_utils import finalize_merged_pv, merge_pv, new_merged_pv
+
+logger = logging.getLogger(__name__)
+
+
+def match_by_id_number(batch: List[dict], items: List[TunisianIDCardData]) -> List[Optional[TunisianIDCardData]]:
+    """
+    Align returned items with the input records by idNumber; unmatched records get None.
+    When the answer has one item per record, an item whose idNumber was reformatted by the
+    model still fills its own position.
+    """
+    by_id = defaultdict(list)
+    for item in items:
+        by_id[item.idNumber.strip()].append(item)
+    matched = []
+    for record in batch:
+        candidates = by_id.get(str(record.get("idNumber", "")).strip())
+        matched.append(candidates.pop(0) if candidates else None)
+
+    if len(items) == len(batch):
+        used = {id(item) for item in matched if item is not None}
+        for index, item in enumerate(items):
+            if matched[index] is None and id(item) not in used:
+                matched[index] = item
+    return matched
+
+
+def _merge(pvs: List[dict]) -> dict:
+    merged_pv = new_merged_pv()
+    merged_pv["start_time"] = pvs[0]["start_time"]
+    for pv in pvs:
+        merge_pv(merged_pv, pv)
+    return finalize_merged_pv(merged_pv)
+
+
+def _spent(error: Exception, pvs: List[dict]) -> Exception:
+    """`error` with the calls already made for the batch added to its own PV."""
+    pvs = pvs + ([error.pv] if getattr(error, "pv", None) else [])
+    if pvs:
+        error.pv = _merge(pvs)
+    return error
+
+
+async def transcribe_batch(llm: LLM,
+                           batch: List[dict],
+                           batcher: Optional[AdaptiveBatcher] = None,
+                           salvage_rounds: int = VALIDATION_MAX_RETRIES) -> dict:
+    """
+    Transcribe one batch of records; returns `{"pv": ..., "result": [TunisianIDCardData, ...]}`
+    in input order.
+    - Items are validated one by one; records whose item is invalid or missing are re-sent
+      on their own in a follow-up call, up to `salvage_rounds` times.
+    - A batch whose answer is truncated is split in half and each half retried, down to
+      single records.
+    Failed and truncated calls stay in the PV; when the batch fails, the exception's `pv`
+    holds every call made for it.
+    """
+    prompt = PROMPT_TRANSCRIPTION + json.dumps(batch, ensure_ascii=False, indent=2)
+    try:
+        response_with_pv = await llm.generate([prompt], output_model=TunisianIDCardData, allow_partial=True)
+    except TruncatedResponseError as e:
+        if batcher is not None and e.pv is not None:
+            batcher.observe(e.pv)
+        if len(batch) == 1:
+            raise
+        middle = len(batch) // 2
+        logger.warning(f"[TRANSCRIPTION] {len(batch)} record(s) truncated, retrying as {middle} + {len(batch) - middle}")
+        halves = await asyncio.gather(
+            transcribe_batch(llm, batch[:middle], batcher, salvage_rounds),
+            transcribe_batch(llm, batch[middle:], batcher, salvage_rounds),
+            return_exceptions=True,
+        )
+        pvs = ([e.pv] if e.pv else []) + [half["pv"] for half in halves if isinstance(half, dict)]
+        errors = [half for half in halves if isinstance(half, BaseException)]
+        if errors:
+            # Both halves ran to the end, so the calls of either one are kept
+            pvs += [error.pv for error in errors[1:] if getattr(error, "pv", None)]
+            raise _spent(errors[0], pvs)
+        return {"pv": _merge(pvs), "result": halves[0]["result"] + halves[1]["result"]}
+
+    if batcher is not None:
+        batcher.observe(response_with_pv["pv"])
+    parsed = response_with_pv["result"]
+    matched = match_by_id_number(batch, parsed if isinstance(parsed, list) else [parsed])
+    missing = [record for record, item in zip(batch, matched) if item is None]
+    if not missing:
+        return {"pv": response_with_pv["pv"], "result": matched}
+
+    ids = ", ".join(str(record.get("idNumber")) for record in missing[:5])
+    if salvage_rounds <= 0:
+        raise ValidationRetryError(f"{len(missing)} record(s) failed validation (idNumber {ids})",
+                                   pv=response_with_pv["pv"])
+    logger.warning(f"[TRANSCRIPTION] Kept {len(batch) - len(missing)} of {len(batch)} record(s), "
+                   f"re-sending {len(missing)} (idNumber {ids})")
+    try:
+        follow_up = await transcribe_batch(llm, missing, batcher, salvage_rounds - 1)
+    except Exception as e:
+        raise _spent(e, [response_with_pv["pv"]])
+
+    recovered = iter(follow_up["result"])
+    result = [item if item is not None else next(recovered) for item in matched]
+    return {"pv": _merge([response_with_pv["pv"], follow_up["pv"]]), "result": result}
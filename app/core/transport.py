@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, List, Optional, Union
+
+from PIL import Image
+
+from config import PROMPT_TRANSCRIPTION, PROMPT_TUNISIAN_ID_BACK, PROMPT_TUNISIAN_ID_CARD, PROMPT_TUNISIAN_ID_FRONT
+from core.api_key_manager import key_id
+from core.session_pool import SessionPool
+
+logger = logging.getLogger(__name__)
+
+
+class ThreadTransport:
+    """Runs the blocking `generate_content` call on the default thread pool."""
+
+    name = "thread"
+
+    def __init__(self, sessions: SessionPool):
+        self.sessions = sessions
+
+    async def generate(self,
+                       key: str,
+                       prompt: Union[str, List[Union[str, Image.Image, dict]]],
+                       generation_config: Optional[dict] = None) -> Any:
+        session = self.sessions.get(key)
+        return await asyncio.to_thread(session.generate_content, prompt, generation_config=generation_config)
+
+
+class AsyncTransport:
+    """Uses the SDK's native `generate_content_async`, so an in-flight call holds no OS thread."""
+
+    name = "async"
+
+    def __init__(self, sessions: SessionPool):
+        self.sessions = sessions
+
+    async def generate(self,
+                       key: str,
+                       prompt: Union[str, List[Union[str, Image.Image, dict]]],
+                       generation_config: Optional[dict] = None) -> Any:
+        session = self.sessions.get_async(key)
+        return await session.generate_content_async(prompt, generation_config=generation_config)
+
+
+# Prompt kind -> (output model name, list answer); recordings carry them for replay and parsing benchmarks
+PROMPT_KINDS = {
+    "front": ("TunisianIDCardFront", False),
+    "back": ("TunisianIDCardBack", False),
+    "card": ("TunisianIDCardPair", False),
+    "transcript": ("TunisianIDCardData", True),
+}
+
+
+def prompt_kind(prompt: Union[str, List[Any]]) -> str:
+    """front, back, card, transcript or other, from the instruction text of the prompt."""
+    text = prompt if isinstance(prompt, str) else next((p for p in prompt if isinstance(p, str)), "")
+    if text == PROMPT_TUNISIAN_ID_FRONT:
+        return "front"
+    if text == PROMPT_TUNISIAN_ID_BACK:
+        return "back"
+    if text == PROMPT_TUNISIAN_ID_CARD:
+        return "card"
+    if text.startswith(PROMPT_TRANSCRIPTION):
+        return "transcript"
+    return "other"
+
+
+def prompt_id(prompt: Union[str, List[Any]]) -> str:
+    """Digest of the text and inline image bytes of a prompt, to replay an answer for the same input."""
+    digest = hashlib.blake2b(digest_size=12)
+    for part in ([prompt] if isinstance(prompt, str) else prompt):
+        if isinstance(part, str):
+            digest.update(b"s" + part.encode("utf-8"))
+        elif isinstance(part, dict) and "data" in part:
+            digest.update(b"b" + part["data"])
+        elif isinstance(part, Image.Image):
+            digest.update(b"i" + part.tobytes())
+    return digest.hexdigest()
+
+
+class RecordingTransport:
+    """
+    Wraps another transport and appends every call to a JSONL file: prompt kind and id, the
+    answer text (or the error), its duration and finish reason. `benchmarks.fake_gemini`
+    replays it offline; `benchmarks.structured_output --responses` reads the same file.
+    """
+
+    def __init__(self, inner, path: str):
+        self.inner = inner
+        self.name = f"{inner.name}+record"
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    async def generate(self,
+                       key: str,
+                       prompt: Union[str, List[Union[str, Image.Image, dict]]],
+                       generation_config: Optional[dict] = None) -> Any:
+        kind = prompt_kind(prompt)
+        output_model, many = PROMPT_KINDS.get(kind, (None, False))
+        entry = {"ts": time.time(), "kind": kind, "prompt_id": prompt_id(prompt), "output_model": output_model,
+                 "many": many, "structured": bool(generation_config), "key": key_id(key)}
+        start = time.perf_counter()
+        try:
+            response = await self.inner.generate(key, prompt, generation_config)
+        except Exception as e:
+            entry.update(duration=time.perf_counter() - start, error=type(e).__name__, error_msg=str(e))
+            self._write(entry)
+            raise
+        candidates = getattr(response, "candidates", None)
+        reason = getattr(candidates[0], "finish_reason", None) if candidates else None
+        entry.update(duration=time.perf_counter() - start, text=getattr(response, "text", None),
+                     finish_reason=getattr(reason, "name", reason))
+        self._write(entry)
+        return response
+
+    def _write(self, entry: dict):
+        try:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+        except Exception as e:
+            logger.warning(f"[RECORD] Could not record a call: {e}")
+
+
+TRANSPORTS = {
+    ThreadTransport.name: ThreadTransport,
+    AsyncTransport.name: AsyncTransport,
+}
+
+
+def build_transport(name: str, sessions: SessionPool, record_path: str = ""):
+    try:
+        transport_cls = TRANSPORTS[name]
+    except KeyError:
+        raise RuntimeError(f"Configuration error: unknown LLM transport '{name}'")
+    logger.info(f"[TRANSPORT] Using {name} transport")
+    transport = transport_cls(sessions)
+    if record_path:
+        logger.warning(f"[TRANSPORT] Recording model answers to {record_path}")
+        transport = RecordingTransport(transport, record_path)
+    return transport
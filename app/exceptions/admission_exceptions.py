@@ -0,0 +1,6 @@
+class AdmissionRejectedError(Exception):
+    """Raised when a request is shed instead of queued; mapped to `status_code` with a Retry-After header."""
+    def __init__(self, message: str, status_code: int, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
@@ -0,0 +1,14 @@
+class ImageTooLargeError(Exception):
+    """Raised when an upload exceeds the byte or pixel limits."""
+    pass
+
+class UnsupportedImageError(Exception):
+    """Raised when an upload cannot be decoded as an image."""
+    pass
+
+class InvalidIDCardError(Exception):
+    """Raised when an upload is not a usable card: rejected by the pre-screen, or reported invalid by the model."""
+    def __init__(self, message: str, reason: str = "model", pv: dict = None):
+        super().__init__(message)
+        self.reason = reason
+        self.pv = pv
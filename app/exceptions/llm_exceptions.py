@@ -3,5 +3,11 @@ class NoResponseError(Exception):
     pass
 
 class ValidationRetryError(Exception):
-    """Raised after exceeding validation retries for LLM response."""
+    """Raised after exceeding validation retries for LLM response; `pv` holds the calls spent on it."""
+    def __init__(self, message: str, pv: dict = None):
+        super().__init__(message)
+        self.pv = pv
+
+class TruncatedResponseError(ValidationRetryError):
+    """Raised when the LLM stops at max_output_tokens; retrying the same prompt would stop there again."""
     pass
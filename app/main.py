@@ -1,34 +1,86 @@
-import os
+import asyncio
 import logging
+import math
+import time
+import uuid
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from slowapi.errors import RateLimitExceeded
 from slowapi import _rate_limit_exceeded_handler
+from api import key_state_sync, limiter
+from api.jobs import job_worker
 from api.router import router
-from config import HOST, LOGS_PATH, PORT
-
-os.makedirs(os.path.dirname(LOGS_PATH), exist_ok=True)
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    handlers=[
-        logging.FileHandler(LOGS_PATH),
-        logging.StreamHandler()
-    ]
-)
+from core.audit_log import audit_log
+from core.extraction import image_preprocessor
+from core.metrics import registry
+from config import HOST, PORT
+from exceptions.admission_exceptions import AdmissionRejectedError
+from utils.logging_utils import request_id_var, setup_logging
+from utils.upload_utils import RequestSizeLimitMiddleware
+
+log_listener = setup_logging()
+access_logger = logging.getLogger("api.access")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await image_preprocessor.start()
+    await job_worker.start()
+    await registry.start()
+    await audit_log.start()
+    if key_state_sync is not None:
+        await key_state_sync.start()
+    yield
+    if key_state_sync is not None:
+        await key_state_sync.stop()
+    await job_worker.stop()
+    await image_preprocessor.stop()
+    await audit_log.stop()
+    await registry.stop()
+    log_listener.stop()
 
 app = FastAPI(
     docs_url=None,
     redoc_url=None,
     openapi_url=None,
+    lifespan=lifespan,
 )
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+app.state.limiter = limiter
+
+async def rate_limit_exceeded(request: Request, exc: RateLimitExceeded):
+    response = _rate_limit_exceeded_handler(request, exc)
+    response.headers["Retry-After"] = str(exc.limit.limit.get_expiry())
+    return response
+
+async def admission_rejected(request: Request, exc: AdmissionRejectedError):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))},
+    )
+
+app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded)
+app.add_exception_handler(AdmissionRejectedError, admission_rejected)
+
+# Added before the logging middleware so it runs inside it: early 413s still get logged and a request id
+app.add_middleware(RequestSizeLimitMiddleware)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logging.info(f"Incoming request: {request.method} {request.url}")
-    response = await call_next(request)
-    logging.info(f"Response status: {response.status_code}")
-    return response
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex[:16]
+    token = request_id_var.set(request_id)
+    start = time.perf_counter()
+    try:
+        access_logger.info(f"Incoming request: {request.method} {request.url}")
+        response = await call_next(request)
+        latency_ms = round((time.perf_counter() - start) * 1000, 1)
+        access_logger.info(f"Response status: {response.status_code}", extra={
+            "method": request.method, "path": request.url.path, "status": response.status_code, "latency_ms": latency_ms
+        })
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
 
 # Routes
 app.include_router(router)
@@ -38,6 +90,13 @@ app.include_router(router)
 def health():
     return {"status": "ok"}
 
+# Prometheus scrape target, merged across uvicorn workers
+@app.get("/metrics")
+async def metrics():
+    gauges = registry.collect_gauges()
+    body = await asyncio.to_thread(registry.render, gauges)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host=HOST, port=PORT)
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, field_validator
 import re
 import regex as re
@@ -67,6 +67,12 @@ class TunisianIDCardBack(BaseModel):
         return value
 
 
+class TunisianIDCardPair(BaseModel):
+    """Raw output of the combined front+back call; each half is validated on its own."""
+    front: Optional[Dict[str, Any]] = None
+    back: Optional[Dict[str, Any]] = None
+
+
 class FrontResponse(BaseModel):
     data: TunisianIDCardFront
     audit: FullPromptValue
@@ -75,6 +81,11 @@ class BackResponse(BaseModel):
     data: TunisianIDCardBack
     audit: FullPromptValue
 
+class CardResponse(BaseModel):
+    front: TunisianIDCardFront
+    back: TunisianIDCardBack
+    audit: FullPromptValue
+
 class TranscriptResponse(BaseModel):
     results: List[TunisianIDCardData]
     pv: FullPromptValue
\ No newline at end of file
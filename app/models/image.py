@@ -0,0 +1,25 @@
+# models/image.py
+
+from dataclasses import dataclass
+from typing import Tuple
+
+
+@dataclass(frozen=True)
+class EncodedImage:
+    """
+    An image as it is sent upstream: encoded bytes with their MIME type, and the pixel size
+    the input tokens are billed on. Sent as inline data, so the SDK does not re-encode it
+    (a PIL image is converted to lossless WebP on every call, on the event loop).
+    """
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+    reencoded: bool = True  # False when the upload bytes are forwarded unchanged
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.width, self.height
+
+    def as_blob(self) -> dict:
+        return {"mime_type": self.mime_type, "data": self.data}
@@ -0,0 +1,30 @@
+from typing import List, Literal, Optional
+from pydantic import BaseModel
+
+from models.id_card import TunisianIDCardData
+from models.pv import FullPromptValue
+
+
+class JobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    total_batches: int
+    total_items: int
+
+class JobBatchError(BaseModel):
+    batch_index: int
+    error: Optional[str]
+    attempts: int
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: Literal["queued", "running", "completed", "failed"]
+    total_batches: int
+    total_items: int
+    done_batches: int
+    failed_batches: int
+    created_at: float
+    updated_at: float
+    errors: List[JobBatchError]
+    results: Optional[List[TunisianIDCardData]] = None
+    pv: Optional[FullPromptValue] = None
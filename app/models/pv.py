@@ -6,12 +6,13 @@ from pydantic import BaseModel
 class AttemptInfo(BaseModel):
     timestamp: float
     key: Optional[str]
-    status: Optional[Literal["success", "validation_error", "resource_exhausted", "system_error"]]
+    status: Optional[Literal["success", "partial", "validation_error", "resource_exhausted", "system_error", "cancelled"]]
     input_tokens: int
     output_tokens: int
     error_type: Optional[str]
     error_msg: Optional[str]
     duration: Optional[float]
+    hedged: bool = False  # second attempt sent while the first was still running
 
 class FullPromptValue(BaseModel):
     total_api_calls: int
@@ -19,5 +20,9 @@ class FullPromptValue(BaseModel):
     total_output_tokens: int
     attempts: List[AttemptInfo]
     keys_used: List[str]
+    image_bytes: int = 0  # encoded image bytes sent upstream, summed over the API calls
     start_time: float
     duration_total: Optional[float]
+    cache_hit: bool = False
+    cache_hit_sides: List[str] = []  # /card: the sides served from the result cache
+    coalesced: bool = False
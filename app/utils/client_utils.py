@@ -1,7 +1,9 @@
 from typing import Union, List
 from PIL import Image
 
-def calculate_image_tokens(image: Image.Image) -> int:
+from models.image import EncodedImage
+
+def calculate_image_tokens(image: Union[Image.Image, EncodedImage]) -> int:
     width, height = image.size
     if width <= 384 and height <= 384:
         return 258
@@ -13,7 +15,7 @@ def calculate_text_tokens(text: str) -> int:
     # Rough estimation: average 1.33 tokens per word 
     return int(len(text.split()) * 1.33)
 
-def calculate_input_tokens(prompt: Union[str, List[Union[str, Image.Image]]]) -> float:
+def calculate_input_tokens(prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]]) -> float:
     total_tokens = 0
     if isinstance(prompt, str):
         total_tokens += calculate_text_tokens(prompt)
@@ -21,10 +23,16 @@ def calculate_input_tokens(prompt: Union[str, List[Union[str, Image.Image]]]) ->
         for item in prompt:
             if isinstance(item, str):
                 total_tokens += calculate_text_tokens(item)
-            elif isinstance(item, Image.Image):
+            elif isinstance(item, (Image.Image, EncodedImage)):
                 total_tokens += calculate_image_tokens(item)
     return float(total_tokens)
 
+def calculate_image_bytes(prompt: Union[str, List[Union[str, Image.Image, EncodedImage]]]) -> int:
+    # Encoded images only; a PIL image's size is only known once the SDK has converted it
+    if isinstance(prompt, list):
+        return sum(len(item.data) for item in prompt if isinstance(item, EncodedImage))
+    return 0
+
 def calculate_output_tokens(text: str) -> float:
     # Output is text only
     return float(calculate_text_tokens(text))
@@ -0,0 +1,136 @@
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, Optional, TextIO
+
+from config import (
+    LOG_BACKUP_COUNT, LOG_FORMAT, LOG_LEVEL, LOG_MAX_BYTES, LOG_QUEUE_SIZE, LOG_SAMPLING, LOGS_PATH
+)
+from core.metrics import LOG_RECORDS_DROPPED
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+# Set by the request middleware (and the job worker) so every line can be tied to its request
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+class RequestContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a share of the INFO/DEBUG records of the configured loggers (longest prefix wins);
+    warnings and errors always pass. Records carrying a request id are sampled per request,
+    so a kept request keeps all of its lines.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            prefix = max((p for p in self.rates if name == p or name.startswith(p + ".")), key=len, default=None)
+            rate = self._resolved[name] = self.rates[prefix] if prefix is not None else 1.0
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate >= 1.0:
+            return True
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            return zlib.crc32(request_id.encode("utf-8")) % 10000 < rate * 10000
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, msg, request_id and any `extra=` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            payload["request_id"] = record.request_id
+        for name, value in record.__dict__.items():
+            if name not in _RECORD_ATTRS and not name.startswith("_"):
+                payload[name] = value
+        if record.exc_info:
+            payload["exc"] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that never blocks the caller: records are dropped (and counted) when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only this handler sees the record, so it is finished in place instead of formatted and copied;
+        # the listener thread does the actual formatting
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging(path: str = LOGS_PATH,
+                  level: str = LOG_LEVEL,
+                  file_format: str = LOG_FORMAT,
+                  sampling: Optional[Dict[str, float]] = None,
+                  console: Optional[TextIO] = sys.stderr) -> QueueListener:
+    """
+    Route every log record through a bounded in-memory queue; a listener thread does the
+    formatting and the disk/console writes. Returns the started listener (stop it on shutdown).
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    file_handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter() if file_format == "json" else logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler]
+    if console is not None:
+        console_handler = logging.StreamHandler(console)
+        console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(console_handler)
+
+    log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLING if sampling is None else sampling))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -2,8 +2,7 @@ import json
 import re
 from typing import List, Optional, Union
 from PIL import Image
-import os
-from datetime import datetime
+import time
 
 
 def resize_id_card_image(img: Image.Image, MAX_WIDTH = 768, MAX_HEIGHT = 512) -> Image.Image:
@@ -20,45 +19,78 @@ def contains_arabic(text: str) -> bool:
     arabic_char_pattern = re.compile(r'[\u0600-\u06FF]')
     return bool(arabic_char_pattern.search(text))
 
+_FENCE = re.compile(r'```[ \t]*(?:json)?[ \t]*\n?([\s\S]*?)```', re.IGNORECASE)
+_DECODER = json.JSONDecoder()
+MAX_JSON_CANDIDATES = 32  # opening brackets tried before giving up on a prose answer
+
+
 def extract_json_from_response(text: str) -> Union[dict, List[dict]]:
     """
-    Extracts a JSON object or list of objects from an LLM response.
-    The JSON content should be wrapped between ```json ... ```.
+    Extracts a JSON object or list of objects from an LLM response: a ```json fenced block
+    (any case, or no language tag), bare JSON as returned in structured output mode, or
+    JSON with prose around it or a fence that was never closed.
 
     Returns:
         A dictionary or a list of dictionaries parsed from the JSON.
-        Returns an empty list if no valid JSON is found.
+        Returns an empty list if no valid JSON is found (a JSON string or number is not an answer).
     """
-    match = re.search(r'```json\s*([\s\S]*?)\s*```', text, re.DOTALL)
-    if not match:
-        return []
+    for match in _FENCE.finditer(text):
+        try:
+            parsed = json.loads(match.group(1))
+        except json.JSONDecodeError:
+            continue
+        if isinstance(parsed, (dict, list)):
+            return parsed
 
-    try:
-        return json.loads(match.group(1))
-    except json.JSONDecodeError:
-        return []
+    # Single left-to-right scan: try each opening bracket, the first complete value wins.
+    # A failed candidate resumes after the point where it broke, so the brackets nested
+    # in a broken (or truncated) answer are never mistaken for the answer itself
+    index, tried = 0, 0
+    while tried < MAX_JSON_CANDIDATES:
+        starts = [i for i in (text.find("{", index), text.find("[", index)) if i >= 0]
+        if not starts:
+            break
+        index = min(starts)
+        tried += 1
+        try:
+            parsed, _ = _DECODER.raw_decode(text, index)
+        except json.JSONDecodeError as e:
+            index = max(e.pos, index + 1)
+            continue
+        if isinstance(parsed, (dict, list)):
+            return parsed
+        index += 1
+    return []
 
 def split_batches(data: List[dict], batch_size: int) -> List[List[dict]]:
     return [data[i:i + batch_size] for i in range(0, len(data), batch_size)]
 
-def is_invalid_id_card_message(text: str) -> bool:
-    return bool(re.search(r'invalid.*id\s*card', text, re.IGNORECASE))
+def new_merged_pv() -> dict:
+    """Empty accumulator for combining the PVs of several `LLM.generate` calls."""
+    return {
+        "total_api_calls": 0,
+        "total_input_tokens": 0,
+        "total_output_tokens": 0,
+        "attempts": [],
+        "keys_used": set(),
+        "image_bytes": 0,
+        "start_time": time.time(),
+    }
 
+def merge_pv(merged_pv: dict, pv: dict) -> dict:
+    merged_pv["total_api_calls"] += pv.get("total_api_calls", 0)
+    merged_pv["total_input_tokens"] += pv.get("total_input_tokens", 0)
+    merged_pv["total_output_tokens"] += pv.get("total_output_tokens", 0)
+    merged_pv["attempts"].extend(pv.get("attempts", []))
+    merged_pv["keys_used"].update(pv.get("keys_used", []))
+    merged_pv["image_bytes"] += pv.get("image_bytes", 0)
+    return merged_pv
 
-def save_pv(indicator: str, pv: dict, save_dir: str = "logs/pv"):
-    os.makedirs(save_dir, exist_ok=True)
-    
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{indicator}.json"
-    path = os.path.join(save_dir, filename)
+def finalize_merged_pv(merged_pv: dict) -> dict:
+    merged_pv["keys_used"] = list(merged_pv["keys_used"])
+    merged_pv["duration_total"] = time.time() - merged_pv["start_time"]
+    return merged_pv
 
-    data = {
-        "timestamp": datetime.utcnow().isoformat() + "Z",
-        "indicator": indicator,
-        "pv": pv
-    }
+def is_invalid_id_card_message(text: str) -> bool:
+    return bool(re.search(r'invalid.*id\s*card', text, re.IGNORECASE))
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-    
-    return path
@@ -0,0 +1,95 @@
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import UploadFile
+
+from config import MAX_IMAGE_BYTES, MAX_REQUEST_BYTES, MAX_REQUEST_BYTES_BY_PATH, UPLOAD_IMAGE_TYPES
+from core.metrics import UPLOADS_REJECTED
+from exceptions.image_exceptions import ImageTooLargeError, UnsupportedImageError
+
+SNIFF_BYTES = 16
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Mime type from the magic bytes at the start of a file, or None when it is not a known image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if head[:2] == b"BM":
+        return "image/bmp"
+    if head[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return None
+
+
+def check_image_type(head: bytes, allowed=UPLOAD_IMAGE_TYPES) -> str:
+    mime = sniff_image_type(head)
+    if mime not in allowed:
+        UPLOADS_REJECTED.inc(reason="unsupported_type")
+        raise UnsupportedImageError(f"Unsupported image type {mime or 'unknown'}, expected {', '.join(allowed)}")
+    return mime
+
+
+async def read_image_upload(upload: UploadFile, max_bytes: int = MAX_IMAGE_BYTES) -> bytes:
+    """
+    Read an uploaded image with a byte cap. Starlette has already spooled the part (to disk
+    past 1 MB); the size and the magic bytes are checked before the body is loaded, and the
+    body is then read in a single bounded call so it exists in memory exactly once.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        UPLOADS_REJECTED.inc(reason="image_too_large")
+        raise ImageTooLargeError(f"{upload.size} bytes exceeds {max_bytes}")
+    check_image_type(await upload.read(SNIFF_BYTES))
+    await upload.seek(0)
+    raw = await upload.read(max_bytes + 1)
+    if len(raw) > max_bytes:
+        UPLOADS_REJECTED.inc(reason="image_too_large")
+        raise ImageTooLargeError(f"more than {max_bytes} bytes")
+    return raw
+
+
+class RequestSizeLimitMiddleware:
+    """
+    Caps request bodies before the multipart/JSON parsers buffer or spool them: a declared
+    Content-Length over the limit is answered 413 without reading the body, and chunked
+    bodies are counted as they stream in.
+    """
+
+    def __init__(self, app, default: int = MAX_REQUEST_BYTES, by_path: Dict[str, int] = MAX_REQUEST_BYTES_BY_PATH):
+        self.app = app
+        self.default = default
+        self.by_path = by_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        limit = self.by_path.get(scope["path"], self.default)
+        detail = f"Request body exceeds {limit} bytes"
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > limit:
+            UPLOADS_REJECTED.inc(reason="request_too_large")
+            return await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    UPLOADS_REJECTED.inc(reason="request_too_large")
+                    # FastAPI re-raises HTTPExceptions from the body parser as they are
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)